@@ -0,0 +1,44 @@
+import argparse
+import sys
+import os
+
+module_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if module_path not in sys.path:
+    sys.path.append(module_path)
+
+from src.Benchmark import Benchmark, BENCHMARK_SCENARIOS, BENCHMARK_TOLERANCE, MIN_FAST_SPEEDUP
+from src.Simulator import ENGINE_FAST, ENGINE_SIMPY
+
+parser = argparse.ArgumentParser(description='benchmark the junction simulation and compare against a baseline')
+parser.add_argument('--scenarios', nargs='+', default=list(BENCHMARK_SCENARIOS), choices=list(BENCHMARK_SCENARIOS))
+parser.add_argument('--engines', nargs='+', default=[ENGINE_SIMPY, ENGINE_FAST], choices=[ENGINE_SIMPY, ENGINE_FAST])
+parser.add_argument('--run-until', type=float, default=1320)
+parser.add_argument('--repeats', type=int, default=5)
+parser.add_argument('--history', default='benchmark_history.json')
+parser.add_argument('--baseline', default='benchmark_baseline.json')
+parser.add_argument('--tolerance', type=float, default=BENCHMARK_TOLERANCE)
+parser.add_argument('--min-speedup', type=float, default=MIN_FAST_SPEEDUP)
+parser.add_argument('--update-baseline', action='store_true')
+args = parser.parse_args()
+
+record = Benchmark(args.scenarios, args.engines, args.run_until, args.repeats).run()
+Benchmark.append_history(args.history, record)
+
+for case, metrics in record['results'].items():
+    print(f"{case:28} run {metrics['run_seconds']:.3f}s  {metrics['events_per_second']:.0f} events/s  "
+          f"{metrics['simulated_minutes_per_second']:.0f} min/s  peak rss {metrics['peak_rss_bytes'] / 2 ** 20:.0f} MiB")
+
+# the speedup is checked on every run, the baseline comparison only once there is a baseline
+slow = Benchmark.check_speedup(record, args.min_speedup)
+for failure in slow:
+    print(f'too slow {failure}')
+
+if args.update_baseline or not os.path.exists(args.baseline):
+    Benchmark.write_json(args.baseline, record)
+    print(f'baseline written to {args.baseline}')
+    sys.exit(1 if slow else 0)
+
+regressions = Benchmark.compare(record, Benchmark.read_baseline(args.baseline), args.tolerance)
+for regression in regressions:
+    print(f'regression {regression}')
+sys.exit(1 if slow or regressions else 0)
@@ -0,0 +1,215 @@
+import math
+
+import numpy as np
+from src.JunctionLayout import JunctionLayout, FOUR_ROUTE_LAYOUT
+from src.StatisticHelper import StatisticHelper, PH_BLOCK_SIZE
+from typing import Dict, List
+
+BATCH_QUEUE_CAPACITY = 16
+BATCH_BLOCK_SIZE = 16 * PH_BLOCK_SIZE
+
+
+class VectorSampler:
+    # PH samples handed out in arrays from a large block, the order of use does not matter for iid samples.
+    # The fit scales with the mean at a fixed cov, so one unit mean sampler serves all routes
+    def __init__(self, cov: float, rng: np.random.Generator, block_size: int = BATCH_BLOCK_SIZE):
+        self.para_A, self.para_B = StatisticHelper.fit_hypoexponential(1., cov)
+        self.rng = rng
+        self.block_size = block_size
+        self.buffer = np.empty(0)
+        self.position = 0
+
+    def sample_block(self, size: int) -> np.ndarray:
+        samples = self.rng.gamma(self.para_A.k, 1 / self.para_A.rate, size)
+        if self.para_B.k > 0:
+            samples += self.rng.gamma(self.para_B.k, 1 / self.para_B.rate, size)
+        return samples
+
+    def take(self, count: int) -> np.ndarray:
+        if self.position + count > len(self.buffer):
+            self.buffer = np.concatenate((self.buffer[self.position:],
+                                          self.sample_block(max(self.block_size, count))))
+            self.position = 0
+        self.position += count
+        return self.buffer[self.position - count:self.position]
+
+
+class BatchJunctionSim:
+    # R independent replications of the JunctionSim model in lockstep: every step processes the next event
+    # of each replication with array operations. Dispatching is random among the admissible routes like the
+    # event mode scheduler. Only the export_summary statistics over [start, end] are accumulated
+    def __init__(self,
+                 replications: int,
+                 route_arrival_rate: Dict[str, float],
+                 route_service_rate: Dict[str, float],
+                 layout: JunctionLayout = FOUR_ROUTE_LAYOUT,
+                 seed=None,
+                 arrival_cov: float = 0.8,
+                 service_cov: float = 0.3,
+                 start: float = 60,
+                 end: float = 1200,
+                 queue_capacity: int = BATCH_QUEUE_CAPACITY):
+        seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        self.rng = np.random.default_rng(seed_sequence)
+        self.routes = list(layout.routes)
+        self.replications = replications
+        self.start = start
+        self.end = end
+        n = len(self.routes)
+        self.conflict_masks = np.array(layout.get_conflict_masks(self.routes), dtype=np.int64)
+        self.route_bits = np.int64(1) << np.arange(n, dtype=np.int64)
+        self.arrival_means = np.array([1 / route_arrival_rate[r] for r in self.routes])
+        self.service_means = np.array([1 / route_service_rate[r] for r in self.routes])
+        self.arrival_sampler = VectorSampler(arrival_cov, self.rng)
+        self.service_sampler = VectorSampler(service_cov, self.rng)
+
+        self.now = 0.
+        # next arrival per route in the first n columns, end of the current service (inf if free) in the last n
+        self.clocks = np.full((replications, 2 * n), np.inf)
+        self.clocks[:, :n] = self.arrival_means * self.arrival_sampler.take(replications * n).reshape(-1, n)
+        self.flat_clocks = self.clocks.reshape(-1)
+        self.occupied = np.zeros(replications, dtype=np.int64)
+        # per replication and route state is flat with index replication * n + route, so every event touches
+        # single entries; the arrival times of the waiting trains are a ring buffer per replication and route
+        self.queue_lengths = np.zeros(replications * n, dtype=np.int64)
+        self.queue_heads = np.zeros(replications * n, dtype=np.int64)
+        self.queue_capacity = queue_capacity
+        self.arrivals = np.zeros(replications * n * queue_capacity)
+        self.service_starts = np.zeros(replications * n)
+        self.waiting_times = np.zeros(replications * n)
+        self.last_changes = np.zeros(replications * n)
+
+        self.waiting_sums = np.zeros(replications * n)
+        self.waiting_counts = np.zeros(replications * n, dtype=np.int64)
+        self.finished_counts = np.zeros(replications * n, dtype=np.int64)
+        self.reading_sums = np.zeros(replications * n)
+        self.areas = np.zeros(replications * n)
+        self.event_count = 0
+
+    def grow_queues(self):
+        # unroll the ring buffers into twice the capacity
+        capacity = self.queue_capacity
+        arrivals = self.arrivals.reshape(-1, capacity)
+        positions = (self.queue_heads[:, None] + np.arange(capacity)) % capacity
+        grown = np.zeros((len(arrivals), 2 * capacity))
+        grown[:, :capacity] = np.take_along_axis(arrivals, positions, axis=1)
+        self.arrivals = grown.reshape(-1)
+        self.queue_heads[:] = 0
+        self.queue_capacity = 2 * capacity
+
+    def accumulate(self, index: np.ndarray, times: np.ndarray):
+        # the queue lengths at index were constant since their last change, called before every change
+        last = self.last_changes[index]
+        lengths = self.queue_lengths[index]
+        self.areas[index] += lengths * np.maximum(0., np.minimum(times, self.end) - np.maximum(last, self.start))
+        # minute readings at the integers k >= 1 with last <= k < times, inside [start, end]
+        first = np.maximum(np.ceil(last), max(1., math.ceil(self.start)))
+        last_reading = np.minimum(np.ceil(times) - 1, math.floor(self.end))
+        self.reading_sums[index] += lengths * np.maximum(0., last_reading - first + 1)
+        self.last_changes[index] = times
+
+    def start_service(self, rows: np.ndarray, routes: np.ndarray, times: np.ndarray):
+        n = len(self.routes)
+        index = rows * n + routes
+        self.accumulate(index, times)
+        heads = self.queue_heads[index]
+        self.service_starts[index] = times
+        self.waiting_times[index] = times - self.arrivals[index * self.queue_capacity + heads]
+        self.queue_heads[index] = (heads + 1) % self.queue_capacity
+        self.queue_lengths[index] -= 1
+        self.occupied[rows] |= self.route_bits[routes]
+        self.flat_clocks[rows * 2 * n + n + routes] = times + self.service_means[routes] * self.service_sampler.take(
+            len(rows))
+
+    def dispatch(self, rows: np.ndarray, times: np.ndarray):
+        # start admissible waiting trains until none is left, a uniform choice among the admissible routes
+        n = len(self.routes)
+        while len(rows):
+            ready = ((self.queue_lengths.reshape(-1, n)[rows] > 0) &
+                     ((self.occupied[rows, None] & self.conflict_masks) == 0))
+            counts = ready.sum(axis=1)
+            waiting = counts > 0
+            if not waiting.all():
+                rows, times, ready, counts = rows[waiting], times[waiting], ready[waiting], counts[waiting]
+                if not len(rows):
+                    return
+            choice = (self.rng.random(len(rows)) * counts).astype(np.int64)
+            routes = np.argmax(np.cumsum(ready, axis=1) > choice[:, None], axis=1)
+            self.start_service(rows, routes, times)
+            # a start only blocks routes, so only replications with another admissible route can continue
+            again = counts > 1
+            rows, times = rows[again], times[again]
+
+    def run(self, until: float):
+        # can be called repeatedly with growing until, events at until itself are left for the next call
+        n = len(self.routes)
+        rows = np.arange(self.replications)
+        while len(rows):
+            clocks = self.clocks[rows] if len(rows) < self.replications else self.clocks
+            events = np.argmin(clocks, axis=1)
+            times = clocks[np.arange(len(rows)), events]
+            running = times < until
+            if not running.all():
+                rows, events, times = rows[running], events[running], times[running]
+                if not len(rows):
+                    break
+            self.event_count += len(rows)
+
+            arriving = events < n
+            a_rows, a_routes, a_times = rows[arriving], events[arriving], times[arriving]
+            if len(a_rows):
+                index = a_rows * n + a_routes
+                self.accumulate(index, a_times)
+                lengths = self.queue_lengths[index]
+                if lengths.max() + 1 > self.queue_capacity:
+                    self.grow_queues()
+                capacity = self.queue_capacity
+                self.arrivals[index * capacity + (self.queue_heads[index] + lengths) % capacity] = a_times
+                self.queue_lengths[index] = lengths + 1
+                self.flat_clocks[a_rows * 2 * n + a_routes] = (a_times + self.arrival_means[a_routes] *
+                                                               self.arrival_sampler.take(len(a_rows)))
+                # no other route was admissible before, an arrival can only start its own route
+                free = (lengths == 0) & ((self.occupied[a_rows] & self.conflict_masks[a_routes]) == 0)
+                if free.any():
+                    self.start_service(a_rows[free], a_routes[free], a_times[free])
+
+            departing = ~arriving
+            d_rows, d_routes, d_times = rows[departing], events[departing] - n, times[departing]
+            if len(d_rows):
+                index = d_rows * n + d_routes
+                service_starts = self.service_starts[index]
+                recorded = index[(service_starts >= self.start) & (service_starts <= self.end)]
+                self.waiting_sums[recorded] += self.waiting_times[recorded]
+                self.waiting_counts[recorded] += 1
+                self.finished_counts[index] += 1
+                self.occupied[d_rows] &= ~self.route_bits[d_routes]
+                self.flat_clocks[d_rows * 2 * n + n + d_routes] = np.inf
+                self.dispatch(d_rows, d_times)
+
+        self.accumulate(np.arange(self.replications * n), np.full(self.replications * n, float(until)))
+        self.now = until
+
+    def export_summaries(self, additional_data={}) -> List[Dict[str, float]]:
+        # one export_summary dict per replication
+        n = len(self.routes)
+        tail = max(0., self.end - max(self.now, self.start))
+        time_weighted = ((self.areas + self.queue_lengths * tail) / (self.end - self.start)).reshape(-1, n)
+        # the same minute readings in every replication
+        readings = max(0, min(math.floor(self.end), math.ceil(self.now) - 1) - max(1, math.ceil(self.start)) + 1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            queue_lengths = (self.reading_sums / readings).reshape(-1, n)
+            waiting_times = (self.waiting_sums / self.waiting_counts).reshape(-1, n)
+        finished_counts = self.finished_counts.reshape(-1, n)
+
+        summaries = []
+        for k in range(self.replications):
+            data = {'start_at': self.start, 'end_at': self.end}
+            data.update(additional_data)
+            data['replication'] = k
+            for i, r in enumerate(self.routes):
+                data[f'queue_length_{r}'] = float(queue_lengths[k, i])
+                data[f'mean_waiting_time_{r}'] = float(waiting_times[k, i])
+                data[f'time_weighted_queue_length_{r}'] = float(time_weighted[k, i])
+                data[f'finished_trains_{r}'] = int(finished_counts[k, i])
+            summaries.append(data)
+        return summaries
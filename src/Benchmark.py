@@ -0,0 +1,217 @@
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+import simpy
+from src.CorrectnessTests import CorrectnessTests
+from src.JunctionContainer import JunctionContainer, TrainMixContainer
+from src.ScenarioSweep import ScenarioSweep
+from src.Simulator import Simulator, ENGINE_FAST, ENGINE_SIMPY
+from typing import Callable, Dict, List, Sequence
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# trains per hour on the main and on the side branch
+BENCHMARK_SCENARIOS = {'light': 3, 'base': 6, 'near_saturation': 10}
+BENCHMARK_SERVICE_RATE = 0.3
+BENCHMARK_TOLERANCE = 0.25
+# the fast engine's run time against the SimPy engine's on the same scenario, measured in the same record
+MIN_FAST_SPEEDUP = 20
+# short calls are repeated for a while, the best of many runs is stable on a busy machine
+MIN_MEASURE_SECONDS = 0.5
+MAX_MEASURE_CALLS = 200
+# metrics where a smaller value is a regression, all others regress when they grow
+HIGHER_IS_BETTER = ('events_per_second', 'simulated_minutes_per_second')
+
+
+def measure(function: Callable, repeats: int, prepare: Callable = None):
+    # best wall time of at least repeats untraced calls and of MIN_MEASURE_SECONDS in total, then one call
+    # under tracemalloc for the allocations; prepare builds the argument of function outside the timing
+    seconds = []
+    while len(seconds) < repeats or (sum(seconds) < MIN_MEASURE_SECONDS and len(seconds) < MAX_MEASURE_CALLS):
+        arguments = (prepare(),) if prepare is not None else ()
+        started = time.perf_counter()
+        function(*arguments)
+        seconds.append(time.perf_counter() - started)
+    arguments = (prepare(),) if prepare is not None else ()
+    tracemalloc.start()
+    result = function(*arguments)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, min(seconds), peak
+
+
+def get_peak_rss() -> float:
+    if resource is None:
+        return np.nan
+    # kilobytes on linux, bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def run_benchmark(scenario: str, engine: str, run_until: float, repeats: int, seed: int) -> Dict[str, float]:
+    # module level so every scenario runs in a fresh process with its own peak RSS
+    trains = BENCHMARK_SCENARIOS[scenario]
+    junction = JunctionContainer(TrainMixContainer(trains, 0, 0, 0), TrainMixContainer(trains, 0, 0, 0),
+                                 't', 't2', 60)
+    route_service_rate = {r: BENCHMARK_SERVICE_RATE for r in ('a-b', 'a-c', 'b-a', 'c-a')}
+
+    def setup(env: simpy.Environment = None):
+        if engine == ENGINE_FAST:
+            return Simulator.create_junction_sim_fast(junction, route_service_rate, seed), None
+        env = env if env is not None else simpy.Environment()
+        junction_sim = Simulator.create_junction_sim_ph(env, junction, route_service_rate, seed=seed)
+        junction_sim.run(run_until, log_progress=False)
+        return junction_sim, env
+
+    def run(prepared):
+        junction_sim, env = prepared
+        if env is None:
+            junction_sim.run(run_until)
+        else:
+            env.run(until=run_until)
+        return junction_sim
+
+    def count_simpy_events() -> int:
+        # the scheduled events like the fast engine's heap pushes, counted in an extra untimed run
+        count = 0
+        env = simpy.Environment()
+        schedule = env.schedule
+
+        def counted_schedule(*args, **kwargs):
+            nonlocal count
+            count += 1
+            return schedule(*args, **kwargs)
+
+        env.schedule = counted_schedule
+        run(setup(env))
+        return count
+
+    _, setup_seconds, setup_bytes = measure(setup, repeats)
+    junction_sim, run_seconds, run_bytes = measure(run, repeats, setup)
+    events = junction_sim.event_count if engine == ENGINE_FAST else count_simpy_events()
+    _, conflicts_seconds, conflicts_bytes = measure(lambda: CorrectnessTests.eval_overlapping_conflicts(junction_sim),
+                                                    repeats)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'statistics.csv')
+        _, export_seconds, export_bytes = measure(lambda: junction_sim.export_statistics(path), repeats)
+
+    return {'setup_seconds': setup_seconds,
+            'run_seconds': run_seconds,
+            'events': events,
+            'events_per_second': events / run_seconds,
+            'simulated_minutes_per_second': run_until / run_seconds,
+            'setup_peak_bytes': setup_bytes,
+            'run_peak_bytes': run_bytes,
+            'conflicts_seconds': conflicts_seconds,
+            'conflicts_peak_bytes': conflicts_bytes,
+            'export_seconds': export_seconds,
+            'export_peak_bytes': export_bytes,
+            'peak_rss_bytes': get_peak_rss()}
+
+
+class Benchmark:
+    # the standard scenario at several loads on every engine; a record is one benchmark run with the
+    # metrics per 'scenario/engine', the history is a JSON list of records
+    def __init__(self,
+                 scenarios: Sequence[str] = tuple(BENCHMARK_SCENARIOS),
+                 engines: Sequence[str] = (ENGINE_SIMPY, ENGINE_FAST),
+                 run_until: float = 1320,
+                 repeats: int = 5,
+                 seed: int = 0,
+                 isolated: bool = True):
+        for engine in engines:
+            Simulator.check_engine(engine)
+        self.scenarios = list(scenarios)
+        self.engines = list(engines)
+        self.run_until = run_until
+        self.repeats = repeats
+        self.seed = seed
+        self.isolated = isolated
+
+    def run_case(self, scenario: str, engine: str) -> Dict[str, float]:
+        arguments = (scenario, engine, self.run_until, self.repeats, self.seed)
+        if not self.isolated:
+            return run_benchmark(*arguments)
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            return executor.submit(run_benchmark, *arguments).result()
+
+    def run(self) -> Dict:
+        return {'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'code_version': ScenarioSweep.get_code_version(),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'simpy': simpy.__version__,
+                'machine': platform.node(),
+                'run_until': self.run_until,
+                'results': {f'{scenario}/{engine}': self.run_case(scenario, engine)
+                            for scenario in self.scenarios for engine in self.engines}}
+
+    @staticmethod
+    def read_history(path: str) -> List[Dict]:
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return json.load(f)
+
+    @staticmethod
+    def append_history(path: str, record: Dict):
+        history = Benchmark.read_history(path)
+        history.append(record)
+        Benchmark.write_json(path, history)
+
+    @staticmethod
+    def write_json(path: str, data):
+        # write and rename like ScenarioSweep.write_cache
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=1)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def read_baseline(path: str) -> Dict:
+        with open(path) as f:
+            return json.load(f)
+
+    @staticmethod
+    def compare(record: Dict, baseline: Dict, tolerance: float = BENCHMARK_TOLERANCE) -> List[str]:
+        # the regressions beyond the relative tolerance, cases or metrics missing in either are skipped
+        regressions = []
+        for case, metrics in record['results'].items():
+            reference = baseline['results'].get(case, {})
+            for metric, value in metrics.items():
+                before = reference.get(metric)
+                if metric == 'events' or before is None or not before > 0 or not np.isfinite(value):
+                    continue
+                if metric in HIGHER_IS_BETTER:
+                    regressed = value < before * (1 - tolerance)
+                else:
+                    regressed = value > before * (1 + tolerance)
+                if regressed:
+                    regressions.append(f'{case} {metric}: {value:.4g} (baseline {before:.4g})')
+        return regressions
+
+    @staticmethod
+    def check_speedup(record: Dict, min_speedup: float = MIN_FAST_SPEEDUP) -> List[str]:
+        # the scenarios where the fast engine is less than min_speedup times faster than the SimPy engine; a
+        # ratio within one record does not depend on the machine like the baseline comparison does
+        failures = []
+        results = record['results']
+        for case, metrics in results.items():
+            scenario, engine = case.split('/')
+            reference = results.get(f'{scenario}/{ENGINE_SIMPY}')
+            if engine != ENGINE_FAST or reference is None:
+                continue
+            speedup = reference['run_seconds'] / metrics['run_seconds']
+            if speedup < min_speedup:
+                failures.append(f'{scenario} fast engine speedup: {speedup:.3g}x (minimum {min_speedup}x)')
+        return failures
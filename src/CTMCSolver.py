@@ -0,0 +1,318 @@
+import itertools
+import math
+import warnings
+
+import numpy as np
+from src.JunctionLayout import JunctionLayout, FOUR_ROUTE_LAYOUT
+from src.StatisticHelper import StatisticHelper
+from typing import Dict, List, Tuple
+
+CTMC_TOLERANCE = 1e-10
+CTMC_MAX_ITERATIONS = 100000
+TRUNCATION_TOLERANCE = 1e-4
+MAX_STATES = 2500000
+
+
+class CTMCSolver:
+    # stationary distribution of the junction model as a continuous time Markov chain. A state holds per
+    # route the waiting trains, the phase of the next arrival and the service phase (0 = route free);
+    # dispatching is instantaneous and random among the admissible routes like JunctionSim.train_scheduler,
+    # so only states without an admissible waiting train are kept. The chain is truncated at
+    # max_waiting_trains waiting trains in total, arrivals beyond are lost. The 1 / cov^2 service phases dominate
+    # the state space, max_service_phases replaces longer services by the Erlang distribution with that many
+    # phases and the same mean, which trades a larger service cov for a larger truncation
+    def __init__(self,
+                 route_arrival_rate: Dict[str, float],
+                 route_service_rate: Dict[str, float],
+                 layout: JunctionLayout = FOUR_ROUTE_LAYOUT,
+                 arrival_cov: float = 0.8,
+                 service_cov: float = 0.3,
+                 max_waiting_trains: int = 6,
+                 max_service_phases: int = None):
+        self.layout = layout
+        self.routes = list(layout.routes)
+        self.route_arrival_rate = route_arrival_rate
+        self.route_service_rate = route_service_rate
+        self.max_waiting_trains = max_waiting_trains
+        self.conflict_masks = np.array(layout.get_conflict_masks(self.routes), dtype=np.int64)
+        self.arrival_phase_rates = [CTMCSolver.get_phase_rates(route_arrival_rate[r], arrival_cov) for r in self.routes]
+        self.service_phase_rates = [CTMCSolver.get_phase_rates(route_service_rate[r], service_cov, max_service_phases)
+                                    for r in self.routes]
+        # mixed radix digits per route: waiting trains, arrival phase, service phase with 0 = free
+        self.radices = np.array([max_waiting_trains + 1] * len(self.routes) +
+                                [len(rates) for rates in self.arrival_phase_rates] +
+                                [len(rates) + 1 for rates in self.service_phase_rates], dtype=np.int64)
+        if np.prod(self.radices.astype(float)) >= 2 ** 62:
+            raise ValueError('state space too large for the CTMC solver')
+        self.weights = np.concatenate(([1], np.cumprod(self.radices[:-1]))).astype(np.int64)
+        self.states = None
+        self.keys = None
+        self.rows = self.cols = self.rates = None
+        self.sweeps = None
+        self.stationary = None
+        self.iterations = 0
+        self.residual = math.nan
+
+    @staticmethod
+    def get_phase_rates(rate: float, cov: float, max_phases: int = None) -> np.ndarray:
+        if max_phases is not None and cov ** 2 < 1 / max_phases:
+            return np.full(max_phases, max_phases * rate)
+        para_A, para_B = StatisticHelper.fit_hypoexponential(1 / rate, cov)
+        return np.array([para_A.rate] * para_A.k + [para_B.rate] * para_B.k)
+
+    def get_independent_sets(self) -> List[int]:
+        # occupancy bitmasks in which no two occupied routes conflict
+        n = len(self.routes)
+        return [mask for mask in range(1 << n)
+                if all(not (self.conflict_masks[i] & mask & ~(1 << i)) for i in range(n) if mask & (1 << i))]
+
+    def encode(self, states: np.ndarray) -> np.ndarray:
+        return states @ self.weights
+
+    def enumerate_states(self) -> np.ndarray:
+        # occupancy x service phases of the occupied routes x waiting trains on blocked routes x arrival phases
+        n = len(self.routes)
+        blocks = []
+        for occupied in self.get_independent_sets():
+            blocked = [i for i in range(n) if self.conflict_masks[i] & occupied]
+            queues = [q for q in itertools.product(range(self.max_waiting_trains + 1), repeat=len(blocked))
+                      if sum(q) <= self.max_waiting_trains]
+            columns = ([[0]] * n + [range(len(rates)) for rates in self.arrival_phase_rates] +
+                       [range(1, len(rates) + 1) if occupied & (1 << i) else [0]
+                        for i, rates in enumerate(self.service_phase_rates)])
+            others = np.array(list(itertools.product(*columns)), dtype=np.int64)
+            queues = np.array(queues, dtype=np.int64).reshape(len(queues), len(blocked))
+            block = np.repeat(others, len(queues), axis=0)
+            block[:, blocked] = np.tile(queues, (len(others), 1))
+            blocks.append(block)
+            if sum(len(b) for b in blocks) > MAX_STATES:
+                raise ValueError(f'more than {MAX_STATES} states, reduce max_waiting_trains or max_service_phases')
+
+        states = np.concatenate(blocks)
+        keys = self.encode(states)
+        order = np.argsort(keys)
+        return states[order]
+
+    def dispatch(self, source: np.ndarray, rate: np.ndarray, states: np.ndarray):
+        # resolve the instantaneous dispatching: every admissible waiting route is chosen with equal probability,
+        # repeated until no route is admissible
+        n = len(self.routes)
+        bits = np.int64(1) << np.arange(n, dtype=np.int64)
+        done = []
+        while len(states):
+            occupied = (states[:, 2 * n:] > 0) @ bits
+            ready = (states[:, :n] > 0) & ((occupied[:, None] & self.conflict_masks[None, :]) == 0)
+            count = ready.sum(axis=1)
+            finished = count == 0
+            done.append((source[finished], rate[finished], states[finished]))
+            rows, routes = np.nonzero(ready)
+            states = states[rows]
+            states[np.arange(len(rows)), routes] -= 1
+            states[np.arange(len(rows)), 2 * n + routes] = 1
+            source = source[rows]
+            rate = rate[rows] / count[rows]
+        return tuple(np.concatenate(parts) for parts in zip(*done))
+
+    def build_generator(self):
+        n = len(self.routes)
+        states = self.enumerate_states()
+        self.states, self.keys = states, self.encode(states)
+        index = np.arange(len(states))
+        total_waiting = states[:, :n].sum(axis=1)
+        sources, rates, targets = [], [], []
+        for i in range(n):
+            arrival_rates, service_rates = self.arrival_phase_rates[i], self.service_phase_rates[i]
+            phase = states[:, n + i]
+            # arrival phase progress
+            moving = phase < len(arrival_rates) - 1
+            target = states[moving].copy()
+            target[:, n + i] += 1
+            sources.append(index[moving]), rates.append(arrival_rates[phase[moving]]), targets.append(target)
+            # arrival, lost at the truncation boundary
+            arriving = ~moving
+            target = states[arriving].copy()
+            target[:, n + i] = 0
+            target[:, i] += total_waiting[arriving] < self.max_waiting_trains
+            source, rate, target = self.dispatch(index[arriving], arrival_rates[phase[arriving]], target)
+            sources.append(source), rates.append(rate), targets.append(target)
+
+            phase = states[:, 2 * n + i]
+            in_service = phase > 0
+            # service phase progress
+            moving = in_service & (phase < len(service_rates))
+            target = states[moving].copy()
+            target[:, 2 * n + i] += 1
+            sources.append(index[moving]), rates.append(service_rates[phase[moving] - 1]), targets.append(target)
+            # departure, the released route may admit waiting trains
+            leaving = phase == len(service_rates)
+            target = states[leaving].copy()
+            target[:, 2 * n + i] = 0
+            source, rate, target = self.dispatch(index[leaving], service_rates[-1] * np.ones(leaving.sum()), target)
+            sources.append(source), rates.append(rate), targets.append(target)
+
+        target_keys = self.encode(np.concatenate(targets))
+        cols = np.searchsorted(self.keys, target_keys)
+        if not np.array_equal(self.keys[np.minimum(cols, len(self.keys) - 1)], target_keys):
+            raise RuntimeError('transition to a state outside the enumerated state space')
+        self.rows, self.cols, self.rates = np.concatenate(sources), cols, np.concatenate(rates)
+
+    def get_exit_rates(self) -> np.ndarray:
+        return np.bincount(self.rows, self.rates, len(self.states))
+
+    def get_sweeps(self) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+        # the level of a state is the sum of its phases and of its waiting trains weighted by their arrival phases.
+        # The phase progress and the queued arrivals raise the level, only the departures and the dispatching
+        # lower it, so the generator restricted to the rising transitions is triangular in level order. Per level
+        # the states and the rising transitions into them, the transitions into state 0 belong to the
+        # normalisation row
+        n = len(self.routes)
+        states, rows, cols = self.states, self.rows, self.cols
+        arrival_phases = np.array([len(rates) for rates in self.arrival_phase_rates], dtype=np.int64)
+        level = states[:, n:].sum(axis=1) + states[:, :n] @ arrival_phases
+        levels = np.arange(level.max() + 2)
+        order = np.argsort(level, kind='stable')
+        bounds = np.searchsorted(level[order], levels)
+        position = np.empty(len(states), dtype=np.int64)
+        position[order] = np.arange(len(states))
+        rising = np.nonzero((level[cols] > level[rows]) & (cols != 0))[0]
+        rising = rising[np.argsort(level[cols[rising]], kind='stable')]
+        rising_bounds = np.searchsorted(level[cols[rising]], levels)
+        sweeps = []
+        for start, end, rising_start, rising_end in zip(bounds[:-1], bounds[1:], rising_bounds[:-1], rising_bounds[1:]):
+            into = rising[rising_start:rising_end]
+            sweeps.append((order[start:end], position[cols[into]] - start, rows[into], self.rates[into]))
+        return sweeps
+
+    def solve(self, tolerance: float = CTMC_TOLERANCE, max_iterations: int = CTMC_MAX_ITERATIONS) -> np.ndarray:
+        # BiCGSTAB on pi Q = 0 with the first balance equation replaced by sum(pi) = 1, preconditioned by one
+        # Gauss-Seidel sweep over the levels; power iteration on the uniformized chain if it breaks down
+        if self.rows is None:
+            self.build_generator()
+        pi = self.solve_bicgstab(tolerance, max_iterations)
+        if pi is None or pi.min() < -tolerance:
+            pi = self.solve_power(tolerance, max_iterations)
+        self.stationary = np.maximum(pi, 0) / np.maximum(pi, 0).sum()
+        return self.stationary
+
+    def solve_bicgstab(self, tolerance: float, max_iterations: int):
+        n_states = len(self.states)
+        rows, cols, rates = self.rows, self.cols, self.rates
+        exit_rates = self.get_exit_rates()
+        if self.sweeps is None:
+            self.sweeps = self.get_sweeps()
+
+        def multiply(x):
+            y = np.bincount(cols, x[rows] * rates, n_states) - exit_rates * x
+            y[0] = x.sum()
+            return y
+
+        diagonal = -exit_rates
+        diagonal[0] = 1.
+
+        def precondition(x):
+            # solve the triangular part level by level, the inflow comes from the levels below only
+            y = np.empty(n_states)
+            for members, targets, sources, inflow_rates in self.sweeps:
+                inflow = np.bincount(targets, y[sources] * inflow_rates, len(members))
+                y[members] = (x[members] - inflow) / diagonal[members]
+            return y
+
+        b = np.zeros(n_states)
+        b[0] = 1.
+        x = np.full(n_states, 1 / n_states)
+        r = b - multiply(x)
+        r_hat = r.copy()
+        rho = alpha = omega = 1.
+        v = p = np.zeros(n_states)
+        for self.iterations in range(1, max_iterations + 1):
+            rho_next = r_hat @ r
+            if rho_next == 0 or omega == 0:
+                return None
+            p = r + (rho_next / rho) * (alpha / omega) * (p - omega * v)
+            p_hat = precondition(p)
+            v = multiply(p_hat)
+            alpha = rho_next / (r_hat @ v)
+            s = r - alpha * v
+            s_hat = precondition(s)
+            t = multiply(s_hat)
+            omega = (t @ s) / (t @ t) if t @ t > 0 else 0.
+            x += alpha * p_hat + omega * s_hat
+            r = s - omega * t
+            rho = rho_next
+            self.residual = float(np.linalg.norm(r))
+            if not np.isfinite(self.residual):
+                return None
+            if self.residual < tolerance:
+                return x
+        return None
+
+    def solve_power(self, tolerance: float, max_iterations: int) -> np.ndarray:
+        n_states = len(self.states)
+        exit_rates = self.get_exit_rates()
+        uniform_rate = 1.05 * exit_rates.max()
+        stay = 1 - exit_rates / uniform_rate
+        probabilities = self.rates / uniform_rate
+        pi = np.full(n_states, 1 / n_states)
+        for self.iterations in range(1, max_iterations + 1):
+            updated = pi * stay + np.bincount(self.cols, pi[self.rows] * probabilities, n_states)
+            updated /= updated.sum()
+            self.residual = float(np.abs(updated - pi).sum())
+            pi = updated
+            if self.residual < tolerance:
+                break
+        else:
+            warnings.warn(f'power iteration stopped after {max_iterations} iterations, residual {self.residual:.2e}')
+        return pi
+
+    def get_truncation_mass(self) -> float:
+        # probability of the boundary states, where arrivals are lost
+        n = len(self.routes)
+        return float(self.stationary[self.states[:, :n].sum(axis=1) == self.max_waiting_trains].sum())
+
+    def export_statistics_dict(self, additional_data={}) -> Dict[str, float]:
+        if self.stationary is None:
+            self.solve()
+        n = len(self.routes)
+        pi, states = self.stationary, self.states
+        at_boundary = states[:, :n].sum(axis=1) == self.max_waiting_trains
+        data = {'states': len(states), 'iterations': self.iterations, 'residual': self.residual,
+                'truncation_mass': self.get_truncation_mass()}
+        data.update(additional_data)
+        for i, r in enumerate(self.routes):
+            queue_length = float(pi @ states[:, i])
+            # accepted arrival rate from the flow out of the last arrival phase, Little's law for the wait
+            last_phase = states[:, n + i] == len(self.arrival_phase_rates[i]) - 1
+            accepted = float(pi[last_phase & ~at_boundary].sum() * self.arrival_phase_rates[i][-1])
+            data[f'queue_length_{r}'] = queue_length
+            data[f'mean_waiting_time_{r}'] = queue_length / accepted if accepted > 0 else math.nan
+            data[f'utilization_{r}'] = float(pi[states[:, 2 * n + i] > 0].sum())
+            # the service cov the chain models, above the requested one with max_service_phases
+            means = 1 / self.service_phase_rates[i]
+            data[f'service_cov_{r}'] = float(math.sqrt((means ** 2).sum()) / means.sum())
+        return data
+
+    @staticmethod
+    def solve_with_truncation(route_arrival_rate: Dict[str, float],
+                              route_service_rate: Dict[str, float],
+                              layout: JunctionLayout = FOUR_ROUTE_LAYOUT,
+                              arrival_cov: float = 0.8,
+                              service_cov: float = 0.3,
+                              truncation_tolerance: float = TRUNCATION_TOLERANCE,
+                              max_waiting_trains: Tuple[int, ...] = (4, 6, 8, 10, 12),
+                              max_service_phases: int = None):
+        # raise the truncation until the boundary mass is below truncation_tolerance or the state space limit
+        solver = None
+        for limit in max_waiting_trains:
+            try:
+                candidate = CTMCSolver(route_arrival_rate, route_service_rate, layout, arrival_cov, service_cov, limit,
+                                       max_service_phases)
+                candidate.solve()
+            except ValueError:
+                break
+            solver = candidate
+            if solver.get_truncation_mass() <= truncation_tolerance:
+                return solver
+        if solver is not None:
+            warnings.warn(f'truncation mass {solver.get_truncation_mass():.2e} above {truncation_tolerance:.0e} '
+                          f'at {solver.max_waiting_trains} waiting trains')
+        return solver
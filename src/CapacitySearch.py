@@ -0,0 +1,167 @@
+import math
+import statistics
+
+import numpy as np
+import simpy
+from src.JunctionContainer import JunctionContainer
+from src.JunctionSim import DISPATCH_EVENT
+from src.SimDataTypes import CapacityResult
+from src.Simulator import Simulator, Seed, ARRIVAL_COV, SERVICE_COV, ENGINE_FAST
+from src.StatisticHelper import StatisticHelper
+from src.TrainMixContainer import TrainMixContainer
+from typing import Dict, List, Sequence
+
+CAPACITY_CHECK_INTERVAL = 60
+TREND_BATCHES = 10
+
+
+class CapacitySearch:
+    # bisects the demand, the TrainMixContainer totals of both branches per time_frame, between a stable and an
+    # unstable level. Every probe runs replications that stop as soon as the total queue length shows a
+    # significant linear trend; the same seeds are used at every demand, so the probes are comparable
+    def __init__(self,
+                 route_service_rate: Dict[str, float],
+                 main_share: float = 0.5,
+                 low: float = 0.,
+                 high: float = None,
+                 tolerance: float = 0.5,
+                 replications: int = 3,
+                 time_frame: int = 60,
+                 start: float = 60,
+                 run_until: float = 1320,
+                 check_interval: float = CAPACITY_CHECK_INTERVAL,
+                 min_growth: float = 0.02,
+                 confidence: float = 0.99,
+                 max_probes: int = 30,
+                 seed: Seed = None,
+                 dispatch_mode: str = DISPATCH_EVENT,
+                 arrival_cov: float = ARRIVAL_COV,
+                 service_cov: float = SERVICE_COV,
+                 engine: str = ENGINE_FAST):
+        CapacitySearch.check_main_share(main_share)
+        Simulator.check_engine(engine)
+        self.route_service_rate = route_service_rate
+        self.main_share = main_share
+        self.low = low
+        # every train of the four route model uses two routes, so the total service rate bounds the demand
+        self.high = high if high is not None else sum(route_service_rate.values()) * time_frame / 2
+        self.tolerance = tolerance
+        self.replications = replications
+        self.time_frame = time_frame
+        self.start = start
+        self.run_until = run_until
+        self.check_interval = check_interval
+        self.min_growth = min_growth
+        self.confidence = confidence
+        self.max_probes = max_probes
+        self.seed = seed
+        self.dispatch_mode = dispatch_mode
+        self.arrival_cov = arrival_cov
+        self.service_cov = service_cov
+        self.engine = engine
+
+    @staticmethod
+    def check_main_share(main_share: float):
+        if not 0 < main_share < 1:
+            raise ValueError('main_share must be between 0 and 1, both branches need trains')
+
+    def get_junction(self, demand: float, main_share: float) -> JunctionContainer:
+        main = demand * main_share
+        return JunctionContainer(TrainMixContainer(main, 0, 0, 0), TrainMixContainer(demand - main, 0, 0, 0),
+                                 'main', 'side', self.time_frame)
+
+    def is_diverging(self, times: np.ndarray, lengths: np.ndarray, arrival_rate: float) -> bool:
+        # least squares slope of batch means of the readings, the batches soften the autocorrelation; the queue
+        # has to grow by at least min_growth of the arriving trains and the slope has to be significant
+        if len(times) < 2 * TREND_BATCHES:
+            return False
+        batch_times = np.array([b.mean() for b in np.array_split(times, TREND_BATCHES)])
+        batch_lengths = np.array([b.mean() for b in np.array_split(lengths, TREND_BATCHES)])
+        x = batch_times - batch_times.mean()
+        slope = float((x * batch_lengths).sum() / (x * x).sum())
+        if slope <= self.min_growth * arrival_rate:
+            return False
+        residuals = batch_lengths - batch_lengths.mean() - slope * x
+        standard_error = math.sqrt((residuals ** 2).sum() / (TREND_BATCHES - 2) / (x * x).sum())
+        return standard_error == 0 or slope / standard_error > StatisticHelper.get_t_quantile(self.confidence,
+                                                                                              TREND_BATCHES - 2)
+
+    def run_probe_replication(self, junction: JunctionContainer, seed: np.random.SeedSequence) -> Dict:
+        if self.engine == ENGINE_FAST:
+            junction_sim = Simulator.create_junction_sim_fast(junction, self.route_service_rate, seed,
+                                                              self.arrival_cov, self.service_cov)
+            advance = junction_sim.run
+        else:
+            env = simpy.Environment()
+            junction_sim = Simulator.create_junction_sim_ph(env, junction, self.route_service_rate,
+                                                            self.dispatch_mode, seed, self.arrival_cov,
+                                                            self.service_cov)
+            junction_sim.run(math.inf, log_progress=False)
+            advance = lambda until: env.run(until=until)
+
+        routes = list(junction_sim.routes.values())
+        arrival_rate = sum(Simulator.get_route_arrival_rates(junction).values())
+        advance(self.start)
+        finished_at_start = sum(r.get_finished_count() for r in routes)
+        now = self.start
+        diverging = False
+        while now < self.run_until and not diverging:
+            now = min(now + self.check_interval, self.run_until)
+            advance(now)
+            # the total of the minute readings of read_train_length since start
+            times = np.arange(math.ceil(self.start), now, dtype=float)
+            lengths = sum(r.length_changes.value_at(times) for r in routes)
+            diverging = self.is_diverging(times, lengths, arrival_rate)
+
+        # finished trains in demand units, the demand itself as long as the junction keeps up
+        finished = sum(r.get_finished_count() for r in routes) - finished_at_start
+        throughput = finished / (now - self.start) / arrival_rate * junction.get_total_number_of_trains()
+        return {'diverging': diverging, 'stopped_at': now, 'throughput': throughput}
+
+    def run_probe(self, demand: float, seeds: Sequence[np.random.SeedSequence], main_share: float) -> Dict:
+        results = [self.run_probe_replication(self.get_junction(demand, main_share), seed) for seed in seeds]
+        diverging = sum(r['diverging'] for r in results)
+        return {'demand': demand,
+                'unstable': 2 * diverging > len(results),
+                'diverging_replications': diverging,
+                'simulated_minutes': sum(r['stopped_at'] for r in results),
+                'replications': results}
+
+    def run(self, main_share: float = None) -> CapacityResult:
+        # main_share overrides the one of the search for this run only
+        main_share = self.main_share if main_share is None else main_share
+        CapacitySearch.check_main_share(main_share)
+        seed_sequence = self.seed if isinstance(self.seed, np.random.SeedSequence) else np.random.SeedSequence(self.seed)
+        seeds = seed_sequence.spawn(self.replications)
+        probes: List[Dict] = []
+        low, high = self.low, self.high
+        stable_probe, unstable_probe = None, None
+        # double high until it is unstable, then bisect
+        while len(probes) < self.max_probes:
+            probe = self.run_probe(high, seeds, main_share)
+            probes.append(probe)
+            if probe['unstable']:
+                unstable_probe = probe
+                break
+            stable_probe = probe
+            low, high = high, 2 * high
+        while unstable_probe is not None and high - low > self.tolerance and len(probes) < self.max_probes:
+            probe = self.run_probe((low + high) / 2, seeds, main_share)
+            probes.append(probe)
+            if probe['unstable']:
+                high, unstable_probe = probe['demand'], probe
+            else:
+                low, stable_probe = probe['demand'], probe
+
+        # the throughput measured at the highest stable demand; overloaded runs are no estimate, with all
+        # queues full the dispatcher packs compatible routes better than at the saturation point
+        throughputs = [r['throughput'] for r in stable_probe['replications']
+                       if not r['diverging']] if stable_probe is not None else []
+        return CapacityResult(main_share, low, high if unstable_probe is not None else math.nan,
+                              statistics.fmean(throughputs) if throughputs else math.nan,
+                              StatisticHelper.get_confidence_half_width(throughputs, self.confidence), probes,
+                              sum(p['simulated_minutes'] for p in probes),
+                              unstable_probe is not None and high - low <= self.tolerance)
+
+    def run_shares(self, main_shares: Sequence[float]) -> List[CapacityResult]:
+        return [self.run(main_share) for main_share in main_shares]
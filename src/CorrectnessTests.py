@@ -1,35 +1,109 @@
+import heapq
+
+import numpy as np
+
+from src.JunctionLayout import FOUR_ROUTE_LAYOUT
 from src.JunctionSim import JunctionSim
+from src.TrainStore import TRAIN_FINISHED
 
-from typing import List
+from typing import Iterable, List, Sequence, Tuple
+
+CONFLICTING_ROUTES = FOUR_ROUTE_LAYOUT.get_conflict_pairs()
 
 
 class CorrectnessTests:
 
+    @staticmethod
+    def get_overlapping_pairs(junction_sim: JunctionSim) -> List[Tuple[int, int]]:
+        # one sweep over the finished service intervals sorted by start; each overlapping pair is
+        # reported once as (earlier started train, later started train)
+        store = junction_sim.trains
+        rows = store.get_rows(status=TRAIN_FINISHED)
+        rows = rows[np.argsort(store.service_start[rows], kind='stable')]
+
+        pairs = []
+        active = []
+        for train_id, start, end in zip(store.id[rows].tolist(),
+                                        store.service_start[rows].tolist(),
+                                        store.end[rows].tolist()):
+            while active and active[0][0] <= start:
+                heapq.heappop(active)
+            if start < end:
+                pairs.extend((other_id, train_id) for _, other_id in active)
+                heapq.heappush(active, (end, train_id))
+
+        return pairs
+
+    @staticmethod
+    def get_route_name(junction_sim: JunctionSim, train_id: int) -> str:
+        store = junction_sim.trains
+        return store.route_names[store.route[store.get_row(train_id)]]
+
     @staticmethod
     def get_overlapping_trains(junction_sim: JunctionSim, route1: str, route2: str):
-        trains_overlapping = [(k1, k2) for k1, t1 in junction_sim.trains.items() for k2, t2 in
-                              junction_sim.trains.items()
-                              if t1.ending_time is not None if t2.ending_time is not None
-                              if max(t1.service_start_time, t2.service_start_time) < min(t1.ending_time, t2.ending_time)
-                              if t1.route == route1 if t2.route == route2]
+        route_of = lambda train_id: CorrectnessTests.get_route_name(junction_sim, train_id)
+        trains_overlapping = [(k1, k2) for a, b in CorrectnessTests.get_overlapping_pairs(junction_sim)
+                              for k1, k2 in ((a, b), (b, a))
+                              if route_of(k1) == route1 if route_of(k2) == route2]
+
+        if route1 == route2:
+            # every non-empty service interval overlaps itself
+            store = junction_sim.trains
+            rows = store.get_rows(store.route_codes.get(route1), TRAIN_FINISHED)
+            rows = rows[store.service_start[rows] < store.end[rows]]
+            trains_overlapping += [(k, k) for k in store.id[rows].tolist()]
 
         return trains_overlapping
 
     @staticmethod
     def get_no_overlapping_trains(junction_sim: JunctionSim, routes: List[str]):
-        overlapping_dict = {(r1, r2): len(CorrectnessTests.get_overlapping_trains(junction_sim, r1, r2))
+        overlapping_dict = {(r1, r2): 0
                             for r1 in routes
                             for r2 in [r for r in routes if r != r1]}
+        for a, b in CorrectnessTests.get_overlapping_pairs(junction_sim):
+            r1 = CorrectnessTests.get_route_name(junction_sim, a)
+            r2 = CorrectnessTests.get_route_name(junction_sim, b)
+            if (r1, r2) in overlapping_dict:
+                overlapping_dict[(r1, r2)] += 1
+                overlapping_dict[(r2, r1)] += 1
         return overlapping_dict
 
     @staticmethod
-    def eval_overlapping_conflicts(junction_sim: JunctionSim):
-        routes = ['a-b', 'a-c', 'b-a', 'c-a']
-        overlapping_dict = CorrectnessTests.get_no_overlapping_trains(junction_sim, routes)
+    def get_conflicting_pairs(junction_sim: JunctionSim,
+                              conflicting_routes: Iterable[Tuple[str, str]] = None):
+        # overlapping trains on routes that conflict in either direction of the given (route, route) pairs,
+        # by default the conflicts of the junction's layout
+        conflicts = set(CorrectnessTests.get_layout_conflicts(junction_sim, conflicting_routes))
+        conflicting_pairs = []
+        for a, b in CorrectnessTests.get_overlapping_pairs(junction_sim):
+            r1 = CorrectnessTests.get_route_name(junction_sim, a)
+            r2 = CorrectnessTests.get_route_name(junction_sim, b)
+            if (r1, r2) in conflicts or (r2, r1) in conflicts:
+                conflicting_pairs.append((a, b))
+        return conflicting_pairs
 
-        conflicting_routes = [('a-b', 'a-c'), ('a-c', 'a-b'), ('a-c', 'b-a'), ('b-a', 'a-c'), ('b-a', 'c-a'),
-                              ('c-a', 'b-a')]
+    @staticmethod
+    def get_layout_conflicts(junction_sim: JunctionSim, conflicting_routes: Iterable[Tuple[str, str]] = None):
+        if conflicting_routes is not None:
+            return conflicting_routes
+        layout = getattr(junction_sim, 'layout', FOUR_ROUTE_LAYOUT)
+        return layout.get_conflict_pairs()
 
-        sum_of_conflicts = sum(overlapping_dict[c] for c in conflicting_routes)
+    @staticmethod
+    def get_conflicting_routes_from_matrix(conflict_matrix: Sequence[Sequence[bool]], routes: Sequence[str]):
+        return [(r1, r2) for i, r1 in enumerate(routes) for j, r2 in enumerate(routes)
+                if i != j if conflict_matrix[i][j]]
+
+    @staticmethod
+    def eval_overlapping_conflicts(junction_sim: JunctionSim,
+                                   conflicting_routes: Iterable[Tuple[str, str]] = None):
+        # counts ordered route pairs like the pairwise check did, so a symmetric conflict counts twice
+        conflicts = set(CorrectnessTests.get_layout_conflicts(junction_sim, conflicting_routes))
+        sum_of_conflicts = 0
+        for a, b in CorrectnessTests.get_overlapping_pairs(junction_sim):
+            r1 = CorrectnessTests.get_route_name(junction_sim, a)
+            r2 = CorrectnessTests.get_route_name(junction_sim, b)
+            if r1 != r2:
+                sum_of_conflicts += ((r1, r2) in conflicts) + ((r2, r1) in conflicts)
 
-        return sum_of_conflicts
\ No newline at end of file
+        return sum_of_conflicts
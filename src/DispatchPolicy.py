@@ -0,0 +1,177 @@
+import math
+
+from typing import Dict, Sequence, Tuple, Union
+
+POLICY_RANDOM = 'random'
+POLICY_FIFO = 'fifo'
+POLICY_LONGEST_QUEUE = 'longest_queue'
+POLICY_PRIORITY = 'priority'
+POLICY_MAX_WEIGHT = 'max_weight'
+
+# the main branch trains of the four route model
+MAIN_LINE_ROUTES = ('a-b', 'b-a')
+# layouts with more routes fill their admission table on demand instead of ahead of time
+MAX_TABLE_ROUTES = 8
+
+
+class AdmissionTable(dict):
+    # the policy's candidates keyed by occupied << n | waiting, with route i at bit i of both masks;
+    # an empty tuple where nothing may be dispatched
+    def __init__(self, policy, route_names: Sequence[str], conflict_masks: Sequence[int]):
+        super().__init__()
+        self.policy = policy
+        self.route_names = list(route_names)
+        self.conflict_masks = list(conflict_masks)
+        self.n = len(self.route_names)
+        if self.n <= MAX_TABLE_ROUTES:
+            for key in range(1 << 2 * self.n):
+                self[key]
+
+    def __missing__(self, key: int):
+        occupied, waiting = key >> self.n, key & ((1 << self.n) - 1)
+        ready = [i for i, mask in enumerate(self.conflict_masks) if waiting & (1 << i) and not occupied & mask]
+        candidates = self.policy.get_candidates(ready, self) if ready else ()
+        self[key] = candidates
+        return candidates
+
+
+class DispatchPolicy:
+    # chooses the route of the next train to dispatch. get_candidates only sees the masks and is compiled into
+    # the AdmissionTable, choose breaks the ties with the current state of the junction and returns a route index.
+    # Every policy dispatches whenever a route is admissible, the engines rely on that
+    name = POLICY_RANDOM
+
+    def __init__(self):
+        self.tables: Dict[Tuple, AdmissionTable] = {}
+
+    def compile(self, route_names: Sequence[str], conflict_masks: Sequence[int]) -> AdmissionTable:
+        # once per layout, the tables only depend on the masks and the policy settings
+        key = (tuple(route_names), tuple(conflict_masks))
+        if key not in self.tables:
+            self.tables[key] = AdmissionTable(self, route_names, conflict_masks)
+        return self.tables[key]
+
+    def get_candidates(self, ready: Sequence[int], table: AdmissionTable) -> Tuple:
+        # the admissible routes in route order
+        return tuple(ready)
+
+    def choose(self, candidates: Tuple, junction_sim) -> int:
+        # uniform among the candidates, like the original scheduler
+        return candidates[junction_sim.choose_index(len(candidates))] if len(candidates) > 1 else candidates[0]
+
+    @staticmethod
+    def get_queue_length(junction_sim, i: int) -> int:
+        return len(junction_sim.route_list[i].waiting_trains)
+
+    @staticmethod
+    def get_head_arrival(junction_sim, i: int) -> float:
+        trains = junction_sim.trains
+        return float(trains.arrival[trains.get_row(junction_sim.route_list[i].waiting_trains[0])])
+
+    def choose_max(self, candidates: Tuple, junction_sim, values: Sequence[float]) -> int:
+        # uniform among the candidates with the largest value
+        best = max(values)
+        ties = [i for i, value in zip(candidates, values) if value == best]
+        return ties[junction_sim.choose_index(len(ties))] if len(ties) > 1 else ties[0]
+
+
+class FifoPolicy(DispatchPolicy):
+    # the admissible route whose first train arrived earliest, across all routes
+    name = POLICY_FIFO
+
+    def choose(self, candidates: Tuple, junction_sim) -> int:
+        if len(candidates) == 1:
+            return candidates[0]
+        return self.choose_max(candidates, junction_sim, [-self.get_head_arrival(junction_sim, i) for i in candidates])
+
+
+class LongestQueuePolicy(DispatchPolicy):
+    name = POLICY_LONGEST_QUEUE
+
+    def choose(self, candidates: Tuple, junction_sim) -> int:
+        if len(candidates) == 1:
+            return candidates[0]
+        return self.choose_max(candidates, junction_sim, [self.get_queue_length(junction_sim, i) for i in candidates])
+
+
+class PriorityPolicy(DispatchPolicy):
+    # routes in priority classes, only the admissible routes of the best class are candidates, so the table
+    # already decides everything but the tie-break
+    name = POLICY_PRIORITY
+
+    def __init__(self, priorities: Union[Dict[str, int], Sequence[str]] = MAIN_LINE_ROUTES):
+        # lower values first; a sequence of routes gives them priority 0 and all others 1
+        super().__init__()
+        self.priorities = dict(priorities) if isinstance(priorities, dict) else {r: 0 for r in priorities}
+
+    def get_candidates(self, ready: Sequence[int], table: AdmissionTable) -> Tuple:
+        classes = [self.priorities.get(table.route_names[i], 1) for i in ready]
+        best = min(classes)
+        return tuple(i for i, c in zip(ready, classes) if c == best)
+
+
+class MaxWeightPolicy(DispatchPolicy):
+    # the table holds the maximal sets of admissible routes that can be set together; choose takes the set
+    # with the largest weight, the sum of queue length times route weight, and dispatches its route with the
+    # largest weight, the others follow at the next decisions
+    name = POLICY_MAX_WEIGHT
+
+    def __init__(self, route_weights: Dict[str, float] = None):
+        super().__init__()
+        self.route_weights = route_weights or {}
+
+    def get_candidates(self, ready: Sequence[int], table: AdmissionTable) -> Tuple:
+        masks = table.conflict_masks
+        sets = []
+
+        def extend(chosen: Tuple[int, ...], blocked: int, rest: Sequence[int]):
+            if not rest:
+                # maximal if no skipped ready route fits
+                if all(blocked & (1 << i) for i in ready):
+                    sets.append(chosen)
+                return
+            i, rest = rest[0], rest[1:]
+            if not blocked & (1 << i):
+                extend(chosen + (i,), blocked | masks[i], rest)
+            extend(chosen, blocked, rest)
+
+        extend((), 0, list(ready))
+        return tuple(sets)
+
+    def choose(self, candidates: Tuple, junction_sim) -> int:
+        route_list = junction_sim.route_list
+        weights = {i: len(route_list[i].waiting_trains) * self.route_weights.get(route_list[i].name, 1.)
+                   for route_set in candidates for i in route_set}
+        if len(candidates) > 1:
+            totals = [math.fsum(weights[i] for i in route_set) for route_set in candidates]
+            best = max(totals)
+            ties = [route_set for route_set, total in zip(candidates, totals) if total == best]
+            route_set = ties[junction_sim.choose_index(len(ties))] if len(ties) > 1 else ties[0]
+        else:
+            route_set = candidates[0]
+        if len(route_set) == 1:
+            return route_set[0]
+        return self.choose_max(route_set, junction_sim, [weights[i] for i in route_set])
+
+
+POLICIES = {POLICY_RANDOM: DispatchPolicy,
+            POLICY_FIFO: FifoPolicy,
+            POLICY_LONGEST_QUEUE: LongestQueuePolicy,
+            POLICY_PRIORITY: PriorityPolicy,
+            POLICY_MAX_WEIGHT: MaxWeightPolicy}
+
+
+# one shared instance per name, so the tables are compiled once per process
+DEFAULT_POLICIES: Dict[str, DispatchPolicy] = {}
+
+
+def get_dispatch_policy(policy: Union[None, str, DispatchPolicy]) -> DispatchPolicy:
+    # a name from POLICIES with its default settings, or a configured policy
+    if isinstance(policy, DispatchPolicy):
+        return policy
+    policy = POLICY_RANDOM if policy is None else policy
+    if policy not in POLICIES:
+        raise ValueError(f'unknown dispatch policy {policy!r}')
+    if policy not in DEFAULT_POLICIES:
+        DEFAULT_POLICIES[policy] = POLICIES[policy]()
+    return DEFAULT_POLICIES[policy]
@@ -0,0 +1,262 @@
+import heapq
+import math
+from collections import deque
+
+import numpy as np
+
+from src.DispatchPolicy import DispatchPolicy, get_dispatch_policy
+from src.JunctionLayout import JunctionLayout, FOUR_ROUTE_LAYOUT
+from src.JunctionSnapshot import JunctionSnapshot, RouteSnapshot
+from src.StatisticHelper import IndexSampler
+from src.SimStatistics import RouteStatistics, JunctionStatistics, TimeSeriesIndex
+from src.StreamingStatistics import StreamingStepSeries
+from src.TrainStore import TrainStore
+from typing import Callable, Deque, Dict, List, Tuple
+
+EVENT_ARRIVAL = 0
+EVENT_DEPARTURE = 1
+
+
+class FastRoute(RouteStatistics):
+    def __init__(self,
+                 name: str,
+                 arrival_generator: Callable[[float], float],
+                 service_generator: Callable[[float], float],
+                 junction_sim):
+        self.name = name
+        self.arrival_generator = arrival_generator
+        self.service_generator = service_generator
+        self.junction_sim = junction_sim
+        self.route_code = None
+        self.waiting_trains: Deque[int] = deque()
+        # the arrival times of the waiting trains, so the loop does not read them back from the store
+        self.waiting_arrivals: Deque[float] = deque()
+        self.next_inter_arrival = None
+        self.inter_arrival_times = []
+        # the minute readings are derived from the queue length change log on demand
+        self.length_samples = None
+        self.length_samples_key = None
+        self.init_statistics()
+
+    def enable_streaming(self, start: float, end: float):
+        super().enable_streaming(start, end)
+        self.length_changes = StreamingStepSeries(start, end, self.length_samples, self.junction_sim.minutes_between_read)
+
+    def get_length_samples(self) -> TimeSeriesIndex:
+        if self.streaming:
+            self.length_changes.read_until(self.junction_sim.now)
+            return self.length_samples
+        key = (self.junction_sim.now, self.length_changes.size)
+        if key != self.length_samples_key:
+            read_times = self.junction_sim.get_read_times()
+            self.length_samples = TimeSeriesIndex.from_arrays(read_times, self.length_changes.value_at(read_times))
+            self.length_samples_key = key
+        return self.length_samples
+
+    def get_queue_length(self):
+        return len(self.waiting_trains)
+
+
+class FastJunctionSim(JunctionStatistics):
+    # the JunctionSim model on a plain binary-heap event list, without SimPy processes and resources
+    def __init__(self,
+                 rng: np.random.Generator = None,
+                 layout: JunctionLayout = FOUR_ROUTE_LAYOUT,
+                 policy: DispatchPolicy = None):
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.choose_index = IndexSampler(self.rng)
+        self.layout = layout
+        self.routes: Dict[str, FastRoute] = {}
+        self.route_list: List[FastRoute] = []
+        self.conflict_masks: List[int] = []
+        self.policy = get_dispatch_policy(policy)
+        self.admission_table = None
+        self.trains = TrainStore()
+        self.now = 0.
+        self.occupied = 0
+        self.waiting = 0
+        self.in_service: List[int] = []
+        # service start and waiting time of the train in service per route
+        self.service_waits: List[Tuple[float, float]] = []
+        self.events = []
+        self.event_count = 0
+        self.started = False
+        self.minutes_between_read = 1.
+        # per route queue lengths at which run stops right after the arrival, for splitting
+        self.stop_levels: List[float] = None
+
+    def add_route(self, route: FastRoute):
+        self.routes[route.name] = route
+        self.route_list.append(route)
+        route.route_code = self.trains.add_route(route.name)
+
+    def add_resources(self):
+        self.conflict_masks = self.layout.get_conflict_masks(list(self.routes.keys()))
+        self.admission_table = self.policy.compile(list(self.routes.keys()), self.conflict_masks)
+        self.in_service = [None] * len(self.route_list)
+        self.service_waits = [None] * len(self.route_list)
+
+    def schedule(self, time: float, kind: int, route_index: int):
+        self.event_count += 1
+        heapq.heappush(self.events, (time, self.event_count, kind, route_index))
+
+    def start(self):
+        self.started = True
+        for i, route in enumerate(self.route_list):
+            self.schedule_arrival(i)
+
+    def schedule_arrival(self, i: int):
+        route = self.route_list[i]
+        route.next_inter_arrival = route.arrival_generator(1)
+        if route.next_inter_arrival is not None:
+            self.schedule(self.now + route.next_inter_arrival, EVENT_ARRIVAL, i)
+
+    def run(self, until: float) -> bool:
+        # can be called repeatedly with growing until, events at until itself are left for the next call;
+        # True if a queue reached its stop level, now is then the time of that arrival. The event handling is
+        # inlined and the masks live in locals, this loop is where the engine spends its time
+        if not self.started:
+            self.start()
+
+        events = self.events
+        route_list = self.route_list
+        admission_table = self.admission_table
+        shift = len(route_list)
+        choose = self.policy.choose
+        trains = self.trains
+        in_service = self.in_service
+        service_waits = self.service_waits
+        stop_levels = self.stop_levels
+        heappop, heappush = heapq.heappop, heapq.heappush
+        occupied, waiting, event_count = self.occupied, self.waiting, self.event_count
+        while events and events[0][0] < until:
+            time, _, kind, i = heappop(events)
+            route = route_list[i]
+
+            if kind == EVENT_ARRIVAL:
+                queue = route.waiting_trains
+                route.inter_arrival_times.append(route.next_inter_arrival)
+                queue.append(trains.add(route.route_code, time))
+                route.waiting_arrivals.append(time)
+                waiting |= 1 << i
+                route.length_changes.append(time, len(queue))
+                route.next_inter_arrival = inter_arrival = route.arrival_generator(1)
+                # None once a replayed trace is exhausted
+                if inter_arrival is not None:
+                    event_count += 1
+                    heappush(events, (time + inter_arrival, event_count, EVENT_ARRIVAL, i))
+            else:
+                trains.finish(in_service[i], time)
+                route.waiting_index.append(*service_waits[i])
+                occupied &= ~(1 << i)
+
+            # one admission table lookup per decision, the policy only breaks the ties. After an arrival only
+            # its own route can have become ready, every other one was already dispatched
+            candidates = admission_table[occupied << shift | waiting]
+            while candidates:
+                j = choose(candidates, self)
+                started = route_list[j]
+                queue = started.waiting_trains
+                train_id = queue.popleft()
+                service_waits[j] = (time, time - started.waiting_arrivals.popleft())
+                if not queue:
+                    waiting &= ~(1 << j)
+                started.length_changes.append(time, len(queue))
+                service_length = started.service_generator(1)
+                trains.start_service(train_id, time, service_length)
+                occupied |= 1 << j
+                in_service[j] = train_id
+                event_count += 1
+                heappush(events, (time + service_length, event_count, EVENT_DEPARTURE, j))
+                candidates = admission_table[occupied << shift | waiting]
+
+            if kind == EVENT_ARRIVAL and stop_levels is not None and len(route.waiting_trains) >= stop_levels[i]:
+                self.occupied, self.waiting, self.event_count = occupied, waiting, event_count
+                self.now = time
+                return True
+
+        self.occupied, self.waiting, self.event_count = occupied, waiting, event_count
+        self.now = until
+        return False
+
+    def get_read_times(self) -> np.ndarray:
+        # the minute readings of RouteSim.read_train_length, up to but excluding the current time
+        count = max(0, math.ceil(self.now / self.minutes_between_read) - 1)
+        return self.minutes_between_read * np.arange(1, count + 1, dtype=float)
+
+    def get_snapshot(self) -> JunctionSnapshot:
+        # the state at now, call between runs; the samplers need get_state like PHSampler
+        if not self.started:
+            self.start()
+        trains = self.trains
+        # a route whose replayed trace is exhausted has no pending arrival
+        next_arrival = {i: time for time, _, kind, i in self.events if kind == EVENT_ARRIVAL}
+        routes = []
+        for i, route in enumerate(self.route_list):
+            in_service = None
+            if self.occupied & (1 << i):
+                row = trains.get_row(self.in_service[i])
+                in_service = (float(trains.arrival[row]), float(trains.service_start[row]),
+                              float(trains.service_length[row]))
+            routes.append(RouteSnapshot(route.name,
+                                        [float(trains.arrival[trains.get_row(t)]) for t in route.waiting_trains],
+                                        in_service,
+                                        next_arrival[i] - route.next_inter_arrival if i in next_arrival else None,
+                                        next_arrival.get(i),
+                                        route.arrival_generator.get_state(),
+                                        route.service_generator.get_state()))
+        return JunctionSnapshot(self.now, routes, self.choose_index.get_state())
+
+    def restore(self, snapshot: JunctionSnapshot, resample: bool = True, continue_streams: bool = True):
+        # continue a fresh simulation from the snapshot. With resample the pending arrival and the remaining
+        # service are drawn from this simulation's samplers, conditioned on the time already elapsed, so every
+        # restore is a new replication; without, the sampler states are restored and the run continues exactly.
+        # Without resample and continue_streams only the pending clocks are taken over and all later samples
+        # come from this simulation's own streams
+        if self.started:
+            raise ValueError('restore needs a simulation that has not run yet')
+        self.started = True
+        self.now = now = snapshot.time
+        if not resample and continue_streams:
+            self.choose_index.set_state(snapshot.scheduler_state)
+
+        index = {route.name: i for i, route in enumerate(self.route_list)}
+        # trains get new ids in arrival order
+        arrivals = sorted((arrival, index[r.name], False) for r in snapshot.routes for arrival in r.waiting_arrivals)
+        arrivals += [(r.in_service[0], index[r.name], True) for r in snapshot.routes if r.in_service is not None]
+        for arrival, i, in_service in sorted(arrivals):
+            route = self.route_list[i]
+            train_id = self.trains.add(route.route_code, arrival)
+            if in_service:
+                self.in_service[i] = train_id
+            else:
+                route.waiting_trains.append(train_id)
+                route.waiting_arrivals.append(arrival)
+                self.waiting |= 1 << i
+
+        for r in snapshot.routes:
+            i = index[r.name]
+            route = self.route_list[i]
+            if not resample and continue_streams:
+                route.arrival_generator.set_state(r.arrival_state)
+                route.service_generator.set_state(r.service_state)
+            route.length_changes.append(now, len(route.waiting_trains))
+
+            if r.in_service is not None:
+                arrival, service_start, service_length = r.in_service
+                self.service_waits[i] = (service_start, service_start - arrival)
+                if resample:
+                    service_length = now - service_start + route.service_generator.sample_remaining(now - service_start)
+                self.trains.start_service(self.in_service[i], service_start, service_length)
+                self.occupied |= 1 << i
+                self.schedule(service_start + service_length, EVENT_DEPARTURE, i)
+
+            next_arrival = r.next_arrival
+            if next_arrival is None:
+                route.next_inter_arrival = None
+                continue
+            if resample:
+                # last_arrival is derived from the pending arrival and may round to just after now
+                next_arrival = now + route.arrival_generator.sample_remaining(max(0., now - r.last_arrival))
+            route.next_inter_arrival = next_arrival - r.last_arrival
+            self.schedule(next_arrival, EVENT_ARRIVAL, i)
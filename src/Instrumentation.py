@@ -0,0 +1,99 @@
+import time
+
+from typing import Callable, Dict, Generator
+
+PROCESS_SPAWN_TRAINS = 'spawn_trains'
+PROCESS_SCHEDULE_TRAIN = 'schedule_train'
+PROCESS_TRAIN_SCHEDULER = 'train_scheduler'
+PROCESS_READ_TRAIN_LENGTH = 'read_train_length'
+PROCESS_TRACE_OCCUPANCY = 'trace_occupancy'
+PROCESS_PROGRESS = 'progress'
+
+SAMPLER_ARRIVAL = 'arrival'
+SAMPLER_SERVICE = 'service'
+SAMPLER_DISPATCH = 'dispatch'
+
+PROGRESS_INTERVAL_SECONDS = 1.
+
+# called with the simulated time, the run length and the simulated minutes per wall clock second
+ProgressCallback = Callable[[float, float, float], None]
+
+
+def print_progress(now: float, until: float, minutes_per_second: float):
+    print(f'{100 * now / until:.0f} % done, {minutes_per_second:.0f} simulated minutes/s')
+
+
+class Instrumentation:
+    # counters and wall time per SimPy process type and per sampler; the processes and samplers are only
+    # wrapped when a JunctionSim enables it, so a run without instrumentation pays nothing.
+    # Sampler time is also part of the time of the process that draws the sample
+    def __init__(self):
+        self.process_starts: Dict[str, int] = {}
+        self.process_events: Dict[str, int] = {}
+        self.process_seconds: Dict[str, float] = {}
+        self.sampler_calls: Dict[str, int] = {}
+        self.sampler_seconds: Dict[str, float] = {}
+        self.started = None
+
+    def start(self):
+        self.started = time.perf_counter()
+
+    def wrap_process(self, category: str, generator: Generator) -> Generator:
+        # drives the process generator, every resume is one processed event of the category
+        self.process_starts[category] = self.process_starts.get(category, 0) + 1
+        self.process_events.setdefault(category, 0)
+        self.process_seconds.setdefault(category, 0.)
+        return self.drive(category, generator)
+
+    def drive(self, category: str, generator: Generator) -> Generator:
+        events, seconds = self.process_events, self.process_seconds
+        clock = time.perf_counter
+        resume = generator.send
+        value = None
+        while True:
+            started = clock()
+            try:
+                target = resume(value)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                events[category] += 1
+                seconds[category] += clock() - started
+            resume = generator.send
+            try:
+                value = yield target
+            except Exception as exception:
+                # failed events and interrupts go on to the wrapped process
+                resume, value = generator.throw, exception
+
+    def wrap_sampler(self, category: str, sampler: Callable) -> Callable:
+        self.sampler_calls.setdefault(category, 0)
+        self.sampler_seconds.setdefault(category, 0.)
+        calls, seconds = self.sampler_calls, self.sampler_seconds
+        clock = time.perf_counter
+
+        def sample(*args):
+            started = clock()
+            value = sampler(*args)
+            calls[category] += 1
+            seconds[category] += clock() - started
+            return value
+
+        return sample
+
+    def get_report(self, simulated_minutes: float) -> Dict:
+        wall_seconds = time.perf_counter() - self.started if self.started is not None else 0.
+        # the scheduler does at most one dispatch per wakeup
+        wakeups = self.process_events.get(PROCESS_TRAIN_SCHEDULER, 0)
+        dispatches = self.process_starts.get(PROCESS_SCHEDULE_TRAIN, 0)
+        return {'wall_seconds': wall_seconds,
+                'simulated_minutes': simulated_minutes,
+                'minutes_per_second': simulated_minutes / wall_seconds if wall_seconds > 0 else 0.,
+                'processes': {k: {'started': self.process_starts[k],
+                                  'events': self.process_events[k],
+                                  'seconds': self.process_seconds[k]} for k in self.process_events},
+                'samplers': {k: {'calls': self.sampler_calls[k],
+                                 'seconds': self.sampler_seconds[k]} for k in self.sampler_calls},
+                'scheduler': {'wakeups': wakeups,
+                              'dispatches': dispatches,
+                              'idle_wakeups': wakeups - dispatches}}
@@ -0,0 +1,51 @@
+from dataclasses import dataclass, field
+from typing import List, Sequence, Tuple
+
+
+@dataclass
+class JunctionLayout:
+    # routes and the unordered pairs of routes that must not be set at the same time,
+    # every route implicitly conflicts with itself
+    routes: List[str]
+    conflicts: List[Tuple[str, str]] = field(default_factory=list)
+
+    def __post_init__(self):
+        unknown = {r for pair in self.conflicts for r in pair} - set(self.routes)
+        if unknown:
+            raise ValueError(f'conflicts reference unknown routes {sorted(unknown)}')
+
+    @staticmethod
+    def from_matrix(routes: Sequence[str], conflict_matrix: Sequence[Sequence[bool]]):
+        return JunctionLayout(list(routes),
+                              [(r1, r2) for i, r1 in enumerate(routes) for j, r2 in enumerate(routes)
+                               if i < j if conflict_matrix[i][j] or conflict_matrix[j][i]])
+
+    @staticmethod
+    def from_graph(graph):
+        # networkx style graph, routes are the nodes and conflicts the edges
+        return JunctionLayout(list(graph.nodes), [(r1, r2) for r1, r2 in graph.edges if r1 != r2])
+
+    def get_conflicting_routes(self, route: str) -> List[str]:
+        # the route itself first, then its neighbours in route order
+        neighbours = {r2 if r1 == route else r1 for r1, r2 in self.conflicts if route in (r1, r2)}
+        return [route] + [r for r in self.routes if r in neighbours and r != route]
+
+    def get_conflict_masks(self, route_order: Sequence[str]) -> List[int]:
+        index = {name: i for i, name in enumerate(route_order)}
+        return [sum(1 << index[c] for c in self.get_conflicting_routes(name) if c in index) for name in route_order]
+
+    def get_conflict_pairs(self) -> List[Tuple[str, str]]:
+        # ordered pairs of different conflicting routes, both directions
+        return [(r1, r2) for pair in self.conflicts if pair[0] != pair[1] for r1, r2 in (pair, pair[::-1])]
+
+    def get_resource_pairs(self) -> List[Tuple[str, str]]:
+        # one resource per route and per conflicting pair of routes
+        return [(r, r) for r in self.routes] + [pair for pair in self.conflicts if pair[0] != pair[1]]
+
+    def get_conflict_matrix(self) -> List[List[bool]]:
+        masks = self.get_conflict_masks(self.routes)
+        return [[bool(mask & (1 << j)) for j in range(len(self.routes))] for mask in masks]
+
+
+FOUR_ROUTE_LAYOUT = JunctionLayout(['a-b', 'a-c', 'b-a', 'c-a'],
+                                   [('a-b', 'a-c'), ('a-c', 'b-a'), ('b-a', 'c-a')])
@@ -1,128 +1,197 @@
-import random
+import math
+import time
 
 import numpy as np
-import pandas
 import simpy
 
+from src.DispatchPolicy import DispatchPolicy, get_dispatch_policy
+from src.Instrumentation import (Instrumentation, ProgressCallback, print_progress, PROGRESS_INTERVAL_SECONDS,
+                                 PROCESS_SPAWN_TRAINS, PROCESS_SCHEDULE_TRAIN, PROCESS_TRAIN_SCHEDULER,
+                                 PROCESS_READ_TRAIN_LENGTH, PROCESS_TRACE_OCCUPANCY, PROCESS_PROGRESS,
+                                 SAMPLER_ARRIVAL, SAMPLER_SERVICE, SAMPLER_DISPATCH)
+from src.JunctionLayout import JunctionLayout, FOUR_ROUTE_LAYOUT
+from src.OccupancyTrace import OccupancyTrace, TracedResource, OCCUPANCY_TRACE_CAPACITY, TRACE_INTERVAL
 from src.RouteSim import RouteSim
-from src.SimDataTypes import Train
+from src.StatisticHelper import IndexSampler
+from src.SimStatistics import JunctionStatistics
+from src.TrainStore import TrainStore
 from typing import Dict, Tuple, List
 
 UPDATE_DELAY = 1. / 600
 
+DISPATCH_EVENT = 'event'
+DISPATCH_POLLING = 'polling'
 
-class JunctionSim:
+
+class JunctionSim(JunctionStatistics):
     def __init__(self,
-                 env: simpy.Environment):
+                 env: simpy.Environment,
+                 dispatch_mode: str = DISPATCH_EVENT,
+                 rng: np.random.Generator = None,
+                 layout: JunctionLayout = FOUR_ROUTE_LAYOUT,
+                 policy: DispatchPolicy = None):
+        if dispatch_mode not in (DISPATCH_EVENT, DISPATCH_POLLING):
+            raise ValueError(f'unknown dispatch mode {dispatch_mode!r}')
         self.env = env
+        self.dispatch_mode = dispatch_mode
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.choose_index = IndexSampler(self.rng)
+        # event mode: the scheduler sleeps on these until a train arrives, a route is released
+        # or a dispatched train has acquired its resources
+        self.state_changed = env.event()
+        self.service_started = env.event()
+        self.layout = layout
         self.routes: Dict[str, RouteSim] = {}
+        self.route_list: List[RouteSim] = []
+        # bitmasks of the routes holding their resources and of the routes with waiting trains,
+        # together the key of the policy's admission table
+        self.occupied = 0
+        self.waiting = 0
+        self.conflict_masks: List[int] = []
+        self.policy = get_dispatch_policy(policy)
+        self.admission_table = None
         self.route_resources: Dict[Tuple[str, str], simpy.Resource] = {}
-        self.trains: Dict[int, Train] = {}
+        self.trains = TrainStore()
         self.last_train_id = 0
-        self.resource_queues: Dict[int, Dict[Tuple[str, str], Tuple[List, List]]] = {}
+        # one entry per unique resource, in the column order of the occupancy trace
+        self.resource_list: List[simpy.Resource] = []
+        self.occupancy_trace: OccupancyTrace = None
+        self.trace_settings: Tuple[float, int, bool] = None
+        self.instrumentation: Instrumentation = None
 
     def add_train(self, route_sim: RouteSim):
-        train = Train(self.last_train_id + 1, route_sim.name, self.env.now, None, None, None, False)
-        self.last_train_id += 1
-        self.trains[train.id] = train
-        route_sim.start_train(train)
+        self.last_train_id = self.trains.add(route_sim.route_code, self.env.now)
+        route_sim.start_train(self.last_train_id)
 
     def add_route(self, route_sim: RouteSim):
         self.routes[route_sim.name] = route_sim
+        self.route_list.append(route_sim)
+        route_sim.route_code = self.trains.add_route(route_sim.name)
 
     def add_resources(self):
-        for r1 in self.routes.values():
-            for r2 in self.routes.values():
-                if (r1.name, r2.name) in self.route_resources.keys():
-                    continue
-                else:
-                    self.route_resources[(r1.name, r2.name)] = simpy.Resource(self.env, 1)
-                    # print((r1.name, r2.name), 'added')
-                    self.route_resources[(r2.name, r1.name)] = self.route_resources[(r1.name, r2.name)]
-
-    def read_resource_queues(self, minutes_between_read=1):
+        # only the route itself and its conflicting pairs need a resource
+        pairs = [(r1, r2) for r1, r2 in self.layout.get_resource_pairs() if r1 in self.routes and r2 in self.routes]
+        interval, capacity, on_change = self.trace_settings or (TRACE_INTERVAL, OCCUPANCY_TRACE_CAPACITY, False)
+        self.occupancy_trace = OccupancyTrace([r1 if r1 == r2 else f'{r1}|{r2}' for r1, r2 in pairs], capacity,
+                                              None if on_change else interval)
+        self.resource_list = []
+        for index, (r1, r2) in enumerate(pairs):
+            resource = (TracedResource(self.env, 1, self.occupancy_trace, index) if on_change
+                        else simpy.Resource(self.env, 1))
+            self.route_resources[(r1, r2)] = self.route_resources[(r2, r1)] = resource
+            self.resource_list.append(resource)
+
+        self.conflict_masks = self.layout.get_conflict_masks(list(self.routes.keys()))
+        self.admission_table = self.policy.compile(list(self.routes.keys()), self.conflict_masks)
+        for i, route in enumerate(self.route_list):
+            route.route_bit = 1 << i
+            route.resources = [self.route_resources[(route.name, c)]
+                               for c in self.layout.get_conflicting_routes(route.name) if c in self.routes]
+
+    def enable_occupancy_trace(self, interval: float = TRACE_INTERVAL, capacity: int = OCCUPANCY_TRACE_CAPACITY,
+                               on_change: bool = False):
+        # call before run; without it the resources are read every minute, except in streaming mode.
+        # on_change records every request, grant and release instead of the readings
+        self.trace_settings = (interval, capacity, on_change)
+        if self.route_resources:
+            self.add_resources()
+
+    def trace_occupancy(self):
+        trace, resources = self.occupancy_trace, self.resource_list
         while True:
-            yield self.env.timeout(minutes_between_read)
-            resource_queues = {k: (v.queue, v.users) for k, v in self.route_resources.items()}
-            self.resource_queues[self.env.now] = resource_queues
-
-    def log_status(self, until):
-        interval = until / 100
+            yield self.env.timeout(trace.interval)
+            trace.append(self.env.now, [len(r.users) for r in resources], [len(r.queue) for r in resources])
+
+    def enable_instrumentation(self):
+        # call after the routes are added and before run
+        self.instrumentation = Instrumentation()
+        self.choose_index = self.instrumentation.wrap_sampler(SAMPLER_DISPATCH, self.choose_index)
+        for route in self.route_list:
+            route.arrival_generator = self.instrumentation.wrap_sampler(SAMPLER_ARRIVAL, route.arrival_generator)
+            route.service_generator = self.instrumentation.wrap_sampler(SAMPLER_SERVICE, route.service_generator)
+
+    def get_instrumentation_report(self) -> Dict:
+        if self.instrumentation is None:
+            raise ValueError('instrumentation is not enabled')
+        return self.instrumentation.get_report(self.env.now)
+
+    def start_process(self, category: str, generator):
+        if self.instrumentation is not None:
+            generator = self.instrumentation.wrap_process(category, generator)
+        return self.env.process(generator)
+
+    def report_progress(self, until: float, callback: ProgressCallback,
+                        interval_seconds: float = PROGRESS_INTERVAL_SECONDS):
+        # checks every 1 % of the run, the callback gets called at most every interval_seconds of wall time
+        step = until / 100
+        started = last_report = time.perf_counter()
 
         while True:
-            yield self.env.timeout(interval)
-            now = self.env.now
-            print(f'{round(now / until, 2) * 100} % Done')
-
-    def train_scheduler(self):
-        while True:
-            queues = {k: r.get_queue_length() for k, r in self.routes.items()}
-            resources = {k: v.count < 1 for k, v in self.route_resources.items()}
-            ready_qs = {k: False for k in self.routes.keys()}
-            ready_qs['a-b'] = queues['a-b'] > 0 and resources[('a-b', 'a-b')] and resources[('a-b', 'a-c')]
-            ready_qs['a-c'] = queues['a-c'] > 0 and resources[('a-c', 'a-b')] and resources[('a-c', 'a-c')] and \
-                              resources[('a-c', 'b-a')]
-            ready_qs['b-a'] = queues['b-a'] > 0 and resources[('b-a', 'b-a')] and resources[('b-a', 'c-a')] and \
-                              resources[('b-a', 'a-c')]
-            ready_qs['c-a'] = queues['c-a'] > 0 and resources[('c-a', 'c-a')] and resources[('c-a', 'b-a')]
-
-            if not any(ready_qs.values()):
-                yield self.env.timeout(UPDATE_DELAY)
-                continue
-
-            ready_list = [k for k, v in ready_qs.items() if v]
-            chosen_key = random.choice(ready_list)
-
-            self.env.process(self.routes[chosen_key].schedule_train())
-            yield self.env.timeout(UPDATE_DELAY)
+            yield self.env.timeout(step)
+            clock = time.perf_counter()
+            if clock - last_report >= interval_seconds:
+                last_report = clock
+                callback(self.env.now, until, self.env.now / (clock - started))
 
-    def run(self, until):
-        for k, r in self.routes.items():
-            self.env.process(r.spawn_trains())
-            self.env.process(r.read_train_length())
-
-        self.env.process(self.train_scheduler())
-        self.env.process(self.read_resource_queues())
-        self.env.process(self.log_status(until))
+    def notify_state_change(self):
+        if not self.state_changed.triggered:
+            self.state_changed.succeed()
 
-    def export_trains(self):
-        return {train.id: train for train in self.trains}
+    def notify_service_start(self):
+        if not self.service_started.triggered:
+            self.service_started.succeed()
 
-    def export_statistics(self, path, start=60, end=1200, additional_data={}, correctness_data={}):
-        ql = {k: r.calc_length_of_queue(start=start, end=end) for k, r in self.routes.items()}
+    def train_scheduler(self):
+        if self.dispatch_mode == DISPATCH_EVENT:
+            return self.train_scheduler_event()
+        return self.train_scheduler_polling()
 
-        try:
-            et_w = {k: r.get_mean_waiting_time(start=start, end=end) for k, r in self.routes.items()}
-        except:
-            et_w = {k: np.nan for k, r in self.routes.items()}
+    def get_candidates(self):
+        return self.admission_table[self.occupied << len(self.route_list) | self.waiting]
 
-        data = {r: {'queue_length_query': ql[r],
-                    'mean_waiting_time': et_w[r],
-                    'arrival_rate': self.routes[r].arrival_rate,
-                    'service_rate': self.routes[r].service_rate,
-                    'start_at': start,
-                    'end_at': end} for r in self.routes.keys()}
-        [v.update(additional_data) for v in data.values()]
+    def train_scheduler_event(self):
+        while True:
+            # a fresh event per wait, so every change after this evaluation wakes the scheduler
+            self.state_changed = self.env.event()
+            candidates = self.get_candidates()
 
-        if len(correctness_data) > 0:
-            [v.update(correctness_data[r]) for r, v in data.items()]
+            if not candidates:
+                yield self.state_changed
+                continue
 
-        df = pandas.DataFrame.from_dict(data)
+            route = self.route_list[self.policy.choose(candidates, self)]
 
-        df.to_csv(path, sep=';', decimal='.')
+            self.service_started = self.env.event()
+            self.start_process(PROCESS_SCHEDULE_TRAIN, route.schedule_train())
+            # the dispatched train acquires its resources at the same instant, wait for it
+            # before re-evaluating so the same resources are never handed out twice
+            yield self.service_started
 
-    def export_statistics_dict(self,start=60, end=1200, additional_data={}, correctness_data={}):
-        ql = {k: r.calc_length_of_queue(start=start, end=end) for k, r in self.routes.items()}
+    def train_scheduler_polling(self):
+        while True:
+            candidates = self.get_candidates()
 
-        route_data = {r: {'queue_length': ql[r]}
-                      for r in self.routes.keys()}
-        data = {'start_at': start,
-                'end_at': end}
+            if not candidates:
+                yield self.env.timeout(UPDATE_DELAY)
+                continue
 
-        data.update(additional_data)
-        if len(correctness_data) > 0:
-            [v.update(correctness_data[r]) for r, v in route_data.items()]
+            route = self.route_list[self.policy.choose(candidates, self)]
 
-        [data.update({f'{k}_{r}': v2 for k, v2 in v.items()}) for r, v in route_data.items()]
+            self.start_process(PROCESS_SCHEDULE_TRAIN, route.schedule_train())
+            yield self.env.timeout(UPDATE_DELAY)
 
-        return data
+    def run(self, until: float, log_progress: bool = True, progress_callback: ProgressCallback = None,
+            progress_interval: float = PROGRESS_INTERVAL_SECONDS):
+        if self.instrumentation is not None:
+            self.instrumentation.start()
+        for k, r in self.routes.items():
+            self.start_process(PROCESS_SPAWN_TRAINS, r.spawn_trains())
+            self.start_process(PROCESS_READ_TRAIN_LENGTH, r.read_train_length())
+
+        self.start_process(PROCESS_TRAIN_SCHEDULER, self.train_scheduler())
+        trace = self.occupancy_trace
+        if trace is not None and trace.interval is not None and (self.trace_settings is not None or not self.streaming):
+            self.start_process(PROCESS_TRACE_OCCUPANCY, self.trace_occupancy())
+        if log_progress and math.isfinite(until):
+            self.start_process(PROCESS_PROGRESS, self.report_progress(until, progress_callback or print_progress,
+                                                                      progress_interval))
@@ -0,0 +1,28 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+
+@dataclass
+class RouteSnapshot:
+    name: str
+    # arrival times of the waiting trains in queue order
+    waiting_arrivals: List[float] = field(default_factory=list)
+    # arrival, service start and service length of the train holding the route
+    in_service: Optional[Tuple[float, float, float]] = None
+    # both None once the arrivals of the route are exhausted
+    last_arrival: Optional[float] = 0.
+    next_arrival: Optional[float] = None
+    arrival_state: Dict = None
+    service_state: Dict = None
+
+
+@dataclass
+class JunctionSnapshot:
+    # plain data of a FastJunctionSim at time, without statistics and finished trains, so it pickles
+    # into worker processes and can be restored any number of times
+    time: float
+    routes: List[RouteSnapshot]
+    scheduler_state: Dict = None
+
+    def get_waiting_trains(self) -> int:
+        return sum(len(route.waiting_arrivals) for route in self.routes)
@@ -0,0 +1,119 @@
+import numpy as np
+import simpy
+from simpy.resources.resource import Release, Request
+from typing import Sequence, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas
+
+OCCUPANCY_TRACE_CAPACITY = 4096
+TRACE_INTERVAL = 1.
+
+
+class OccupancyTrace:
+    # users and queued requests per resource in preallocated ring buffers, the oldest rows are overwritten
+    # once capacity rows are written. Rows are readings every interval minutes, or with interval None
+    # one row per change of a resource
+    def __init__(self, names: Sequence[str], capacity: int = OCCUPANCY_TRACE_CAPACITY,
+                 interval: float = TRACE_INTERVAL):
+        self.names = list(names)
+        self.capacity = capacity
+        self.interval = interval
+        self.times = np.zeros(capacity)
+        self.users = np.zeros((capacity, len(self.names)), dtype=np.int32)
+        self.queues = np.zeros((capacity, len(self.names)), dtype=np.int32)
+        self.count = 0
+        self.current_users = np.zeros(len(self.names), dtype=np.int32)
+        self.current_queues = np.zeros(len(self.names), dtype=np.int32)
+
+    def append(self, time: float, users, queues):
+        row = self.count % self.capacity
+        self.times[row] = time
+        self.users[row] = users
+        self.queues[row] = queues
+        self.count += 1
+
+    def update(self, time: float, index: int, users: int, queue: int):
+        # on change mode, a row with the new counts of resource index and the last counts of all others
+        if self.current_users[index] == users and self.current_queues[index] == queue:
+            return
+        self.current_users[index] = users
+        self.current_queues[index] = queue
+        self.append(time, self.current_users, self.current_queues)
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    @property
+    def dropped(self) -> int:
+        return max(0, self.count - self.capacity)
+
+    def get_rows(self) -> np.ndarray:
+        # buffer rows in time order
+        if self.count <= self.capacity:
+            return np.arange(self.count)
+        return np.arange(self.count, self.count + self.capacity) % self.capacity
+
+    def get_times(self) -> np.ndarray:
+        return self.times[self.get_rows()]
+
+    def get_users(self) -> np.ndarray:
+        return self.users[self.get_rows()]
+
+    def get_queues(self) -> np.ndarray:
+        return self.queues[self.get_rows()]
+
+    def to_dataframe(self) -> 'pandas.DataFrame':
+        import pandas
+        rows = self.get_rows()
+        data = {f'users_{name}': self.users[rows, i] for i, name in enumerate(self.names)}
+        data.update({f'queue_{name}': self.queues[rows, i] for i, name in enumerate(self.names)})
+        return pandas.DataFrame(data, index=pandas.Index(self.times[rows], name='time'))
+
+    def save_npz(self, path):
+        rows = self.get_rows()
+        np.savez(path, names=np.array(self.names), times=self.times[rows], users=self.users[rows],
+                 queues=self.queues[rows], interval=np.nan if self.interval is None else self.interval)
+
+    @staticmethod
+    def load_npz(path):
+        with np.load(path) as data:
+            interval = float(data['interval'])
+            trace = OccupancyTrace(data['names'].tolist(), max(1, len(data['times'])),
+                                   None if np.isnan(interval) else interval)
+            trace.count = len(data['times'])
+            trace.times[:trace.count] = data['times']
+            trace.users[:trace.count] = data['users']
+            trace.queues[:trace.count] = data['queues']
+        return trace
+
+
+class TracedRequest(Request):
+    def cancel(self):
+        super().cancel()
+        self.resource.record()
+
+
+class TracedResource(simpy.Resource):
+    # reports every request, grant, release and cancel to an on change OccupancyTrace, only through the
+    # public request and release
+    def __init__(self, env: simpy.Environment, capacity: int, trace: OccupancyTrace, index: int):
+        super().__init__(env, capacity)
+        self.env = env
+        self.trace = trace
+        self.trace_index = index
+
+    def record(self, event: simpy.Event = None):
+        self.trace.update(self.env.now, self.trace_index, len(self.users), len(self.queue))
+
+    def request(self) -> Request:
+        request = TracedRequest(self)
+        self.record()
+        # a queued request is granted when a release is processed, its callbacks run once it is granted
+        request.callbacks.append(self.record)
+        return request
+
+    def release(self, request: Request) -> Release:
+        release = super().release(request)
+        self.record()
+        return release
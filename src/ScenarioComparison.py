@@ -0,0 +1,69 @@
+import statistics
+
+import numpy as np
+from src.JunctionContainer import JunctionContainer
+from src.JunctionSim import DISPATCH_EVENT
+from src.SimDataTypes import ComparisonResult, ReplicationTask
+from src.Simulator import Simulator, Seed, ROUTE_NAMES, ARRIVAL_COV, SERVICE_COV, ENGINE_SIMPY
+from src.StatisticHelper import StatisticHelper, SAMPLING_GAMMA, SAMPLING_INVERSION, SAMPLING_ANTITHETIC
+from typing import Any, Dict, Sequence
+
+Scenario = Dict[str, Any]
+
+
+class ScenarioComparison:
+    # paired replications of two scenarios of one junction; a scenario overrides ReplicationTask fields, e.g.
+    # {'route_service_rate': {...}} or {'dispatch_mode': DISPATCH_POLLING}. With common random numbers both
+    # scenarios of a pair run on the same seed, so every route sees the same arrivals and service draws
+    def __init__(self,
+                 junction: JunctionContainer,
+                 route_service_rate: Dict[str, float],
+                 outputs: Sequence[str] = None,
+                 run_until: float = 1320,
+                 start: float = 60,
+                 end: float = 1200,
+                 dispatch_mode: str = DISPATCH_EVENT,
+                 arrival_cov: float = ARRIVAL_COV,
+                 service_cov: float = SERVICE_COV,
+                 engine: str = ENGINE_SIMPY,
+                 workers: int = 1,
+                 confidence: float = 0.95):
+        self.base_task = ReplicationTask(junction, route_service_rate, run_until, dispatch_mode, None, start, end,
+                                         arrival_cov, service_cov, engine, {})
+        self.outputs = list(outputs) if outputs is not None else [f'mean_waiting_time_{r}' for r in ROUTE_NAMES]
+        self.workers = workers
+        self.confidence = confidence
+
+    def get_task(self, scenario: Scenario, seed: np.random.SeedSequence, sampling: str, replication: int):
+        return self.base_task._replace(seed=seed, sampling=sampling, additional_data={'replication': replication},
+                                       **scenario)
+
+    def compare(self,
+                scenario_a: Scenario,
+                scenario_b: Scenario,
+                n: int,
+                seed: Seed = None,
+                common_random_numbers: bool = True,
+                antithetic: bool = False) -> ComparisonResult:
+        # n pairs; with antithetic every replication is the mean of a run on U and a run on 1 - U
+        seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        seeds_a = seed_sequence.spawn(n)
+        seeds_b = seeds_a if common_random_numbers else seed_sequence.spawn(n)
+        samplings = (SAMPLING_INVERSION, SAMPLING_ANTITHETIC) if antithetic else (SAMPLING_GAMMA,)
+
+        tasks = [self.get_task(scenario, child, sampling, i)
+                 for scenario, seeds in ((scenario_a, seeds_a), (scenario_b, seeds_b))
+                 for sampling in samplings
+                 for i, child in enumerate(seeds)]
+        summaries = Simulator.run_tasks(tasks, self.workers)
+
+        mean_a, mean_b, differences, half_widths = {}, {}, {}, {}
+        for k in self.outputs:
+            values = np.array([summary[k] for summary in summaries]).reshape(2, len(samplings), n).mean(axis=1)
+            paired = values[0] - values[1]
+            mean_a[k] = float(values[0].mean())
+            mean_b[k] = float(values[1].mean())
+            differences[k] = statistics.fmean(paired)
+            half_widths[k] = StatisticHelper.get_confidence_half_width(paired.tolist(), self.confidence)
+
+        return ComparisonResult(mean_a, mean_b, differences, half_widths, n)
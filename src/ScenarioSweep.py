@@ -0,0 +1,156 @@
+import ast
+import dataclasses
+import hashlib
+import itertools
+import json
+import os
+import pandas
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from src.JunctionContainer import JunctionContainer
+from src.JunctionSim import DISPATCH_EVENT
+from src.SimDataTypes import ReplicationTask
+from src.Simulator import Simulator, ARRIVAL_COV, SERVICE_COV, ENGINE_SIMPY, run_replication
+from typing import Dict, Iterable, List
+
+# run_replication lives here, the modules it imports directly or indirectly invalidate cached results
+SIMULATION_ENTRY_MODULE = 'Simulator'
+
+
+class ScenarioSweep:
+    def __init__(self,
+                 cache_dir: str,
+                 run_until: float = 1320,
+                 start: float = 60,
+                 end: float = 1200,
+                 arrival_cov: float = ARRIVAL_COV,
+                 service_cov: float = SERVICE_COV,
+                 dispatch_mode: str = DISPATCH_EVENT,
+                 workers: int = None,
+                 engine: str = ENGINE_SIMPY):
+        Simulator.check_engine(engine)
+        self.cache_dir = cache_dir
+        self.run_until = run_until
+        self.start = start
+        self.end = end
+        self.arrival_cov = arrival_cov
+        self.service_cov = service_cov
+        self.dispatch_mode = dispatch_mode
+        self.workers = workers
+        self.engine = engine
+        self.code_version = ScenarioSweep.get_code_version()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def get_simulation_modules(entry: str = SIMULATION_ENTRY_MODULE) -> List[str]:
+        # the src modules reachable from entry through import statements, lazy imports in functions included
+        src_dir = os.path.dirname(os.path.abspath(__file__))
+        modules, pending = set(), [entry]
+        while pending:
+            name = pending.pop()
+            if name in modules:
+                continue
+            modules.add(name)
+            with open(os.path.join(src_dir, f'{name}.py'), 'rb') as f:
+                tree = ast.parse(f.read())
+            for node in ast.walk(tree):
+                names = ([node.module] if isinstance(node, ast.ImportFrom) and node.module
+                         else [alias.name for alias in node.names] if isinstance(node, ast.Import) else [])
+                pending += [n.split('.')[1] for n in names if n.startswith('src.')]
+        return sorted(f'{name}.py' for name in modules)
+
+    @staticmethod
+    def get_code_version() -> str:
+        src_dir = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.sha256()
+        for name in ScenarioSweep.get_simulation_modules():
+            with open(os.path.join(src_dir, name), 'rb') as f:
+                digest.update(f.read())
+        return digest.hexdigest()[:16]
+
+    def get_point_parameters(self, junction: JunctionContainer, route_service_rate: Dict[str, float], seed: int):
+        return {'junction': dataclasses.asdict(junction),
+                'route_service_rate': dict(sorted(route_service_rate.items())),
+                'arrival_cov': self.arrival_cov,
+                'service_cov': self.service_cov,
+                'run_until': self.run_until,
+                'start': self.start,
+                'end': self.end,
+                'dispatch_mode': self.dispatch_mode,
+                'engine': self.engine,
+                'seed': seed,
+                'code_version': self.code_version}
+
+    @staticmethod
+    def get_cache_key(parameters: Dict) -> str:
+        return hashlib.sha256(json.dumps(parameters, sort_keys=True).encode()).hexdigest()
+
+    def get_cache_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f'{key}.json')
+
+    def read_cache(self, key: str):
+        path = self.get_cache_path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)['result']
+
+    def write_cache(self, key: str, parameters: Dict, result: Dict):
+        # write and rename, so an interrupted sweep never leaves a truncated entry behind
+        path = self.get_cache_path(key)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'parameters': parameters, 'result': result}, f)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def get_point_columns(junction: JunctionContainer, route_service_rate: Dict[str, float], seed: int):
+        columns = {'main_branch_trains': junction.main_branch_mix.get_total_number(),
+                   'side_branch_trains': junction.side_branch_mix.get_total_number(),
+                   'time_frame': junction.time_frame,
+                   'seed': seed}
+        columns.update({f'service_rate_{r}': v for r, v in route_service_rate.items()})
+        return columns
+
+    def run(self,
+            junctions: Iterable[JunctionContainer],
+            route_service_rates: Iterable[Dict[str, float]],
+            seeds: Iterable[int] = (0,)) -> pandas.DataFrame:
+        points = list(itertools.product(junctions, route_service_rates, seeds))
+        keys = []
+        results: Dict[str, Dict] = {}
+        missing: List = []
+        missing_keys = set()
+        for junction, route_service_rate, seed in points:
+            parameters = self.get_point_parameters(junction, route_service_rate, seed)
+            key = ScenarioSweep.get_cache_key(parameters)
+            keys.append(key)
+            if key in results or key in missing_keys:
+                continue
+            cached = self.read_cache(key)
+            if cached is not None:
+                results[key] = cached
+            else:
+                missing_keys.add(key)
+                missing.append((key, parameters, ReplicationTask(junction, route_service_rate, self.run_until,
+                                                                 self.dispatch_mode, seed, self.start, self.end,
+                                                                 self.arrival_cov, self.service_cov, self.engine,
+                                                                 ScenarioSweep.get_point_columns(
+                                                                     junction, route_service_rate, seed))))
+
+        for key, parameters, result in self.run_missing(missing):
+            self.write_cache(key, parameters, result)
+            results[key] = result
+
+        return pandas.DataFrame([results[key] for key in keys])
+
+    def run_missing(self, missing: List):
+        if self.workers is not None and self.workers <= 1:
+            for key, parameters, task in missing:
+                yield key, parameters, run_replication(task)
+            return
+
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(run_replication, task): (key, parameters) for key, parameters, task in missing}
+            for future in as_completed(futures):
+                key, parameters = futures[future]
+                yield key, parameters, future.result()
@@ -0,0 +1,151 @@
+import math
+import os
+import statistics
+import time
+
+import numpy as np
+import simpy
+from src.JunctionContainer import JunctionContainer
+from src.JunctionSim import DISPATCH_EVENT
+from src.SimDataTypes import PrecisionResult, ReplicationTask
+from src.Simulator import Simulator, Seed, ROUTE_NAMES, ARRIVAL_COV, SERVICE_COV, ENGINE_FAST, ENGINE_SIMPY
+from src.StatisticHelper import StatisticHelper
+from typing import Dict, List, Sequence
+
+OUTPUT_QUEUE_LENGTH = 'queue_length'
+OUTPUT_WAITING_TIME = 'mean_waiting_time'
+
+
+class SequentialRunner:
+    # adds replications, or extends a single run, until the confidence intervals of the outputs are narrow
+    # enough; outputs are export_summary keys like 'mean_waiting_time_a-b' or 'queue_length_c-a'
+    def __init__(self,
+                 junction: JunctionContainer,
+                 route_service_rate: Dict[str, float],
+                 outputs: Sequence[str] = None,
+                 relative_precision: float = 0.05,
+                 absolute_precision: float = None,
+                 confidence: float = 0.95,
+                 start: float = 60,
+                 end: float = 1200,
+                 run_until: float = 1320,
+                 min_replications: int = 5,
+                 max_replications: int = 1000,
+                 max_minutes: float = None,
+                 max_seconds: float = None,
+                 seed: Seed = None,
+                 workers: int = 1,
+                 dispatch_mode: str = DISPATCH_EVENT,
+                 arrival_cov: float = ARRIVAL_COV,
+                 service_cov: float = SERVICE_COV,
+                 engine: str = ENGINE_SIMPY):
+        Simulator.check_engine(engine)
+        self.junction = junction
+        self.route_service_rate = route_service_rate
+        self.outputs = list(outputs) if outputs is not None else [f'{OUTPUT_WAITING_TIME}_{r}' for r in ROUTE_NAMES]
+        self.relative_precision = relative_precision
+        self.absolute_precision = absolute_precision
+        self.confidence = confidence
+        self.start = start
+        self.end = end
+        self.run_until = run_until
+        self.min_replications = min_replications
+        self.max_replications = max_replications
+        self.max_minutes = max_minutes
+        self.max_seconds = max_seconds
+        self.seed = seed
+        self.workers = workers
+        self.dispatch_mode = dispatch_mode
+        self.arrival_cov = arrival_cov
+        self.service_cov = service_cov
+        self.engine = engine
+
+    def is_precise(self, estimate: float, half_width: float) -> bool:
+        # either target suffices, a nan half-width never does
+        if math.isnan(half_width):
+            return False
+        if self.absolute_precision is not None and half_width <= self.absolute_precision:
+            return True
+        return self.relative_precision is not None and half_width <= self.relative_precision * abs(estimate)
+
+    def is_converged(self, estimates: Dict[str, float], half_widths: Dict[str, float]) -> bool:
+        return all(self.is_precise(estimates[k], half_widths[k]) for k in self.outputs)
+
+    def is_over_budget(self, replications: int, simulated_minutes: float, started: float) -> bool:
+        return (replications >= self.max_replications or
+                (self.max_minutes is not None and simulated_minutes >= self.max_minutes) or
+                (self.max_seconds is not None and time.perf_counter() - started >= self.max_seconds))
+
+    def run_replications(self) -> PrecisionResult:
+        # independent replications of run_until minutes, in rounds of workers replications; the seeds are
+        # spawned one by one, so the replications do not depend on the number of workers
+        seed_sequence = self.seed if isinstance(self.seed, np.random.SeedSequence) else np.random.SeedSequence(self.seed)
+        round_size = max(1, self.workers or os.cpu_count())
+        started = time.perf_counter()
+        values: Dict[str, List[float]] = {k: [] for k in self.outputs}
+        replications = 0
+        while True:
+            n = self.min_replications if replications == 0 else round_size
+            n = min(n, self.max_replications - replications)
+            if self.max_minutes is not None:
+                # only whole replications that fit into the budget
+                n = min(n, int((self.max_minutes - replications * self.run_until) // self.run_until))
+            if n > 0:
+                tasks = [ReplicationTask(self.junction, self.route_service_rate, self.run_until, self.dispatch_mode,
+                                         child, self.start, self.end, self.arrival_cov, self.service_cov, self.engine,
+                                         {'replication': replications + i})
+                         for i, child in enumerate(seed_sequence.spawn(n))]
+                for summary in Simulator.run_tasks(tasks, self.workers):
+                    for k in self.outputs:
+                        values[k].append(summary[k])
+                replications += n
+
+            # no estimates when not even one replication fits into max_minutes
+            estimates = {k: statistics.fmean(v) if v else math.nan for k, v in values.items()}
+            half_widths = {k: StatisticHelper.get_confidence_half_width(v, self.confidence) for k, v in values.items()}
+            converged = self.is_converged(estimates, half_widths)
+            if converged or n <= 0 or self.is_over_budget(replications, replications * self.run_until, started):
+                return PrecisionResult(estimates, half_widths, replications, replications * self.run_until, converged)
+
+    def run_batch_means(self, extension: float = None) -> PrecisionResult:
+        # one long run in streaming mode from start on, extended by extension minutes until the batch means
+        # confidence intervals are narrow enough and the batch means nearly uncorrelated; the first check is
+        # after run_until
+        extension = extension if extension is not None else self.run_until
+        if self.engine == ENGINE_FAST:
+            junction_sim = Simulator.create_junction_sim_fast(self.junction, self.route_service_rate, self.seed,
+                                                              self.arrival_cov, self.service_cov)
+            junction_sim.enable_streaming(self.start, math.inf)
+            advance = junction_sim.run
+        else:
+            env = simpy.Environment()
+            junction_sim = Simulator.create_junction_sim_ph(env, self.junction, self.route_service_rate,
+                                                            self.dispatch_mode, self.seed, self.arrival_cov,
+                                                            self.service_cov)
+            junction_sim.enable_streaming(self.start, math.inf)
+            junction_sim.run(math.inf, log_progress=False)
+            advance = lambda until: env.run(until=until)
+
+        started = time.perf_counter()
+        now = self.run_until if self.max_minutes is None else min(self.run_until, self.max_minutes)
+        while True:
+            advance(now)
+            estimates, half_widths = {}, {}
+            independent = True
+            for k in self.outputs:
+                series = SequentialRunner.get_streaming_series(junction_sim, k)
+                estimates[k] = series.moments.mean if series.moments.count > 0 else math.nan
+                half_widths[k] = series.get_half_width(self.confidence)
+                independent = independent and series.batches.is_independent()
+            converged = independent and self.is_converged(estimates, half_widths)
+            if converged or self.is_over_budget(0, now, started):
+                return PrecisionResult(estimates, half_widths, 1, now, converged)
+            now += extension if self.max_minutes is None else min(extension, self.max_minutes - now)
+
+    @staticmethod
+    def get_streaming_series(junction_sim, output: str):
+        for prefix in (OUTPUT_QUEUE_LENGTH, OUTPUT_WAITING_TIME):
+            if output.startswith(f'{prefix}_'):
+                route = junction_sim.routes[output[len(prefix) + 1:]]
+                return route.get_length_samples() if prefix == OUTPUT_QUEUE_LENGTH else route.waiting_index
+        raise ValueError(f'unknown output {output!r}')
@@ -1,3 +1,21 @@
 from collections import namedtuple
+from src.StatisticHelper import SAMPLING_GAMMA
 
-Train = namedtuple('Train', ('id', 'route', 'starting_time', 'ending_time', 'service_start_time', 'service_length' , 'in_service'))
\ No newline at end of file
+Train = namedtuple('Train', ('id', 'route', 'starting_time', 'ending_time', 'service_start_time', 'service_length' , 'in_service'))
+
+ReplicationTask = namedtuple('ReplicationTask', ('junction', 'route_service_rate', 'run_until', 'dispatch_mode', 'seed',
+                                                 'start', 'end', 'arrival_cov', 'service_cov', 'engine',
+                                                 'additional_data', 'streaming', 'sampling', 'snapshot', 'policy'),
+                             defaults=(False, SAMPLING_GAMMA, None, None))
+
+PrecisionResult = namedtuple('PrecisionResult', ('estimates', 'half_widths', 'replications', 'simulated_minutes',
+                                                 'converged'))
+
+ComparisonResult = namedtuple('ComparisonResult', ('mean_a', 'mean_b', 'differences', 'half_widths', 'replications'))
+
+CapacityResult = namedtuple('CapacityResult', ('main_share', 'stable_demand', 'unstable_demand', 'throughput',
+                                               'throughput_half_width', 'probes', 'simulated_minutes', 'converged'))
+
+SplittingResult = namedtuple('SplittingResult', ('probability', 'standard_error', 'half_width', 'relative_error',
+                                                 'stage_probabilities', 'repetitions', 'trajectories',
+                                                 'simulated_minutes', 'seconds'))
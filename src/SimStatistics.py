@@ -0,0 +1,280 @@
+import statistics
+
+import numpy as np
+
+from src.StreamingStatistics import DiscreteStreamingSeries, StreamingSeries, StreamingStepSeries, Welford
+from src.TrainStore import TRAIN_FINISHED, TRAIN_WAITING
+from typing import Dict, List
+
+
+class TimeSeriesIndex:
+    # append-only (time, value) series with non-decreasing times; appends only go to lists, the first query
+    # after them moves them into the arrays, where prefix sums of the values and of the area under the step
+    # function answer window means in O(log n)
+    def __init__(self, capacity: int = 1024):
+        self.indexed = 0
+        self.pending_times: List[float] = []
+        self.pending_values: List[float] = []
+        self.times = np.empty(capacity)
+        self.values = np.empty(capacity)
+        self.value_sums = np.zeros(capacity + 1)
+        self.areas = np.zeros(capacity)
+
+    @property
+    def size(self) -> int:
+        return self.indexed + len(self.pending_times)
+
+    def grow(self, size: int):
+        capacity = max(2 * len(self.times), size)
+        for column, offset in (('times', 0), ('values', 0), ('value_sums', 1), ('areas', 0)):
+            values = np.zeros(capacity + offset)
+            values[:self.indexed + offset] = getattr(self, column)[:self.indexed + offset]
+            setattr(self, column, values)
+
+    def append(self, time: float, value: float):
+        self.pending_times.append(time)
+        self.pending_values.append(value)
+
+    def update_index(self):
+        if not self.pending_times:
+            return
+        lo, size = self.indexed, self.size
+        if size > len(self.times):
+            self.grow(size)
+        times = np.array(self.pending_times, dtype=float)
+        values = np.array(self.pending_values, dtype=float)
+        self.times[lo:size] = times
+        self.values[lo:size] = values
+        # cumsum accumulates in order, the sums are the same as adding one value at a time
+        self.value_sums[lo + 1:size + 1] = np.cumsum(np.concatenate(([self.value_sums[lo]], values)))[1:]
+        if lo > 0:
+            times = np.concatenate(([self.times[lo - 1]], times))
+            values = np.concatenate(([self.values[lo - 1]], values))
+            areas = np.cumsum(np.concatenate(([self.areas[lo - 1]], values[:-1] * np.diff(times))))[1:]
+        else:
+            areas = np.cumsum(np.concatenate(([0.], values[:-1] * np.diff(times))))
+        self.areas[lo:size] = areas
+        self.indexed = size
+        self.pending_times, self.pending_values = [], []
+
+    def __len__(self):
+        return self.size
+
+    @staticmethod
+    def from_arrays(times: np.ndarray, values: np.ndarray):
+        series = TimeSeriesIndex(max(1, len(times)))
+        series.pending_times = list(times)
+        series.pending_values = list(values)
+        series.update_index()
+        return series
+
+    def get_times(self) -> np.ndarray:
+        self.update_index()
+        return self.times[:self.indexed]
+
+    def get_values(self) -> np.ndarray:
+        self.update_index()
+        return self.values[:self.indexed]
+
+    def window(self, start: float, end: float):
+        times = self.get_times()
+        return int(np.searchsorted(times, start, side='left')), int(np.searchsorted(times, end, side='right'))
+
+    def window_count(self, start: float, end: float) -> int:
+        lo, hi = self.window(start, end)
+        return max(0, hi - lo)
+
+    def window_mean(self, start: float, end: float) -> float:
+        lo, hi = self.window(start, end)
+        if hi <= lo:
+            raise statistics.StatisticsError('mean requires at least one data point')
+        return float((self.value_sums[hi] - self.value_sums[lo]) / (hi - lo))
+
+    def integral(self, time: float) -> float:
+        # area under the step function from the first entry up to time
+        k = int(np.searchsorted(self.get_times(), time, side='right')) - 1
+        if k < 0:
+            return 0.
+        return float(self.areas[k] + self.values[k] * (time - self.times[k]))
+
+    def time_weighted_mean(self, start: float, end: float) -> float:
+        if end <= start:
+            raise statistics.StatisticsError('time weighted mean requires end > start')
+        return (self.integral(end) - self.integral(start)) / (end - start)
+
+    def value_at(self, times: np.ndarray) -> np.ndarray:
+        # value of the step function at the given times, 0 before the first entry
+        positions = np.searchsorted(self.get_times(), times, side='right') - 1
+        return np.where(positions >= 0, self.get_values()[np.maximum(positions, 0)], 0)
+
+
+class RouteStatistics:
+    # statistics surface shared by the SimPy and the heap-based route implementations, expects
+    # name, route_code, junction_sim with a TrainStore, waiting_trains and the two generators;
+    # get_length_samples returns the minute readings
+    streaming = False
+
+    def init_statistics(self):
+        self.length_changes = TimeSeriesIndex()
+        self.length_changes.append(0., 0)
+        self.waiting_index = TimeSeriesIndex()
+
+    def enable_streaming(self, start: float, end: float):
+        # same interfaces, but only online accumulators over [start, end] are kept
+        self.streaming = True
+        self.length_samples = DiscreteStreamingSeries(start, end)
+        self.length_changes = StreamingStepSeries(start, end)
+        self.waiting_index = StreamingSeries(start, end)
+        self.inter_arrival_times = Welford()
+
+    def record_queue_length(self, time: float):
+        self.length_changes.append(time, len(self.waiting_trains))
+
+    def record_waiting_time(self, service_start: float, waiting_time: float):
+        # trains of a route finish in service order, so service starts arrive sorted
+        self.waiting_index.append(service_start, waiting_time)
+
+    def get_length_samples(self) -> TimeSeriesIndex:
+        raise NotImplementedError
+
+    @property
+    def lengths(self) -> Dict[float, int]:
+        samples = self.get_length_samples()
+        return dict(zip(samples.get_times().tolist(), samples.get_values().astype(int).tolist()))
+
+    @property
+    def arrival_rate(self):
+        return 1 / self.arrival_generator.get_mean() if hasattr(self.arrival_generator, 'get_mean') else np.nan
+
+    @property
+    def service_rate(self):
+        return 1 / self.service_generator.get_mean() if hasattr(self.service_generator, 'get_mean') else np.nan
+
+    def calc_length_of_queue(self, start=60, end=120):
+        return self.get_length_samples().window_mean(start, end)
+
+    def calc_time_weighted_length_of_queue(self, start=60, end=120):
+        # exact mean of the queue length over [start, end] instead of the one-minute readings
+        return self.length_changes.time_weighted_mean(start, end)
+
+    def get_finished_count(self) -> int:
+        return len(self.waiting_index)
+
+    def get_streaming_summary(self):
+        waiting_index, length_samples = self.waiting_index, self.get_length_samples()
+        data = {'mean_waiting_time_half_width': waiting_index.get_half_width(),
+                'queue_length_half_width': length_samples.get_half_width()}
+        data.update({f'waiting_time_p{round(100 * p)}': waiting_index.get_quantile(p) for p in waiting_index.quantile_levels})
+        data.update({f'queue_length_p{round(100 * p)}': length_samples.get_quantile(p) for p in length_samples.quantile_levels})
+        return data
+
+    def get_finished_rows(self) -> np.ndarray:
+        return self.junction_sim.trains.get_rows(self.route_code, TRAIN_FINISHED)
+
+    @property
+    def waiting_times(self) -> Dict[int, float]:
+        store = self.junction_sim.trains
+        rows = self.get_finished_rows()
+        return dict(zip(store.id[rows].tolist(), (store.service_start[rows] - store.arrival[rows]).tolist()))
+
+    @property
+    def service_times(self) -> Dict[int, float]:
+        store = self.junction_sim.trains
+        rows = self.get_finished_rows()
+        return dict(zip(store.id[rows].tolist(), (store.end[rows] - store.service_start[rows]).tolist()))
+
+    @property
+    def service_times_collection(self) -> List[float]:
+        store = self.junction_sim.trains
+        rows = store.get_rows(self.route_code)
+        return store.service_length[rows][store.status[rows] != TRAIN_WAITING].tolist()
+
+    def get_mean_waiting_time(self, start= 60, end = 120):
+        return self.waiting_index.window_mean(start, end)
+
+    def get_length_after_calculation(self):
+        # queue length of the finished trains at every reading: arrived before k, served at or after k;
+        # per route both columns are sorted, so this is one searchsorted pass
+        store = self.junction_sim.trains
+        rows = self.get_finished_rows()
+        read_times = self.get_length_samples().get_times()
+        lengths = (np.searchsorted(store.arrival[rows], read_times, side='left') -
+                   np.searchsorted(store.service_start[rows], read_times, side='left'))
+
+        return dict(zip(read_times.tolist(), lengths.tolist()))
+
+    def get_train(self, train_id):
+        return self.junction_sim.trains.get_train(train_id)
+
+
+class JunctionStatistics:
+    # export surface shared by JunctionSim and FastJunctionSim, expects routes and a TrainStore as trains
+    streaming = False
+
+    def enable_streaming(self, start=60, end=1200):
+        # call before run; finished trains are aggregated on the fly and dropped from the store
+        self.streaming = True
+        self.trains.keep_finished = False
+        for route in self.routes.values():
+            route.enable_streaming(start, end)
+
+    def export_trains(self):
+        return {train.id: train for train in self.trains.values()}
+
+    def export_trains_npz(self, path):
+        self.trains.save_npz(path)
+
+    def export_statistics(self, path, start=60, end=1200, additional_data={}, correctness_data={}):
+        ql = {k: r.calc_length_of_queue(start=start, end=end) for k, r in self.routes.items()}
+
+        try:
+            et_w = {k: r.get_mean_waiting_time(start=start, end=end) for k, r in self.routes.items()}
+        except:
+            et_w = {k: np.nan for k, r in self.routes.items()}
+
+        data = {r: {'queue_length_query': ql[r],
+                    'mean_waiting_time': et_w[r],
+                    'arrival_rate': self.routes[r].arrival_rate,
+                    'service_rate': self.routes[r].service_rate,
+                    'start_at': start,
+                    'end_at': end} for r in self.routes.keys()}
+        [v.update(additional_data) for v in data.values()]
+
+        if len(correctness_data) > 0:
+            [v.update(correctness_data[r]) for r, v in data.items()]
+
+        import pandas
+        df = pandas.DataFrame.from_dict(data)
+
+        df.to_csv(path, sep=';', decimal='.')
+
+    def export_statistics_dict(self,start=60, end=1200, additional_data={}, correctness_data={}):
+        ql = {k: r.calc_length_of_queue(start=start, end=end) for k, r in self.routes.items()}
+
+        route_data = {r: {'queue_length': ql[r]}
+                      for r in self.routes.keys()}
+        data = {'start_at': start,
+                'end_at': end}
+
+        data.update(additional_data)
+        if len(correctness_data) > 0:
+            [v.update(correctness_data[r]) for r, v in route_data.items()]
+
+        [data.update({f'{k}_{r}': v2 for k, v2 in v.items()}) for r, v in route_data.items()]
+
+        return data
+
+    def export_summary(self, start=60, end=1200, additional_data={}):
+        route_data = {}
+        for k, r in self.routes.items():
+            try:
+                mean_waiting_time = r.get_mean_waiting_time(start=start, end=end)
+            except statistics.StatisticsError:
+                mean_waiting_time = np.nan
+            route_data[k] = {'mean_waiting_time': mean_waiting_time,
+                             'time_weighted_queue_length': r.calc_time_weighted_length_of_queue(start, end),
+                             'finished_trains': r.get_finished_count()}
+            if self.streaming:
+                route_data[k].update(r.get_streaming_summary())
+
+        return self.export_statistics_dict(start, end, additional_data, route_data)
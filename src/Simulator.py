@@ -1,72 +1,290 @@
-
+import numpy as np
 import simpy
+from concurrent.futures import ProcessPoolExecutor
+from src.BatchJunctionSim import BatchJunctionSim
+from src.DispatchPolicy import DispatchPolicy, POLICY_RANDOM
+from src.FastJunctionSim import FastJunctionSim, FastRoute
+from src.Instrumentation import ProgressCallback
 from src.JunctionContainer import JunctionContainer
-from src.JunctionSim import JunctionSim
-from src.RouteSim import RouteSimAB, RouteSimAC, RouteSimBA, RouteSimCA
-from src.StatisticHelper import StatisticHelper
-from typing import Dict
+from src.JunctionSim import JunctionSim, DISPATCH_EVENT
+from src.JunctionLayout import JunctionLayout, FOUR_ROUTE_LAYOUT
+from src.JunctionSnapshot import JunctionSnapshot
+from src.RouteSim import RouteSim
+from src.SimDataTypes import ReplicationTask
+from src.StatisticHelper import StatisticHelper, SAMPLING_GAMMA
+from src.TraceReplay import ReplayTrace
+from typing import Dict, List, Sequence, Tuple, Union
+
+ROUTE_NAMES = tuple(FOUR_ROUTE_LAYOUT.routes)
+ARRIVAL_COV = 0.8
+SERVICE_COV = 0.3
+
+ENGINE_SIMPY = 'simpy'
+ENGINE_FAST = 'fast'
+# lockstep NumPy engine, only for run_replications
+ENGINE_BATCH = 'batch'
+ENGINES = (ENGINE_SIMPY, ENGINE_FAST, ENGINE_BATCH)
+# the engines that run one simulation at a time
+SINGLE_RUN_ENGINES = (ENGINE_SIMPY, ENGINE_FAST)
+
+Seed = Union[None, int, np.random.SeedSequence]
+# a POLICY_* name or a configured DispatchPolicy, None is the random policy
+Policy = Union[None, str, DispatchPolicy]
 
 
 class Simulator:
 
+    @staticmethod
+    def check_engine(engine: str, supported: Sequence[str] = SINGLE_RUN_ENGINES):
+        if engine not in ENGINES:
+            raise ValueError(f'unknown engine {engine!r}')
+        if engine not in supported:
+            raise ValueError(f'the {engine} engine only runs in run_replications, use one of {", ".join(supported)}')
+
+    @staticmethod
+    def check_snapshot_window(start: float, snapshots: Sequence[JunctionSnapshot]):
+        # a restored run has no history before its snapshot, readings there would count as empty queues
+        latest = max(snapshot.time for snapshot in snapshots)
+        if start < latest:
+            raise ValueError(f'the statistics window starts at {start}, before the snapshot time {latest}')
+
     @staticmethod
     def run_junction_sim(env: simpy.Environment,
                          junction: JunctionContainer,
                          route_service_rate: Dict[str, float],
-                         run_until: float = 120):
+                         run_until: float = 120,
+                         dispatch_mode: str = DISPATCH_EVENT,
+                         seed: Seed = None,
+                         log_progress: bool = True,
+                         arrival_cov: float = ARRIVAL_COV,
+                         service_cov: float = SERVICE_COV,
+                         engine: str = ENGINE_SIMPY,
+                         streaming_window: Tuple[float, float] = None,
+                         sampling: str = SAMPLING_GAMMA,
+                         progress_callback: ProgressCallback = None,
+                         instrumentation: bool = False,
+                         snapshot: JunctionSnapshot = None,
+                         policy: Policy = None):
+        Simulator.check_engine(engine)
+        if engine == ENGINE_FAST:
+            if instrumentation:
+                raise ValueError('instrumentation counts SimPy processes, it needs the simpy engine')
+            junction_sim = Simulator.create_junction_sim_fast(junction, route_service_rate, seed,
+                                                              arrival_cov, service_cov, sampling, policy)
+            if streaming_window is not None:
+                junction_sim.enable_streaming(*streaming_window)
+            if snapshot is not None:
+                if streaming_window is not None:
+                    Simulator.check_snapshot_window(streaming_window[0], [snapshot])
+                junction_sim.restore(snapshot)
+            junction_sim.run(run_until)
+            return junction_sim
+        if snapshot is not None:
+            raise ValueError('snapshots hold FastJunctionSim state, they need the fast engine')
 
-        junction_sim = Simulator.create_junction_sim_ph(env, junction, route_service_rate)
+        junction_sim = Simulator.create_junction_sim_ph(env, junction, route_service_rate, dispatch_mode, seed,
+                                                        arrival_cov, service_cov, sampling, policy)
+        if streaming_window is not None:
+            junction_sim.enable_streaming(*streaming_window)
+        if instrumentation:
+            junction_sim.enable_instrumentation()
 
-        junction_sim.run(run_until)
+        junction_sim.run(run_until, log_progress, progress_callback)
         env.run(until=run_until)
 
         return junction_sim
 
+    @staticmethod
+    def run_replications(junction: JunctionContainer,
+                         route_service_rate: Dict[str, float],
+                         n: int,
+                         workers: int = None,
+                         run_until: float = 1320,
+                         seed: Seed = None,
+                         start: float = 60,
+                         end: float = 1200,
+                         dispatch_mode: str = DISPATCH_EVENT,
+                         arrival_cov: float = ARRIVAL_COV,
+                         service_cov: float = SERVICE_COV,
+                         engine: str = ENGINE_SIMPY,
+                         streaming: bool = False,
+                         snapshots: Sequence[JunctionSnapshot] = None,
+                         policy: Policy = None) -> List[Dict[str, float]]:
+        # one spawned seed per replication, so the results do not depend on the number of workers;
+        # with snapshots replication i continues from snapshots[i % len(snapshots)] instead of an empty junction
+        Simulator.check_engine(engine, ENGINES)
+        seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        if snapshots and engine != ENGINE_BATCH:
+            Simulator.check_snapshot_window(start, snapshots)
+        if engine == ENGINE_BATCH:
+            if snapshots:
+                raise ValueError('snapshots hold FastJunctionSim state, they need the fast engine')
+            if policy not in (None, POLICY_RANDOM):
+                raise ValueError('the batch engine only dispatches with the random policy')
+            if dispatch_mode != DISPATCH_EVENT:
+                raise ValueError('the batch engine only dispatches on events')
+            if streaming:
+                raise ValueError('the batch engine has no streaming statistics')
+            if workers not in (None, 1):
+                raise ValueError('the batch engine runs all replications in this process, it takes no workers')
+            # all replications at once in this process, event mode dispatching
+            junction_sim = BatchJunctionSim(n, Simulator.get_route_arrival_rates(junction), route_service_rate,
+                                            FOUR_ROUTE_LAYOUT, seed_sequence, arrival_cov, service_cov, start, end)
+            junction_sim.run(run_until)
+            return junction_sim.export_summaries()
+        tasks = [ReplicationTask(junction, route_service_rate, run_until, dispatch_mode, child, start, end,
+                                 arrival_cov, service_cov, engine, {'replication': i}, streaming,
+                                 snapshot=snapshots[i % len(snapshots)] if snapshots else None, policy=policy)
+                 for i, child in enumerate(seed_sequence.spawn(n))]
+
+        return Simulator.run_tasks(tasks, workers)
+
+    @staticmethod
+    def run_tasks(tasks: List[ReplicationTask], workers: int = None) -> List[Dict[str, float]]:
+        if workers is not None and workers <= 1:
+            return [run_replication(task) for task in tasks]
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(run_replication, tasks, chunksize=max(1, len(tasks) // (4 * (workers or 8)))))
+
+    @staticmethod
+    def create_snapshot_pool(junction: JunctionContainer,
+                             route_service_rate: Dict[str, float],
+                             size: int,
+                             warmup: float,
+                             seed: Seed = None,
+                             arrival_cov: float = ARRIVAL_COV,
+                             service_cov: float = SERVICE_COV,
+                             sampling: str = SAMPLING_GAMMA) -> List[JunctionSnapshot]:
+        # the state of size independent fast engine runs after warmup minutes
+        seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        snapshots = []
+        for child in seed_sequence.spawn(size):
+            junction_sim = Simulator.create_junction_sim_fast(junction, route_service_rate, child, arrival_cov,
+                                                              service_cov, sampling)
+            junction_sim.run(warmup)
+            snapshots.append(junction_sim.get_snapshot())
+        return snapshots
+
+    @staticmethod
+    def spawn_streams(seed: Seed, route_names: Sequence[str] = ROUTE_NAMES) -> Dict[str, Dict[str, np.random.Generator]]:
+        # independent substreams for the scheduler and for each route's arrivals and services
+        seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        n = len(route_names)
+        # the children spawn() would return first, without advancing the sequence, so a SeedSequence
+        # reproduces the same streams every time it is passed in
+        children = [np.random.SeedSequence(seed_sequence.entropy, spawn_key=seed_sequence.spawn_key + (i,),
+                                           pool_size=seed_sequence.pool_size)
+                    for i in range(1 + 2 * n)]
+        return {'scheduler': np.random.default_rng(children[0]),
+                'arrival': {r: np.random.default_rng(c) for r, c in zip(route_names, children[1:1 + n])},
+                'service': {r: np.random.default_rng(c) for r, c in zip(route_names, children[1 + n:1 + 2 * n])}}
+
+    @staticmethod
+    def get_route_arrival_rates(junction: JunctionContainer) -> Dict[str, float]:
+        # the four route model: main branch trains run a-b and b-a, side branch trains a-c and c-a
+        main_rate = junction.main_branch_mix.get_arrival_rate(junction.time_frame)
+        side_rate = junction.side_branch_mix.get_arrival_rate(junction.time_frame)
+        return {'a-b': main_rate, 'a-c': side_rate, 'b-a': main_rate, 'c-a': side_rate}
+
+    @staticmethod
+    def create_junction_sim_fast(junction, route_service_rate, seed: Seed = None,
+                                 arrival_cov: float = ARRIVAL_COV, service_cov: float = SERVICE_COV,
+                                 sampling: str = SAMPLING_GAMMA, policy: Policy = None):
+        return Simulator.create_layout_sim_fast(FOUR_ROUTE_LAYOUT, Simulator.get_route_arrival_rates(junction),
+                                                route_service_rate, seed, arrival_cov, service_cov, sampling, policy)
+
+    @staticmethod
+    def create_junction_sim_ph(env, junction, route_service_rate, dispatch_mode: str = DISPATCH_EVENT,
+                               seed: Seed = None, arrival_cov: float = ARRIVAL_COV, service_cov: float = SERVICE_COV,
+                               sampling: str = SAMPLING_GAMMA, policy: Policy = None):
+        return Simulator.create_layout_sim_ph(env, FOUR_ROUTE_LAYOUT, Simulator.get_route_arrival_rates(junction),
+                                              route_service_rate, dispatch_mode, seed, arrival_cov, service_cov,
+                                              sampling, policy)
+
+    @staticmethod
+    def create_layout_sim_fast(layout: JunctionLayout,
+                               route_arrival_rate: Dict[str, float],
+                               route_service_rate: Dict[str, float],
+                               seed: Seed = None,
+                               arrival_cov: float = ARRIVAL_COV,
+                               service_cov: float = SERVICE_COV,
+                               sampling: str = SAMPLING_GAMMA,
+                               policy: Policy = None):
+        streams = Simulator.spawn_streams(seed, layout.routes)
+        junction_sim = FastJunctionSim(streams['scheduler'], layout, policy)
+        for route in layout.routes:
+            junction_sim.add_route(FastRoute(route,
+                                             StatisticHelper.get_ph_generator_from_rate_and_cov(
+                                                 route_arrival_rate[route], arrival_cov, streams['arrival'][route],
+                                                 sampling),
+                                             StatisticHelper.get_ph_generator_from_rate_and_cov(
+                                                 route_service_rate[route], service_cov, streams['service'][route],
+                                                 sampling),
+                                             junction_sim))
+        junction_sim.add_resources()
+
+        return junction_sim
+
+    @staticmethod
+    def create_layout_sim_ph(env: simpy.Environment,
+                             layout: JunctionLayout,
+                             route_arrival_rate: Dict[str, float],
+                             route_service_rate: Dict[str, float],
+                             dispatch_mode: str = DISPATCH_EVENT,
+                             seed: Seed = None,
+                             arrival_cov: float = ARRIVAL_COV,
+                             service_cov: float = SERVICE_COV,
+                             sampling: str = SAMPLING_GAMMA,
+                             policy: Policy = None):
+        streams = Simulator.spawn_streams(seed, layout.routes)
+        junction_sim = JunctionSim(env, dispatch_mode, streams['scheduler'], layout, policy)
+        for route in layout.routes:
+            junction_sim.add_route(RouteSim(env,
+                                            route,
+                                            StatisticHelper.get_ph_generator_from_rate_and_cov(
+                                                route_arrival_rate[route], arrival_cov, streams['arrival'][route],
+                                                sampling),
+                                            StatisticHelper.get_ph_generator_from_rate_and_cov(
+                                                route_service_rate[route], service_cov, streams['service'][route],
+                                                sampling),
+                                            junction_sim))
+
+        junction_sim.add_resources()
+
+        return junction_sim
 
     @staticmethod
-    def create_junction_sim_ph(env, junction, route_service_rate):
-        junction_sim = JunctionSim(env)
-        route_ab = RouteSimAB(env,
-                              'a-b',
-                              StatisticHelper.get_ph_generator_from_rate_and_cov(
-                                  junction.main_branch_mix.get_arrival_rate(junction.time_frame),
-                                  0.8),
-                              StatisticHelper.get_ph_generator_from_rate_and_cov(
-                                  route_service_rate['a-b'],
-                                  0.3),
-                              junction_sim)
-        route_ac = RouteSimAC(env,
-                              'a-c',
-                              StatisticHelper.get_ph_generator_from_rate_and_cov(
-                                  junction.side_branch_mix.get_arrival_rate(junction.time_frame),
-                                  0.8),
-                              StatisticHelper.get_ph_generator_from_rate_and_cov(
-                                  route_service_rate['a-c'],
-                                  0.3),
-                              junction_sim)
-        route_ba = RouteSimBA(env,
-                              'b-a',
-                              StatisticHelper.get_ph_generator_from_rate_and_cov(
-                                  junction.main_branch_mix.get_arrival_rate(junction.time_frame),
-                                  0.8),
-                              StatisticHelper.get_ph_generator_from_rate_and_cov(
-                                  route_service_rate['b-a'],
-                                  0.3),
-                              junction_sim)
-        route_ca = RouteSimCA(env,
-                              'c-a',
-                              StatisticHelper.get_ph_generator_from_rate_and_cov(
-                                  junction.side_branch_mix.get_arrival_rate(junction.time_frame),
-                                  0.8),
-                              StatisticHelper.get_ph_generator_from_rate_and_cov(
-                                  route_service_rate['c-a'],
-                                  0.3),
-                              junction_sim)
-        junction_sim.add_route(route_ab)
-        junction_sim.add_route(route_ac)
-        junction_sim.add_route(route_ba)
-        junction_sim.add_route(route_ca)
+    def create_replay_sim_fast(trace: ReplayTrace, layout: JunctionLayout = FOUR_ROUTE_LAYOUT, seed: Seed = None,
+                               policy: Policy = None):
+        # recorded arrivals and occupation times instead of PH samples, the seed only drives the dispatcher
+        junction_sim = FastJunctionSim(Simulator.spawn_streams(seed, layout.routes)['scheduler'], layout, policy)
+        for route in layout.routes:
+            junction_sim.add_route(FastRoute(route, trace.get_arrival_generator(route),
+                                             trace.get_service_generator(route), junction_sim))
+        junction_sim.add_resources()
+
+        return junction_sim
 
+    @staticmethod
+    def create_replay_sim_ph(env: simpy.Environment, trace: ReplayTrace, layout: JunctionLayout = FOUR_ROUTE_LAYOUT,
+                             dispatch_mode: str = DISPATCH_EVENT, seed: Seed = None, policy: Policy = None):
+        junction_sim = JunctionSim(env, dispatch_mode, Simulator.spawn_streams(seed, layout.routes)['scheduler'],
+                                   layout, policy)
+        for route in layout.routes:
+            junction_sim.add_route(RouteSim(env, route, trace.get_arrival_generator(route),
+                                            trace.get_service_generator(route), junction_sim))
         junction_sim.add_resources()
 
-        return junction_sim
\ No newline at end of file
+        return junction_sim
+
+
+def run_replication(task: ReplicationTask) -> Dict[str, float]:
+    # module level so it can be pickled into the worker processes
+    junction_sim = Simulator.run_junction_sim(simpy.Environment(), task.junction, task.route_service_rate,
+                                              task.run_until, task.dispatch_mode, task.seed, log_progress=False,
+                                              arrival_cov=task.arrival_cov, service_cov=task.service_cov,
+                                              engine=task.engine,
+                                              streaming_window=(task.start, task.end) if task.streaming else None,
+                                              sampling=task.sampling, snapshot=task.snapshot, policy=task.policy)
+    return junction_sim.export_summary(task.start, task.end, task.additional_data)
@@ -0,0 +1,160 @@
+import math
+import statistics
+import time
+
+import numpy as np
+from src.JunctionContainer import JunctionContainer
+from src.JunctionSnapshot import JunctionSnapshot
+from src.SimDataTypes import SplittingResult
+from src.Simulator import Simulator, Seed, Policy, ARRIVAL_COV, SERVICE_COV
+from src.StatisticHelper import StatisticHelper
+from typing import Dict, List, Sequence, Tuple
+
+SPLIT_QUEUE_LENGTH = 'queue_length'
+SPLIT_WAITING_TIME = 'waiting_time'
+SPLITTING_BLOCK_SIZE = 64
+
+
+class SplittingEstimator:
+    # fixed-effort multilevel splitting for the probability that the importance of a route reaches the last of
+    # levels before horizon: the queue length, or the time the oldest waiting train has waited so far, which
+    # exceeds a waiting time level exactly when some train waits longer. Stage k starts effort trajectories
+    # from the states in which stage k - 1 reached its level and runs them until they reach level k or the
+    # horizon; the product of the stage fractions is unbiased. The variance comes from independent repetitions
+    def __init__(self,
+                 junction: JunctionContainer,
+                 route_service_rate: Dict[str, float],
+                 route: str,
+                 levels: Sequence[float],
+                 importance: str = SPLIT_QUEUE_LENGTH,
+                 horizon: float = 1320,
+                 effort: int = 200,
+                 repetitions: int = 10,
+                 confidence: float = 0.95,
+                 seed: Seed = None,
+                 arrival_cov: float = ARRIVAL_COV,
+                 service_cov: float = SERVICE_COV,
+                 policy: Policy = None):
+        if importance not in (SPLIT_QUEUE_LENGTH, SPLIT_WAITING_TIME):
+            raise ValueError(f'unknown importance function {importance!r}')
+        if list(levels) != sorted(levels) or len(set(levels)) != len(levels):
+            raise ValueError('levels must be increasing')
+        self.junction = junction
+        self.route_service_rate = route_service_rate
+        self.route = route
+        self.levels = list(levels)
+        self.importance = importance
+        self.horizon = horizon
+        self.effort = effort
+        self.repetitions = repetitions
+        self.confidence = confidence
+        self.seed = seed
+        self.arrival_cov = arrival_cov
+        self.service_cov = service_cov
+        self.policy = policy
+
+    def create_junction_sim(self, seed: np.random.SeedSequence, snapshot: JunctionSnapshot = None):
+        junction_sim = Simulator.create_junction_sim_fast(self.junction, self.route_service_rate, seed,
+                                                          self.arrival_cov, self.service_cov, policy=self.policy)
+        for route in junction_sim.route_list:
+            # a trajectory draws few samples, small blocks keep starting one cheap
+            route.arrival_generator.block_size = route.service_generator.block_size = SPLITTING_BLOCK_SIZE
+        if snapshot is not None:
+            # the clone keeps the pending clocks, the state of the process, and draws everything later fresh
+            junction_sim.restore(snapshot, resample=False, continue_streams=False)
+        return junction_sim
+
+    def advance(self, junction_sim, level: float) -> bool:
+        # runs until the importance reaches level, True, or until the horizon, False
+        route_index = list(junction_sim.routes).index(self.route)
+        stop_levels = [math.inf] * len(junction_sim.route_list)
+        if self.importance == SPLIT_QUEUE_LENGTH:
+            stop_levels[route_index] = level
+            junction_sim.stop_levels = stop_levels
+            return junction_sim.run(self.horizon)
+
+        route, trains = junction_sim.route_list[route_index], junction_sim.trains
+        stop_levels[route_index] = 1
+        while junction_sim.now < self.horizon:
+            if not route.waiting_trains:
+                # until a train of the route has to wait
+                junction_sim.stop_levels = stop_levels
+                if not junction_sim.run(self.horizon):
+                    return False
+                continue
+            # a later head of the queue arrived later, so the current one reaches the level first
+            crossing = float(trains.arrival[trains.get_row(route.waiting_trains[0])]) + level
+            junction_sim.stop_levels = None
+            junction_sim.run(min(crossing, self.horizon))
+            if (route.waiting_trains and junction_sim.now < self.horizon and
+                    float(trains.arrival[trains.get_row(route.waiting_trains[0])]) + level <= junction_sim.now):
+                return True
+        return False
+
+    def run_trajectory(self, seed: np.random.SeedSequence, snapshot: JunctionSnapshot, level: float):
+        junction_sim = self.create_junction_sim(seed, snapshot)
+        started = junction_sim.now
+        reached = self.advance(junction_sim, level)
+        return junction_sim.get_snapshot() if reached else None, junction_sim.now - started
+
+    def run_repetition(self, seed_sequence: np.random.SeedSequence,
+                       rng: np.random.Generator) -> Tuple[List, int, float]:
+        # one fixed-effort estimate, the stage probabilities, the trajectories run and the simulated minutes;
+        # a stage without hits ends the repetition early
+        stage_probabilities = []
+        trajectories = 0
+        simulated_minutes = 0.
+        entrances: List[JunctionSnapshot] = [None]
+        for level in self.levels:
+            # every entrance state gets the same number of trajectories, the remainder goes to random ones
+            starts = entrances * (self.effort // len(entrances))
+            starts += [entrances[k] for k in rng.choice(len(entrances), self.effort % len(entrances), replace=False)]
+            hits = []
+            for snapshot, seed in zip(starts, seed_sequence.spawn(self.effort)):
+                hit, minutes = self.run_trajectory(seed, snapshot, level)
+                trajectories += 1
+                simulated_minutes += minutes
+                if hit is not None:
+                    hits.append(hit)
+            stage_probabilities.append(len(hits) / self.effort)
+            if not hits:
+                stage_probabilities += [0.] * (len(self.levels) - len(stage_probabilities))
+                break
+            entrances = hits
+        return stage_probabilities, trajectories, simulated_minutes
+
+    def run(self) -> SplittingResult:
+        started = time.perf_counter()
+        seed_sequence = self.seed if isinstance(self.seed, np.random.SeedSequence) else np.random.SeedSequence(self.seed)
+        rng = np.random.default_rng(seed_sequence.spawn(1)[0])
+        estimates, stages, trajectories, simulated_minutes = [], [], 0, 0.
+        for child in seed_sequence.spawn(self.repetitions):
+            stage_probabilities, count, minutes = self.run_repetition(child, rng)
+            estimates.append(math.prod(stage_probabilities))
+            stages.append(stage_probabilities)
+            trajectories += count
+            simulated_minutes += minutes
+        return SplittingEstimator.get_result(estimates, np.mean(stages, axis=0).tolist(), trajectories,
+                                             simulated_minutes, time.perf_counter() - started, self.confidence)
+
+    def run_brute_force(self, replications: int) -> SplittingResult:
+        # plain replications up to the first passage of the last level, for comparison
+        started = time.perf_counter()
+        seed_sequence = self.seed if isinstance(self.seed, np.random.SeedSequence) else np.random.SeedSequence(self.seed)
+        hits, simulated_minutes = [], 0.
+        for child in seed_sequence.spawn(replications):
+            hit, minutes = self.run_trajectory(child, None, self.levels[-1])
+            hits.append(float(hit is not None))
+            simulated_minutes += minutes
+        return SplittingEstimator.get_result(hits, [statistics.fmean(hits)], replications, simulated_minutes,
+                                             time.perf_counter() - started, self.confidence)
+
+    @staticmethod
+    def get_result(estimates: List[float], stage_probabilities: List[float], trajectories: int,
+                   simulated_minutes: float, seconds: float, confidence: float) -> SplittingResult:
+        probability = statistics.fmean(estimates)
+        standard_error = statistics.stdev(estimates) / math.sqrt(len(estimates)) if len(estimates) > 1 else math.nan
+        return SplittingResult(probability, standard_error,
+                               StatisticHelper.get_confidence_half_width(estimates, confidence),
+                               standard_error / probability if probability > 0 else math.nan,
+                               stage_probabilities, len(estimates), trajectories, simulated_minutes, seconds)
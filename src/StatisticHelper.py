@@ -1,13 +1,144 @@
+import functools
 import math
-import ciw
+import statistics
+import numpy as np
 from collections import namedtuple
+from typing import Dict
 
 ErlangParameter = namedtuple('ErlangParameter', ['k', 'rate'])
 
+PH_BLOCK_SIZE = 1024
+# the blocks start small and double up to the block size, a short run does not draw a full block it never uses
+PH_FIRST_BLOCK_SIZE = 64
+
+# numpy's gamma sampler, or the Erlang phases by inversion as -log(U) or antithetic as -log(1 - U)
+SAMPLING_GAMMA = 'gamma'
+SAMPLING_INVERSION = 'inversion'
+SAMPLING_ANTITHETIC = 'antithetic'
+
+
+class PHSampler:
+    # sum of two Erlang phases (Coxian with probs [0, ..., 0, 1]) drawn in vectorized blocks
+    def __init__(self,
+                 erlang_para_A: ErlangParameter,
+                 erlang_para_B: ErlangParameter,
+                 rng: np.random.Generator = None,
+                 block_size: int = PH_BLOCK_SIZE,
+                 sampling: str = SAMPLING_GAMMA):
+        if sampling not in (SAMPLING_GAMMA, SAMPLING_INVERSION, SAMPLING_ANTITHETIC):
+            raise ValueError(f'unknown sampling {sampling!r}')
+        self.erlang_para_A = erlang_para_A
+        self.erlang_para_B = erlang_para_B
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.sampling = sampling
+        self.block_size = block_size
+        self.next_block_size = PH_FIRST_BLOCK_SIZE
+        self.buffer = []
+
+    def __call__(self, x=1) -> float:
+        # the block is kept reversed, popping from the end serves it in order
+        if not self.buffer:
+            size = min(self.next_block_size, self.block_size)
+            self.next_block_size = 2 * size
+            self.buffer = self.sample_block(size)[::-1].tolist()
+        return self.buffer.pop()
+
+    def sample_block(self, size: int) -> np.ndarray:
+        if self.sampling != SAMPLING_GAMMA:
+            samples = self.sample_erlang_by_inversion(self.erlang_para_A, size)
+            if self.erlang_para_B.k > 0:
+                samples += self.sample_erlang_by_inversion(self.erlang_para_B, size)
+            return samples
+        samples = self.rng.gamma(self.erlang_para_A.k, 1 / self.erlang_para_A.rate, size)
+        if self.erlang_para_B.k > 0:
+            samples += self.rng.gamma(self.erlang_para_B.k, 1 / self.erlang_para_B.rate, size)
+        return samples
+
+    def sample_erlang_by_inversion(self, erlang_para: ErlangParameter, size: int) -> np.ndarray:
+        uniforms = self.rng.random((size, erlang_para.k))
+        if self.sampling == SAMPLING_ANTITHETIC:
+            uniforms = 1 - uniforms
+        return -np.log(np.maximum(uniforms, np.finfo(float).tiny)).sum(axis=1) / erlang_para.rate
+
+    def get_mean(self) -> float:
+        return float(np.sum(1 / self.get_phase_rates()))
+
+    def get_phase_rates(self) -> np.ndarray:
+        para_A, para_B = self.erlang_para_A, self.erlang_para_B
+        return np.array([para_A.rate] * para_A.k + [para_B.rate] * para_B.k)
+
+    def sample_remaining(self, age: float) -> float:
+        # remaining time of a sample known to exceed age: the phase at age, then the rest of that phase and
+        # the later phases, which are exponential
+        rates = self.get_phase_rates()
+        phase = self.rng.choice(len(rates), p=PHSampler.get_phase_probabilities(rates, age))
+        return float(self.rng.exponential(1 / rates[phase:]).sum())
+
+    @staticmethod
+    def get_phase_probabilities(rates: np.ndarray, age: float) -> np.ndarray:
+        # distribution of the current phase after age, given the sample has not ended, by uniformization
+        k = len(rates)
+        uniform_rate = rates.max()
+        mean = uniform_rate * age
+        jump = rates / uniform_rate
+        state = np.zeros(k + 1)
+        state[0] = 1.
+        probabilities = np.zeros(k + 1)
+        for n in range(int(mean + 10 * math.sqrt(mean)) + 11):
+            weight = math.exp(n * math.log(mean) - mean - math.lgamma(n + 1)) if mean > 0 else float(n == 0)
+            probabilities += weight * state
+            moved = state[:k] * jump
+            state[:k] -= moved
+            state[1:] += moved
+        probabilities = probabilities[:k]
+        if not probabilities.sum() > 0:
+            # far beyond the support, the sample is in its last phase
+            probabilities[-1] = 1.
+        return probabilities / probabilities.sum()
+
+    def get_state(self) -> Dict:
+        # the generator state, the unused rest of the block and the next block size, enough to continue the exact
+        # same stream
+        return {'rng': self.rng.bit_generator.state,
+                'buffer': self.buffer[::-1],
+                'next_block_size': self.next_block_size}
+
+    def set_state(self, state: Dict):
+        self.rng.bit_generator.state = state['rng']
+        self.buffer = list(state['buffer'])[::-1]
+        self.next_block_size = state['next_block_size']
+
+
+class IndexSampler:
+    # uniform index in range(n) for the scheduler tie-breaking, served from a block of uniforms
+    def __init__(self, rng: np.random.Generator = None, block_size: int = PH_BLOCK_SIZE):
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.block_size = block_size
+        self.buffer = []
+
+    def __call__(self, n: int) -> int:
+        if not self.buffer:
+            self.buffer = self.rng.random(self.block_size)[::-1].tolist()
+        return int(self.buffer.pop() * n)
+
+    def get_state(self) -> Dict:
+        return {'rng': self.rng.bit_generator.state, 'buffer': self.buffer[::-1]}
+
+    def set_state(self, state: Dict):
+        self.rng.bit_generator.state = state['rng']
+        self.buffer = list(state['buffer'])[::-1]
+
+
 class StatisticHelper:
 
     @staticmethod
-    def get_ph_generator_from_rate_and_cov(rate: float, coefficient_of_var: float = 0.3):
+    def get_ph_generator_from_rate_and_cov(rate: float, coefficient_of_var: float = 0.3,
+                                           rng: np.random.Generator = None, sampling: str = SAMPLING_GAMMA):
+        para_1, para_2 = StatisticHelper.fit_hypoexponential(1 / rate, coefficient_of_var)
+        return PHSampler(para_1, para_2, rng, sampling=sampling)
+
+    @staticmethod
+    def get_ciw_ph_generator_from_rate_and_cov(rate: float, coefficient_of_var: float = 0.3):
         para_1, para_2 = StatisticHelper.fit_hypoexponential(1 / rate, coefficient_of_var)
         c_x = StatisticHelper.get_cox_dist_by_erlang_para_pair(para_1, para_2)
         return lambda x: c_x._sample()
@@ -18,10 +149,13 @@ class StatisticHelper:
         probs = [0.] * (k_tot - 1) + [1]
         rates = [erlang_para_A.rate] * erlang_para_A.k + [erlang_para_B.rate] * erlang_para_B.k
 
+        # ciw pulls in networkx and tqdm, only load it for the ciw distributions
+        import ciw
         Cx = ciw.dists.Coxian(rates=rates, probs=probs)
         return Cx
 
     @staticmethod
+    @functools.lru_cache(maxsize=None)
     def fit_hypoexponential(mean: float, coeff_of_var: float):
         # see PhdThesis Weik, §3.2 (p.29)
         # see also sommereder, 2011
@@ -39,8 +173,30 @@ class StatisticHelper:
         E_B = (mean / (E_A_star + E_B_star)) * E_B_star
 
         rate_A = k_A / E_A
-        rate_B = k_B / E_B
+        # cov >= 1 leaves a single exponential phase
+        rate_B = k_B / E_B if k_B > 0 else 0.
 
         return ErlangParameter(k_A, rate_A), ErlangParameter(k_B, rate_B)
 
+    @staticmethod
+    def get_t_quantile(p: float, df: int) -> float:
+        # p-quantile of Student's t, exact for df <= 2 and the Cornish-Fisher expansion
+        # (Abramowitz and Stegun 26.7.5) above, within 0.2 % for df >= 3
+        if df == 1:
+            return math.tan(math.pi * (p - 0.5))
+        if df == 2:
+            return (2 * p - 1) / math.sqrt(2 * p * (1 - p))
+        z = statistics.NormalDist().inv_cdf(p)
+        g1 = (z ** 3 + z) / 4
+        g2 = (5 * z ** 5 + 16 * z ** 3 + 3 * z) / 96
+        g3 = (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / 384
+        g4 = (79 * z ** 9 + 776 * z ** 7 + 1482 * z ** 5 - 1920 * z ** 3 - 945 * z) / 92160
+        return z + g1 / df + g2 / df ** 2 + g3 / df ** 3 + g4 / df ** 4
 
+    @staticmethod
+    def get_confidence_half_width(values, confidence: float = 0.95) -> float:
+        # half-width of the t confidence interval of the mean of independent values
+        n = len(values)
+        if n < 2:
+            return math.nan
+        return StatisticHelper.get_t_quantile((1 + confidence) / 2, n - 1) * statistics.stdev(values) / math.sqrt(n)
@@ -0,0 +1,270 @@
+import bisect
+import math
+import statistics
+
+from src.StatisticHelper import StatisticHelper
+from typing import Dict, List, Sequence
+
+STREAMING_QUANTILES = (0.5, 0.9, 0.95)
+MAX_BATCHES = 64
+# the batch means only give a valid confidence interval once the batches are long enough to be nearly
+# independent; below MIN_BATCHES or above the lag-1 autocorrelation limit they are not trusted
+MIN_BATCHES = 20
+MAX_BATCH_AUTOCORRELATION = 0.2
+
+
+def check_window(series, start: float, end: float):
+    # the accumulators only hold the window they were created for
+    if (start, end) != (series.start, series.end):
+        raise ValueError(f'streaming statistics only cover the window [{series.start}, {series.end}], '
+                         f'not [{start}, {end}]')
+
+
+def get_overlap(a: float, b: float, start: float, end: float) -> float:
+    return max(0., min(b, end) - max(a, start))
+
+
+class Welford:
+    # running mean and variance, append mirrors list.append so it can replace the collected lists
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.
+        self.m2 = 0.
+
+    def append(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def append_repeated(self, value: float, count: int):
+        # merge of count equal values (Chan et al.)
+        total = self.count + count
+        delta = value - self.mean
+        self.mean += delta * count / total
+        self.m2 += delta * delta * self.count * count / total
+        self.count = total
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / (self.count - 1) if self.count > 1 else math.nan
+
+
+class BatchMeans:
+    # means of consecutive batches; at max_batches neighbouring batches are merged and the batch size doubles
+    def __init__(self, max_batches: int = MAX_BATCHES, batch_size: int = 1):
+        self.max_batches = max_batches
+        self.batch_size = batch_size
+        self.means: List[float] = []
+        self.batch_sum = 0.
+        self.batch_count = 0
+
+    def append(self, value: float):
+        self.batch_sum += value
+        self.batch_count += 1
+        if self.batch_count == self.batch_size:
+            self.close_batch()
+
+    def append_repeated(self, value: float, count: int):
+        while count > 0:
+            take = min(count, self.batch_size - self.batch_count)
+            self.batch_sum += value * take
+            self.batch_count += take
+            count -= take
+            if self.batch_count == self.batch_size:
+                self.close_batch()
+
+    def close_batch(self):
+        self.means.append(self.batch_sum / self.batch_size)
+        self.batch_sum = 0.
+        self.batch_count = 0
+        if len(self.means) == self.max_batches:
+            self.means = [(a + b) / 2 for a, b in zip(self.means[::2], self.means[1::2])]
+            self.batch_size *= 2
+
+    def get_half_width(self, level: float = 0.95) -> float:
+        return StatisticHelper.get_confidence_half_width(self.means, level)
+
+    def get_autocorrelation(self) -> float:
+        # lag-1 autocorrelation of the batch means, 0 for constant means
+        if len(self.means) < 3:
+            return math.nan
+        mean = statistics.fmean(self.means)
+        deviations = [m - mean for m in self.means]
+        variance = math.fsum(d * d for d in deviations)
+        if variance == 0:
+            return 0.
+        return math.fsum(a * b for a, b in zip(deviations, deviations[1:])) / variance
+
+    def is_independent(self, min_batches: int = MIN_BATCHES,
+                       max_autocorrelation: float = MAX_BATCH_AUTOCORRELATION) -> bool:
+        return len(self.means) >= min_batches and self.get_autocorrelation() <= max_autocorrelation
+
+
+class P2Quantile:
+    # P-square estimate of the p-quantile with five markers (Jain and Chlamtac 1985)
+    def __init__(self, p: float):
+        self.p = p
+        self.count = 0
+        self.heights: List[float] = []
+        self.positions = [1, 2, 3, 4, 5]
+        # desired marker positions are 1 + (count - 1) * increment
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def append(self, value: float):
+        self.count += 1
+        q = self.heights
+        if self.count <= 5:
+            bisect.insort(q, value)
+            return
+
+        n = self.positions
+        if value < q[0]:
+            q[0] = value
+            k = 1
+        elif value >= q[4]:
+            q[4] = value
+            k = 4
+        else:
+            k = bisect.bisect_right(q, value)
+        for i in range(k, 5):
+            n[i] += 1
+
+        scale = self.count - 1
+        increments = self.increments
+        for i in (1, 2, 3):
+            d = 1 + scale * increments[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                        (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+                        (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def get_value(self) -> float:
+        if self.count == 0:
+            return math.nan
+        if self.count <= 5:
+            return self.heights[min(self.count - 1, int(self.p * self.count))]
+        return self.heights[2]
+
+
+class StreamingSeries:
+    # drop-in for TimeSeriesIndex that only aggregates the values with time in [start, end]
+    def __init__(self, start: float, end: float, quantiles: Sequence[float] = STREAMING_QUANTILES):
+        self.start = start
+        self.end = end
+        self.seen = 0
+        self.moments = Welford()
+        self.batches = BatchMeans()
+        self.quantile_levels = tuple(quantiles)
+        self.quantiles: Dict[float, P2Quantile] = {p: P2Quantile(p) for p in quantiles}
+
+    def append(self, time: float, value: float):
+        self.seen += 1
+        if self.start <= time <= self.end:
+            self.add(value)
+
+    def add(self, value: float):
+        self.moments.append(value)
+        self.batches.append(value)
+        for quantile in self.quantiles.values():
+            quantile.append(value)
+
+    def add_repeated(self, value: float, count: int):
+        for _ in range(count):
+            self.add(value)
+
+    def __len__(self):
+        return self.seen
+
+    def window_count(self, start: float, end: float) -> int:
+        check_window(self, start, end)
+        return self.moments.count
+
+    def window_mean(self, start: float, end: float) -> float:
+        check_window(self, start, end)
+        if self.moments.count == 0:
+            raise statistics.StatisticsError('mean requires at least one data point')
+        return self.moments.mean
+
+    def get_half_width(self, level: float = 0.95) -> float:
+        return self.batches.get_half_width(level)
+
+    def get_quantile(self, p: float) -> float:
+        return self.quantiles[p].get_value()
+
+
+class DiscreteStreamingSeries(StreamingSeries):
+    # integer valued series like the queue length readings: a value histogram gives exact quantiles
+    # in memory bounded by the largest value, and runs of equal readings are added at once
+    def __init__(self, start: float, end: float, quantiles: Sequence[float] = STREAMING_QUANTILES):
+        super().__init__(start, end, ())
+        self.quantile_levels = tuple(quantiles)
+        self.counts: Dict[int, int] = {}
+
+    def add(self, value: int):
+        self.moments.append(value)
+        self.batches.append(value)
+        self.counts[value] = self.counts.get(value, 0) + 1
+
+    def add_repeated(self, value: int, count: int):
+        self.moments.append_repeated(value, count)
+        self.batches.append_repeated(value, count)
+        self.counts[value] = self.counts.get(value, 0) + count
+
+    def get_quantile(self, p: float) -> float:
+        if self.moments.count == 0:
+            return math.nan
+        cumulative = 0
+        for value in sorted(self.counts):
+            cumulative += self.counts[value]
+            if cumulative >= p * self.moments.count:
+                return value
+
+
+class StreamingStepSeries:
+    # drop-in for the queue length change log: integrates the step function over [start, end] and
+    # optionally feeds the readings every minutes_between_read into samples
+    def __init__(self, start: float, end: float, samples: StreamingSeries = None,
+                 minutes_between_read: float = 1.):
+        self.start = start
+        self.end = end
+        self.samples = samples
+        self.minutes_between_read = minutes_between_read
+        self.read_count = 0
+        self.last_time = 0.
+        self.last_value = 0
+        self.area = 0.
+
+    def append(self, time: float, value: float):
+        if self.samples is not None:
+            self.read_until(time)
+        self.area += self.last_value * get_overlap(self.last_time, time, self.start, self.end)
+        self.last_time = time
+        self.last_value = value
+
+    def read_until(self, time: float):
+        # readings strictly before time see the current value, like FastJunctionSim.get_read_times
+        interval = self.minutes_between_read
+        last_read = math.ceil(time / interval) - 1
+        if last_read <= self.read_count:
+            return
+        first = max(self.read_count + 1, math.ceil(self.start / interval))
+        last = min(last_read, math.floor(self.end / interval)) if math.isfinite(self.end) else last_read
+        if last >= first:
+            self.samples.add_repeated(self.last_value, last - first + 1)
+        self.samples.seen += last_read - self.read_count
+        self.read_count = last_read
+
+    def time_weighted_mean(self, start: float, end: float) -> float:
+        check_window(self, start, end)
+        if end <= start:
+            raise statistics.StatisticsError('time weighted mean requires end > start')
+        return (self.area + self.last_value * get_overlap(self.last_time, end, start, end)) / (end - start)
@@ -0,0 +1,51 @@
+from unittest import TestCase
+
+import numpy as np
+from src.BatchJunctionSim import BatchJunctionSim
+from src.CapacitySearch import CapacitySearch
+from src.JunctionContainer import JunctionContainer, TrainMixContainer
+from src.JunctionSim import DISPATCH_POLLING
+from src.JunctionLayout import JunctionLayout
+from src.SequentialRunner import SequentialRunner
+from src.Simulator import Simulator, ENGINE_BATCH, ENGINE_FAST
+
+
+class TestBatchJunctionSim(TestCase):
+    junction = JunctionContainer(TrainMixContainer(6, 0, 0, 0), TrainMixContainer(6, 0, 0, 0), 't', 't2', 60)
+    route_service_rate = {'a-b': 0.3, 'a-c': 0.3, 'b-a': 0.3, 'c-a': 0.3}
+
+    def test_mm1(self):
+        # single route with exponential times, mean waiting time rho / (mu - lambda) = 1
+        layout = JunctionLayout(['x'])
+        junction_sim = BatchJunctionSim(400, {'x': 0.5}, {'x': 1.}, layout, seed=0, arrival_cov=1., service_cov=1.,
+                                        start=200, end=2200)
+        junction_sim.run(2400)
+        summaries = junction_sim.export_summaries()
+        self.assertAlmostEqual(np.mean([s['mean_waiting_time_x'] for s in summaries]), 1., delta=0.05)
+        self.assertAlmostEqual(np.mean([s['time_weighted_queue_length_x'] for s in summaries]), 0.5, delta=0.03)
+
+    def test_matches_fast_engine(self):
+        batch = Simulator.run_replications(self.junction, self.route_service_rate, 400, seed=1, engine=ENGINE_BATCH)
+        fast = Simulator.run_replications(self.junction, self.route_service_rate, 40, workers=1, seed=1,
+                                          engine=ENGINE_FAST)
+        self.assertEqual(set(batch[0]), set(fast[0]))
+        for r in self.route_service_rate:
+            for key in [f'mean_waiting_time_{r}', f'time_weighted_queue_length_{r}', f'queue_length_{r}']:
+                b = np.array([s[key] for s in batch])
+                f = np.array([s[key] for s in fast])
+                error = np.sqrt(b.var() / len(b) + f.var() / len(f))
+                self.assertLess(abs(b.mean() - f.mean()), 4 * error, key)
+
+    def test_single_runs_reject_batch(self):
+        with self.assertRaises(ValueError):
+            Simulator.run_junction_sim(None, self.junction, self.route_service_rate, engine=ENGINE_BATCH)
+        with self.assertRaises(ValueError):
+            SequentialRunner(self.junction, self.route_service_rate, engine=ENGINE_BATCH)
+        with self.assertRaises(ValueError):
+            CapacitySearch(self.route_service_rate, engine=ENGINE_BATCH)
+        with self.assertRaises(ValueError):
+            Simulator.run_replications(self.junction, self.route_service_rate, 2, engine='fsat')
+        for unsupported in ({'workers': 2}, {'streaming': True}, {'dispatch_mode': DISPATCH_POLLING}):
+            with self.assertRaises(ValueError):
+                Simulator.run_replications(self.junction, self.route_service_rate, 2, engine=ENGINE_BATCH,
+                                           **unsupported)
@@ -0,0 +1,40 @@
+import copy
+import os
+import tempfile
+from unittest import TestCase
+
+from src.Benchmark import Benchmark
+from src.Simulator import ENGINE_FAST, ENGINE_SIMPY
+
+
+class TestBenchmark(TestCase):
+    def test_record_and_compare(self):
+        record = Benchmark(['base'], [ENGINE_FAST], run_until=240, repeats=1, isolated=False).run()
+        metrics = record['results']['base/fast']
+        self.assertGreater(metrics['events'], 0)
+        self.assertAlmostEqual(metrics['events_per_second'], metrics['events'] / metrics['run_seconds'])
+        self.assertGreater(metrics['run_peak_bytes'], 0)
+        self.assertEqual(Benchmark.compare(record, record), [])
+
+        slower = copy.deepcopy(record)
+        slower['results']['base/fast']['run_seconds'] *= 2
+        slower['results']['base/fast']['events_per_second'] /= 2
+        regressions = Benchmark.compare(slower, record)
+        self.assertEqual(len(regressions), 2)
+        self.assertEqual(Benchmark.compare(record, slower), [])
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'history.json')
+            Benchmark.append_history(path, record)
+            Benchmark.append_history(path, slower)
+            self.assertEqual(Benchmark.read_history(path), [record, slower])
+
+    def test_speedup(self):
+        record = {'results': {f'base/{ENGINE_SIMPY}': {'run_seconds': 0.08},
+                              f'base/{ENGINE_FAST}': {'run_seconds': 0.003},
+                              f'light/{ENGINE_FAST}': {'run_seconds': 0.001}}}
+        self.assertEqual(Benchmark.check_speedup(record), [])
+        record['results'][f'base/{ENGINE_FAST}']['run_seconds'] = 0.008
+        failures = Benchmark.check_speedup(record)
+        self.assertEqual(len(failures), 1)
+        self.assertTrue(failures[0].startswith('base '))
@@ -0,0 +1,62 @@
+import time
+from unittest import TestCase
+
+import numpy as np
+from src.CTMCSolver import CTMCSolver
+from src.JunctionContainer import JunctionContainer, TrainMixContainer
+from src.JunctionLayout import JunctionLayout
+from src.Simulator import Simulator, ENGINE_FAST
+
+
+class TestCTMCSolver(TestCase):
+    def test_matches_simulation(self):
+        route_service_rate = {
+            'a-b': 0.3,
+            'a-c': 0.3,
+            'b-a': 0.3,
+            'c-a': 0.3
+        }
+        route_arrival_rate = {r: 0.05 for r in route_service_rate}
+        solver = CTMCSolver(route_arrival_rate, route_service_rate, service_cov=0.5, max_waiting_trains=4)
+        exact = solver.export_statistics_dict()
+        self.assertAlmostEqual(solver.stationary.sum(), 1.)
+        self.assertLess(exact['truncation_mass'], 1e-3)
+
+        junction = JunctionContainer(TrainMixContainer(3, 0, 0, 0), TrainMixContainer(3, 0, 0, 0), 't', 't2', 60)
+        summaries = [Simulator.run_junction_sim(None, junction, route_service_rate, 100000, seed=seed,
+                                                engine=ENGINE_FAST, service_cov=0.5).export_summary(1000, 100000)
+                     for seed in range(4)]
+        for r in route_service_rate:
+            self.assertAlmostEqual(exact[f'utilization_{r}'], 1 / 6, delta=1e-3)
+            for k in [f'queue_length_{r}', f'mean_waiting_time_{r}']:
+                simulated = np.mean([summary[k] for summary in summaries])
+                self.assertAlmostEqual(exact[k], simulated, delta=0.1 * exact[k])
+
+    def test_base_case(self):
+        # 6 trains per hour on every route, the 12 service phases per route make this chain large
+        route_service_rate = {r: 0.3 for r in ['a-b', 'a-c', 'b-a', 'c-a']}
+        route_arrival_rate = {r: 0.1 for r in route_service_rate}
+        start = time.perf_counter()
+        exact = CTMCSolver(route_arrival_rate, route_service_rate, arrival_cov=0.8,
+                           service_cov=0.3).export_statistics_dict()
+        self.assertLess(time.perf_counter() - start, 60)
+        self.assertLess(exact['truncation_mass'], 0.02)
+        self.assertAlmostEqual(exact['service_cov_a-c'], 0.3)
+
+        # Erlang services with 4 phases allow a wider truncation with fewer states
+        start = time.perf_counter()
+        aggregated = CTMCSolver(route_arrival_rate, route_service_rate, arrival_cov=0.8, service_cov=0.3,
+                                max_waiting_trains=8, max_service_phases=4).export_statistics_dict()
+        self.assertLess(time.perf_counter() - start, 20)
+        self.assertLess(aggregated['states'], exact['states'] / 3)
+        self.assertLess(aggregated['truncation_mass'], 0.01)
+        self.assertAlmostEqual(aggregated['service_cov_a-c'], 0.5)
+
+    def test_single_route(self):
+        # M/M/1: mean wait rho / (mu - lambda)
+        layout = JunctionLayout(['a-b'])
+        solver = CTMCSolver({'a-b': 0.5}, {'a-b': 1.}, layout, arrival_cov=1., service_cov=1.,
+                            max_waiting_trains=60)
+        statistics = solver.export_statistics_dict()
+        self.assertAlmostEqual(statistics['mean_waiting_time_a-b'], 1., places=4)
+        self.assertAlmostEqual(statistics['queue_length_a-b'], 0.5, places=4)
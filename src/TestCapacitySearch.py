@@ -0,0 +1,37 @@
+from unittest import TestCase
+
+import numpy as np
+from src.CapacitySearch import CapacitySearch
+
+
+class TestCapacitySearch(TestCase):
+    route_service_rate = {'a-b': 0.3, 'a-c': 0.3, 'b-a': 0.3, 'c-a': 0.3}
+
+    def test_trend_detection(self):
+        search = CapacitySearch(self.route_service_rate)
+        rng = np.random.default_rng(0)
+        times = np.arange(60., 300.)
+        self.assertFalse(search.is_diverging(times, rng.poisson(3, len(times)), 0.4))
+        self.assertTrue(search.is_diverging(times, rng.poisson(3, len(times)) + 0.05 * times, 0.4))
+        # too short to decide
+        self.assertFalse(search.is_diverging(times[:10], 0.05 * times[:10], 0.4))
+
+    def test_search(self):
+        search = CapacitySearch(self.route_service_rate, seed=1)
+        result = search.run()
+        self.assertTrue(result.converged)
+        self.assertLessEqual(result.unstable_demand - result.stable_demand, search.tolerance)
+        # between a single route at a time and all four routes in parallel
+        self.assertGreater(result.stable_demand, 9)
+        self.assertLess(result.unstable_demand, 18)
+        self.assertLess(abs(result.throughput - result.stable_demand), 3 * result.throughput_half_width)
+        for probe in result.probes:
+            if probe['unstable']:
+                # overloaded runs stop early
+                self.assertLess(probe['simulated_minutes'], search.replications * search.run_until)
+
+    def test_shares(self):
+        search = CapacitySearch(self.route_service_rate, tolerance=4, seed=1)
+        results = search.run_shares([0.25, 0.75])
+        self.assertEqual([r.main_share for r in results], [0.25, 0.75])
+        self.assertEqual(search.main_share, 0.5)
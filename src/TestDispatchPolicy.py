@@ -0,0 +1,52 @@
+from unittest import TestCase
+
+import simpy
+from src.DispatchPolicy import (DispatchPolicy, MaxWeightPolicy, PriorityPolicy, POLICIES, POLICY_PRIORITY,
+                                get_dispatch_policy)
+from src.JunctionContainer import JunctionContainer, TrainMixContainer
+from src.JunctionLayout import FOUR_ROUTE_LAYOUT
+from src.Simulator import Simulator, ENGINE_FAST
+
+
+class TestDispatchPolicy(TestCase):
+    junction = JunctionContainer(TrainMixContainer(7, 0, 0, 0), TrainMixContainer(7, 0, 0, 0), 't', 't2', 60)
+    route_service_rate = {'a-b': 0.3, 'a-c': 0.3, 'b-a': 0.3, 'c-a': 0.3}
+
+    def test_tables(self):
+        routes = FOUR_ROUTE_LAYOUT.routes
+        masks = FOUR_ROUTE_LAYOUT.get_conflict_masks(routes)
+        table = DispatchPolicy().compile(routes, masks)
+        self.assertEqual(len(table), 256)
+        for occupied in range(16):
+            for waiting in range(16):
+                ready = tuple(i for i in range(4) if waiting & (1 << i) and not occupied & masks[i])
+                self.assertEqual(table[occupied << 4 | waiting], ready)
+
+        # a-b and b-a are the main line, a-c conflicts with both
+        table = PriorityPolicy().compile(routes, masks)
+        self.assertEqual(table[0b1111], (0, 2))
+        self.assertEqual(table[0b0001 << 4 | 0b1010], (3,))
+        # maximal sets of compatible routes on the conflict path a-b, a-c, b-a, c-a
+        table = MaxWeightPolicy().compile(routes, masks)
+        self.assertEqual(table[0b1111], ((0, 2), (0, 3), (1, 3)))
+        self.assertEqual(table[0b1000 << 4 | 0b1011], ((0,), (1,)))
+
+    def test_engines_agree(self):
+        for name in POLICIES:
+            summaries = []
+            for engine in ('simpy', ENGINE_FAST):
+                junction_sim = Simulator.run_junction_sim(simpy.Environment(), self.junction, self.route_service_rate,
+                                                          1320, seed=3, log_progress=False, engine=engine,
+                                                          policy=name)
+                self.assertEqual(type(junction_sim.policy), POLICIES[name])
+                summaries.append(junction_sim.export_summary(60, 1200))
+            self.assertEqual(summaries[0], summaries[1], name)
+
+    def test_priority(self):
+        summaries = Simulator.run_replications(self.junction, self.route_service_rate, 10, workers=1, seed=1,
+                                               engine=ENGINE_FAST, policy=POLICY_PRIORITY)
+        main = sum(s['mean_waiting_time_a-b'] + s['mean_waiting_time_b-a'] for s in summaries)
+        side = sum(s['mean_waiting_time_a-c'] + s['mean_waiting_time_c-a'] for s in summaries)
+        self.assertLess(main, side)
+        with self.assertRaises(ValueError):
+            get_dispatch_policy('shortest')
@@ -0,0 +1,32 @@
+import os
+import subprocess
+import sys
+from unittest import TestCase
+
+# CPU time budget for importing the simulation core in a fresh interpreter, numpy and simpy included; CPU time
+# rather than wall time, so a busy machine does not fail the test
+IMPORT_TIME_BUDGET_SECONDS = 1.
+CORE_MODULES = ('src.Simulator', 'src.JunctionSim', 'src.RouteSim', 'src.FastJunctionSim', 'src.StatisticHelper')
+LAZY_MODULES = ('pandas', 'ciw')
+
+IMPORT_SCRIPT = f'''
+import sys, time
+started = time.process_time()
+for name in {CORE_MODULES!r}:
+    __import__(name)
+print(time.process_time() - started)
+print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))
+'''
+
+
+class TestImportTime(TestCase):
+    def test_core_import(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        seconds = []
+        for _ in range(3):
+            output = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT], cwd=root, capture_output=True, text=True,
+                                    check=True).stdout.splitlines()
+            seconds.append(float(output[0]))
+            self.assertEqual(output[1:], [''], 'the core imports pandas or ciw')
+        # the best of three, the first run also pays for cold caches
+        self.assertLess(min(seconds), IMPORT_TIME_BUDGET_SECONDS)
@@ -0,0 +1,60 @@
+import pickle
+from unittest import TestCase
+
+import numpy as np
+from src.JunctionContainer import JunctionContainer, TrainMixContainer
+from src.Simulator import Simulator, ENGINE_FAST
+from src.StatisticHelper import PHSampler, ErlangParameter
+
+
+class TestJunctionSnapshot(TestCase):
+    junction = JunctionContainer(TrainMixContainer(8, 0, 0, 0), TrainMixContainer(8, 0, 0, 0), 't', 't2', 60)
+    route_service_rate = {'a-b': 0.3, 'a-c': 0.3, 'b-a': 0.3, 'c-a': 0.3}
+
+    def test_exact_continuation(self):
+        straight = Simulator.create_junction_sim_fast(self.junction, self.route_service_rate, seed=3)
+        straight.run(1200)
+
+        warmup = Simulator.create_junction_sim_fast(self.junction, self.route_service_rate, seed=3)
+        warmup.run(120)
+        snapshot = pickle.loads(pickle.dumps(warmup.get_snapshot()))
+        self.assertGreater(snapshot.get_waiting_trains(), 0)
+        restored = Simulator.create_junction_sim_fast(self.junction, self.route_service_rate, seed=99)
+        restored.restore(snapshot, resample=False)
+        restored.run(1200)
+
+        def get_trains(junction_sim):
+            return sorted((t.route, t.starting_time, t.service_start_time, t.ending_time)
+                          for t in junction_sim.trains.values() if t.ending_time is None or t.ending_time > 120)
+
+        self.assertEqual(get_trains(restored), get_trains(straight))
+        expected = straight.export_summary(120, 1200)
+        for k, v in restored.export_summary(120, 1200).items():
+            if not k.startswith('finished_trains'):
+                self.assertAlmostEqual(v, expected[k], places=9)
+
+    def test_snapshot_pool(self):
+        snapshots = Simulator.create_snapshot_pool(self.junction, self.route_service_rate, 3, 120, seed=1)
+        summaries = Simulator.run_replications(self.junction, self.route_service_rate, 6, workers=1, run_until=600,
+                                               seed=2, start=120, end=600, engine=ENGINE_FAST, snapshots=snapshots)
+        for r in self.route_service_rate:
+            values = [summary[f'mean_waiting_time_{r}'] for summary in summaries]
+            self.assertTrue(np.all(np.isfinite(values)))
+            # replications on the same snapshot continue differently
+            self.assertNotEqual(values[0], values[3])
+
+        # the default window starts at 60, before the snapshots
+        with self.assertRaises(ValueError):
+            Simulator.run_replications(self.junction, self.route_service_rate, 3, workers=1, run_until=600,
+                                       seed=2, engine=ENGINE_FAST, snapshots=snapshots)
+        with self.assertRaises(ValueError):
+            Simulator.run_junction_sim(None, self.junction, self.route_service_rate, 600, seed=2, engine=ENGINE_FAST,
+                                       streaming_window=(60, 600), snapshot=snapshots[0])
+
+    def test_remaining_time(self):
+        sampler = PHSampler(ErlangParameter(3, 1.5), ErlangParameter(2, 0.5), np.random.default_rng(0))
+        samples = sampler.sample_block(200000)
+        for age in [0., 1., 4.]:
+            expected = samples[samples > age] - age
+            remaining = [sampler.sample_remaining(age) for _ in range(5000)]
+            self.assertAlmostEqual(np.mean(remaining), expected.mean(), delta=0.05 * expected.mean())
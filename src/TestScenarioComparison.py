@@ -0,0 +1,39 @@
+from unittest import TestCase
+
+import numpy as np
+from src.JunctionContainer import JunctionContainer, TrainMixContainer
+from src.ScenarioComparison import ScenarioComparison
+from src.Simulator import ENGINE_FAST
+from src.StatisticHelper import PHSampler, ErlangParameter, SAMPLING_INVERSION, SAMPLING_ANTITHETIC
+
+
+class TestScenarioComparison(TestCase):
+    def test_common_random_numbers_reduce_variance(self):
+        route_service_rate = {
+            'a-b': 0.3,
+            'a-c': 0.3,
+            'b-a': 0.3,
+            'c-a': 0.3
+        }
+        faster = {r: 0.31 for r in route_service_rate}
+        junction = JunctionContainer(TrainMixContainer(6, 0, 0, 0), TrainMixContainer(6, 0, 0, 0), 't', 't2', 60)
+        comparison = ScenarioComparison(junction, route_service_rate, engine=ENGINE_FAST)
+
+        same = comparison.compare({}, {}, 5, seed=3)
+        self.assertEqual(set(same.differences.values()), {0.})
+
+        independent = comparison.compare({}, {'route_service_rate': faster}, 30, seed=3, common_random_numbers=False)
+        common = comparison.compare({}, {'route_service_rate': faster}, 30, seed=3)
+        antithetic = comparison.compare({}, {'route_service_rate': faster}, 30, seed=3, antithetic=True)
+        for k in comparison.outputs:
+            self.assertLess(common.half_widths[k], independent.half_widths[k])
+            self.assertLess(antithetic.half_widths[k], independent.half_widths[k])
+
+    def test_antithetic_sampler(self):
+        samples = {}
+        for sampling in [SAMPLING_INVERSION, SAMPLING_ANTITHETIC]:
+            sampler = PHSampler(ErlangParameter(2, 4.), ErlangParameter(1, 2.), np.random.default_rng(0),
+                                sampling=sampling)
+            samples[sampling] = sampler.sample_block(20000)
+            self.assertAlmostEqual(samples[sampling].mean(), sampler.get_mean(), delta=0.02)
+        self.assertLess(np.corrcoef(samples[SAMPLING_INVERSION], samples[SAMPLING_ANTITHETIC])[0, 1], -0.5)
@@ -0,0 +1,36 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from src.JunctionContainer import JunctionContainer, TrainMixContainer
+from src.ScenarioSweep import ScenarioSweep
+
+
+class TestScenarioSweep(TestCase):
+    def test_cached_points_are_not_rerun(self):
+        route_service_rate = {
+            'a-b': 0.3,
+            'a-c': 0.3,
+            'b-a': 0.3,
+            'c-a': 0.3
+        }
+        junctions = [JunctionContainer(TrainMixContainer(n, 0, 0, 0), TrainMixContainer(n, 0, 0, 0), 't', 't2', 60)
+                     for n in (4, 6)]
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            sweep = ScenarioSweep(cache_dir, run_until=300, end=300, workers=1)
+            first = sweep.run(junctions[:1], [route_service_rate], seeds=[0, 1])
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+            extended = sweep.run(junctions, [route_service_rate], seeds=[0, 1])
+            self.assertEqual(len(os.listdir(cache_dir)), 4)
+            self.assertEqual(len(extended), 4)
+            self.assertEqual(list(first['queue_length_a-b']), list(extended['queue_length_a-b'][:2]))
+            self.assertEqual(list(extended['main_branch_trains']), [4, 4, 6, 6])
+
+    def test_code_version_modules(self):
+        modules = ScenarioSweep.get_simulation_modules()
+        # imported by Simulator directly, through the engines, and lazily inside functions
+        for name in ('Simulator.py', 'FastJunctionSim.py', 'DispatchPolicy.py', 'TraceReplay.py', 'TrainStore.py'):
+            self.assertIn(name, modules)
+        self.assertNotIn('ScenarioSweep.py', modules)
@@ -0,0 +1,64 @@
+from unittest import TestCase
+
+import numpy as np
+from src.JunctionContainer import JunctionContainer, TrainMixContainer
+from src.SequentialRunner import SequentialRunner
+from src.Simulator import ENGINE_FAST
+from src.StatisticHelper import StatisticHelper
+from src.StreamingStatistics import BatchMeans
+
+
+class TestSequentialRunner(TestCase):
+    def test_stops_at_target_or_budget(self):
+        route_service_rate = {
+            'a-b': 0.3,
+            'a-c': 0.3,
+            'b-a': 0.3,
+            'c-a': 0.3
+        }
+        junction = JunctionContainer(TrainMixContainer(6, 0, 0, 0), TrainMixContainer(6, 0, 0, 0), 't', 't2', 60)
+        outputs = ['mean_waiting_time_a-b', 'queue_length_a-c']
+
+        runner = SequentialRunner(junction, route_service_rate, outputs, relative_precision=0.1, seed=1,
+                                  engine=ENGINE_FAST)
+        result = runner.run_replications()
+        self.assertTrue(result.converged)
+        self.assertGreater(result.replications, runner.min_replications)
+        for k in outputs:
+            self.assertLessEqual(result.half_widths[k], 0.1 * result.estimates[k])
+        # one replication less would not have been enough
+        fewer = SequentialRunner(junction, route_service_rate, outputs, relative_precision=0.1, seed=1,
+                                 engine=ENGINE_FAST, max_replications=result.replications - 1).run_replications()
+        self.assertFalse(fewer.converged)
+
+        result = runner.run_batch_means()
+        self.assertTrue(result.converged)
+        self.assertEqual(result.replications, 1)
+
+        runner = SequentialRunner(junction, route_service_rate, outputs, relative_precision=0.001, seed=1,
+                                  engine=ENGINE_FAST, max_minutes=10000)
+        result = runner.run_replications()
+        self.assertFalse(result.converged)
+        self.assertLessEqual(result.simulated_minutes, 10000)
+        self.assertEqual(runner.run_batch_means().simulated_minutes, 10000)
+        runner.max_minutes = 600
+        self.assertEqual(runner.run_batch_means().simulated_minutes, 600)
+        # not even one replication of run_until fits
+        result = runner.run_replications()
+        self.assertFalse(result.converged)
+        self.assertEqual((result.replications, result.simulated_minutes), (0, 0))
+
+        self.assertAlmostEqual(StatisticHelper.get_t_quantile(0.975, 4), 2.776, places=2)
+        self.assertAlmostEqual(StatisticHelper.get_t_quantile(0.995, 9), 3.250, places=2)
+
+    def test_batch_means_autocorrelation(self):
+        # with short batches the means of a strongly correlated series are correlated as well
+        noise = np.random.default_rng(0).normal(size=2000)
+        for phi, independent in [(0., True), (0.95, False)]:
+            batches = BatchMeans()
+            value = 0.
+            for e in noise:
+                value = phi * value + e
+                batches.append(value)
+            self.assertEqual(batches.is_independent(), independent)
+        self.assertFalse(BatchMeans().is_independent())
@@ -1,11 +1,22 @@
 from unittest import TestCase
 
+import os
+import tempfile
 import time
 
+import numpy as np
 import simpy
-from src.Simulator import Simulator
+from src.FastJunctionSim import FastJunctionSim, FastRoute
+from src.Simulator import Simulator, ENGINE_FAST
 from src.JunctionContainer import JunctionContainer, TrainMixContainer
-from src.CorrectnessTests import CorrectnessTests
+from src.JunctionSim import DISPATCH_POLLING
+from src.CorrectnessTests import CorrectnessTests, CONFLICTING_ROUTES
+from src.JunctionLayout import JunctionLayout
+from src.OccupancyTrace import OccupancyTrace
+from src.SimStatistics import TimeSeriesIndex
+from src.StatisticHelper import StatisticHelper
+from src.StreamingStatistics import P2Quantile
+from src.TrainStore import TrainStore
 
 class TestSimulation(TestCase):
     def test_instance(self):
@@ -13,8 +24,7 @@ class TestSimulation(TestCase):
 
         env = simpy.Environment()
 
-        junction = JunctionContainer(TrainMixContainer(0, 0, 0, 0), TrainMixContainer(0, 0, 0, 0),
-                                     TrainMixContainer(6, 0, 0, 0), TrainMixContainer(6, 0, 0, 0), 't', 't2')
+        junction = JunctionContainer(TrainMixContainer(6, 0, 0, 0), TrainMixContainer(6, 0, 0, 0), 't', 't2')
         junction.time_frame = 60
 
         route_service_rate = {
@@ -42,3 +52,310 @@ class TestSimulation(TestCase):
 
         sum_of_conflicts = CorrectnessTests.eval_overlapping_conflicts(junction_sim)
         self.assertEquals(sum_of_conflicts, 0)
+
+    def test_instance_polling(self):
+        env = simpy.Environment()
+
+        junction = JunctionContainer(TrainMixContainer(6, 0, 0, 0), TrainMixContainer(6, 0, 0, 0), 't', 't2')
+        junction.time_frame = 60
+
+        route_service_rate = {
+            'a-b': 0.3,
+            'a-c': 0.3,
+            'b-a': 0.3,
+            'c-a': 0.3
+        }
+
+        junction_sim = Simulator.run_junction_sim(env, junction, route_service_rate, run_until=240,
+                                                  dispatch_mode=DISPATCH_POLLING)
+
+        sum_of_conflicts = CorrectnessTests.eval_overlapping_conflicts(junction_sim)
+        self.assertEqual(sum_of_conflicts, 0)
+
+    def test_queue_bookkeeping(self):
+        env = simpy.Environment()
+
+        junction = JunctionContainer(TrainMixContainer(12, 0, 0, 0), TrainMixContainer(12, 0, 0, 0), 't', 't2')
+        junction.time_frame = 60
+
+        route_service_rate = {
+            'a-b': 0.3,
+            'a-c': 0.3,
+            'b-a': 0.3,
+            'c-a': 0.3
+        }
+
+        junction_sim = Simulator.run_junction_sim(env, junction, route_service_rate, run_until=600)
+
+        for route in junction_sim.routes.values():
+            trains = [t for t in junction_sim.trains.values() if t.route == route.name if t.ending_time is None]
+            waiting = sorted(t.id for t in trains if not t.in_service)
+            in_service = {t.id for t in trains if t.in_service}
+            self.assertEqual(route.get_queue_length(), len(waiting))
+            self.assertEqual(list(route.waiting_trains), waiting)
+            self.assertEqual(route.in_service_trains, in_service)
+
+    def test_ph_sampler_moments(self):
+        for rate, cov in [(0.1, 0.8), (0.3, 0.3)]:
+            sampler = StatisticHelper.get_ph_generator_from_rate_and_cov(rate, cov, np.random.default_rng(1))
+            samples = np.array([sampler(1) for _ in range(100000)])
+            self.assertAlmostEqual(samples.mean() * rate, 1, delta=0.02)
+            self.assertAlmostEqual(samples.std() / samples.mean(), cov, delta=0.02)
+
+    def test_replications_independent_of_workers(self):
+        junction = JunctionContainer(TrainMixContainer(6, 0, 0, 0), TrainMixContainer(6, 0, 0, 0), 't', 't2', 60)
+
+        route_service_rate = {
+            'a-b': 0.3,
+            'a-c': 0.3,
+            'b-a': 0.3,
+            'c-a': 0.3
+        }
+
+        serial = Simulator.run_replications(junction, route_service_rate, 4, workers=1, run_until=300, seed=7,
+                                            end=300)
+        parallel = Simulator.run_replications(junction, route_service_rate, 4, workers=2, run_until=300, seed=7,
+                                              end=300)
+
+        self.assertEqual(serial, parallel)
+        self.assertEqual([r['replication'] for r in serial], [0, 1, 2, 3])
+        self.assertNotEqual(serial[0]['queue_length_a-b'], serial[1]['queue_length_a-b'])
+
+    def test_fast_engine_matches_simpy(self):
+        junction = JunctionContainer(TrainMixContainer(8, 0, 0, 0), TrainMixContainer(6, 0, 0, 0), 't', 't2', 60)
+
+        route_service_rate = {
+            'a-b': 0.3,
+            'a-c': 0.25,
+            'b-a': 0.3,
+            'c-a': 0.35
+        }
+
+        for seed in range(3):
+            junction_sim = Simulator.run_junction_sim(simpy.Environment(), junction, route_service_rate,
+                                                      run_until=1320, seed=seed, log_progress=False)
+            fast_sim = Simulator.run_junction_sim(None, junction, route_service_rate, run_until=1320, seed=seed,
+                                                  engine=ENGINE_FAST)
+
+            self.assertEqual(fast_sim.export_summary(), junction_sim.export_summary())
+            self.assertEqual(fast_sim.export_trains(), junction_sim.export_trains())
+            for k, r in fast_sim.routes.items():
+                self.assertEqual(r.lengths, junction_sim.routes[k].lengths)
+            self.assertEqual(CorrectnessTests.eval_overlapping_conflicts(fast_sim), 0)
+
+    def test_train_store_export(self):
+        junction = JunctionContainer(TrainMixContainer(12, 0, 0, 0), TrainMixContainer(12, 0, 0, 0), 't', 't2', 60)
+
+        route_service_rate = {
+            'a-b': 0.3,
+            'a-c': 0.3,
+            'b-a': 0.3,
+            'c-a': 0.3
+        }
+
+        fast_sim = Simulator.run_junction_sim(None, junction, route_service_rate, run_until=6000, seed=1,
+                                              engine=ENGINE_FAST)
+        store = fast_sim.trains
+        self.assertGreater(len(store), 1024)
+        self.assertEqual(list(store.to_numpy()['id']), list(range(1, len(store) + 1)))
+
+        df = store.to_dataframe()
+        self.assertEqual(len(df), len(store))
+        self.assertEqual(set(df['route']), {'a-b', 'a-c', 'b-a', 'c-a'})
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'trains.npz')
+            fast_sim.export_trains_npz(path)
+            self.assertEqual(dict(TrainStore.load_npz(path).items()), fast_sim.export_trains())
+
+    def test_train_store_drops_finished(self):
+        # the first train never leaves its queue, the finished trains behind it are dropped all the same
+        store = TrainStore(capacity=8, keep_finished=False)
+        blocked, other = store.add_route('a-b'), store.add_route('b-a')
+        first = store.add(blocked, 0.)
+        waiting = None
+        for k in range(1, 200):
+            train_id = store.add(other, float(k))
+            if waiting is not None:
+                store.start_service(waiting, float(k), 0.5)
+                store.finish(waiting, k + 0.5)
+            waiting = train_id
+        self.assertLessEqual(store.capacity, 16)
+        self.assertEqual(store[first].starting_time, 0.)
+        self.assertIsNone(store[first].service_start_time)
+        self.assertNotIn(2, store)
+        with self.assertRaises(KeyError):
+            store.get_train(2)
+        self.assertEqual(list(store.keys())[0], first)
+        self.assertEqual(list(store.keys())[-1], waiting)
+        store.start_service(first, 200., 1.)
+        store.finish(first, 201.)
+        self.assertEqual(store[first].ending_time, 201.)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'trains.npz')
+            store.save_npz(path)
+            self.assertEqual(dict(TrainStore.load_npz(path).items()), dict(store.items()))
+
+    def test_sweep_line_conflicts_match_pairwise(self):
+        # only self conflicts, so trains on different routes overlap freely
+        fast_sim = FastJunctionSim(np.random.default_rng(3), JunctionLayout(['a-b', 'a-c', 'b-a', 'c-a']))
+        for k, r in enumerate(['a-b', 'a-c', 'b-a', 'c-a']):
+            fast_sim.add_route(FastRoute(r,
+                                         StatisticHelper.get_ph_generator_from_rate_and_cov(
+                                             0.1, 0.8, np.random.default_rng(10 + k)),
+                                         StatisticHelper.get_ph_generator_from_rate_and_cov(
+                                             0.3, 0.3, np.random.default_rng(20 + k)),
+                                         fast_sim))
+        fast_sim.add_resources()
+        fast_sim.run(600)
+
+        trains = fast_sim.export_trains()
+        routes = ['a-b', 'a-c', 'b-a', 'c-a']
+        for r1 in routes:
+            for r2 in routes:
+                pairwise = [(k1, k2) for k1, t1 in trains.items() for k2, t2 in trains.items()
+                            if t1.ending_time is not None if t2.ending_time is not None
+                            if max(t1.service_start_time, t2.service_start_time) < min(t1.ending_time, t2.ending_time)
+                            if t1.route == r1 if t2.route == r2]
+                self.assertEqual(sorted(CorrectnessTests.get_overlapping_trains(fast_sim, r1, r2)), sorted(pairwise))
+
+        self.assertEqual(CorrectnessTests.eval_overlapping_conflicts(fast_sim), 0)
+        self.assertGreater(CorrectnessTests.eval_overlapping_conflicts(fast_sim, CONFLICTING_ROUTES), 0)
+        self.assertEqual(CorrectnessTests.eval_overlapping_conflicts(fast_sim, CONFLICTING_ROUTES),
+                         2 * len(CorrectnessTests.get_conflicting_pairs(fast_sim, CONFLICTING_ROUTES)))
+
+    def test_time_indexed_statistics(self):
+        fast_sim = Simulator.run_junction_sim(None, JunctionContainer(TrainMixContainer(6, 0, 0, 0),
+                                                                      TrainMixContainer(6, 0, 0, 0), 't', 't2', 60),
+                                              {'a-b': 0.3, 'a-c': 0.3, 'b-a': 0.3, 'c-a': 0.3}, run_until=600,
+                                              seed=4, engine=ENGINE_FAST)
+        for r in fast_sim.routes.values():
+            window = [v for k, v in r.lengths.items() if 60 <= k <= 500]
+            self.assertAlmostEqual(r.calc_length_of_queue(60, 500), sum(window) / len(window))
+            waits = [t.service_start_time - t.starting_time for t in fast_sim.trains.values()
+                     if t.route == r.name if t.ending_time is not None if 60 <= t.service_start_time <= 500]
+            self.assertAlmostEqual(r.get_mean_waiting_time(60, 500), sum(waits) / len(waits))
+
+            # exact integral against a fine grid
+            grid = np.linspace(60, 500, 440001)
+            self.assertAlmostEqual(r.calc_time_weighted_length_of_queue(60, 500),
+                                   float(np.mean(r.length_changes.value_at(grid[:-1]))), places=2)
+
+        series = TimeSeriesIndex(2)
+        for t, v in [(0., 1), (1., 3), (1., 2), (4., 0)]:
+            series.append(t, v)
+        self.assertEqual(series.window_count(1, 4), 3)
+        self.assertAlmostEqual(series.time_weighted_mean(0, 6), (1 + 2 * 3) / 6)
+        self.assertEqual(list(series.value_at(np.array([-1., 0.5, 1., 5.]))), [0, 1, 2, 0])
+
+    def test_streaming_statistics(self):
+        junction = JunctionContainer(TrainMixContainer(6, 0, 0, 0), TrainMixContainer(6, 0, 0, 0), 't', 't2', 60)
+        route_service_rate = {'a-b': 0.3, 'a-c': 0.3, 'b-a': 0.3, 'c-a': 0.3}
+        for engine in ['simpy', ENGINE_FAST]:
+            full = Simulator.run_junction_sim(simpy.Environment(), junction, route_service_rate, run_until=3000,
+                                              seed=5, log_progress=False, engine=engine)
+            streaming = Simulator.run_junction_sim(simpy.Environment(), junction, route_service_rate, run_until=3000,
+                                                   seed=5, log_progress=False, engine=engine,
+                                                   streaming_window=(60, 2900))
+            expected = full.export_summary(60, 2900)
+            summary = streaming.export_summary(60, 2900)
+            for k, v in expected.items():
+                self.assertAlmostEqual(summary[k], v, places=9)
+            expected = full.export_statistics_dict(60, 2900)
+            for k, v in streaming.export_statistics_dict(60, 2900).items():
+                self.assertAlmostEqual(v, expected[k], places=9)
+            # only the trains after the oldest open one are kept
+            self.assertLessEqual(streaming.trains.capacity, 1024)
+            self.assertGreater(streaming.trains.offset, 0)
+            with self.assertRaises(ValueError):
+                streaming.export_statistics_dict(0, 2900)
+
+        values = np.random.default_rng(0).gamma(2., 1., 20000)
+        for p in [0.5, 0.9, 0.95]:
+            quantile = P2Quantile(p)
+            for value in values:
+                quantile.append(value)
+            self.assertAlmostEqual(quantile.get_value(), np.quantile(values, p), delta=0.05)
+
+    def test_layout_junction(self):
+        routes = [f'r{i}' for i in range(8)]
+        rng = np.random.default_rng(7)
+        matrix = np.triu(rng.random((8, 8)) < 0.3, 1)
+        layout = JunctionLayout.from_matrix(routes, matrix | matrix.T)
+        arrival_rate = {r: 0.05 for r in routes}
+        service_rate = {r: 0.4 for r in routes}
+
+        junction_sim = Simulator.create_layout_sim_ph(simpy.Environment(), layout, arrival_rate, service_rate, seed=2)
+        self.assertEqual(len(set(map(id, junction_sim.route_resources.values()))), 8 + len(layout.conflicts))
+        junction_sim.run(600, log_progress=False)
+        junction_sim.env.run(until=600)
+        fast_sim = Simulator.create_layout_sim_fast(layout, arrival_rate, service_rate, seed=2)
+        fast_sim.run(600)
+
+        self.assertGreater(len(junction_sim.trains), 200)
+        self.assertEqual(fast_sim.export_trains(), junction_sim.export_trains())
+        self.assertEqual(CorrectnessTests.eval_overlapping_conflicts(junction_sim), 0)
+        self.assertEqual(layout.get_conflict_matrix(), (matrix | matrix.T | np.eye(8, dtype=bool)).tolist())
+
+    def test_instrumentation(self):
+        junction = JunctionContainer(TrainMixContainer(6, 0, 0, 0), TrainMixContainer(6, 0, 0, 0), 't', 't2', 60)
+        route_service_rate = {'a-b': 0.3, 'a-c': 0.3, 'b-a': 0.3, 'c-a': 0.3}
+        plain = Simulator.run_junction_sim(simpy.Environment(), junction, route_service_rate, run_until=600,
+                                           seed=4, log_progress=False)
+        instrumented = Simulator.run_junction_sim(simpy.Environment(), junction, route_service_rate, run_until=600,
+                                                  seed=4, log_progress=False, instrumentation=True)
+        self.assertEqual(instrumented.export_trains(), plain.export_trains())
+
+        report = instrumented.get_instrumentation_report()
+        trains = len(instrumented.trains)
+        started = sum(1 for t in instrumented.trains.values() if t.service_start_time is not None)
+        self.assertEqual(report['samplers']['arrival']['calls'], trains + 4)
+        self.assertEqual(report['samplers']['service']['calls'], started)
+        self.assertEqual(report['scheduler']['dispatches'], started)
+        self.assertEqual(report['processes']['spawn_trains']['events'], trains + 4)
+        self.assertEqual(report['processes']['read_train_length']['events'], 4 * 600)
+        self.assertGreater(report['scheduler']['idle_wakeups'], 0)
+
+        progress = []
+        env = simpy.Environment()
+        junction_sim = Simulator.create_junction_sim_ph(env, junction, route_service_rate, seed=4)
+        junction_sim.run(600, progress_callback=lambda *args: progress.append(args), progress_interval=0)
+        env.run(until=600)
+        self.assertEqual([now for now, _, _ in progress], [6. * i for i in range(1, 100)])
+        self.assertTrue(all(minutes_per_second > 0 for _, _, minutes_per_second in progress))
+
+    def test_occupancy_trace(self):
+        junction = JunctionContainer(TrainMixContainer(6, 0, 0, 0), TrainMixContainer(6, 0, 0, 0), 't', 't2', 60)
+        route_service_rate = {'a-b': 0.3, 'a-c': 0.3, 'b-a': 0.3, 'c-a': 0.3}
+        readings = Simulator.run_junction_sim(simpy.Environment(), junction, route_service_rate, run_until=600,
+                                              seed=6, log_progress=False)
+        trace = readings.occupancy_trace
+        self.assertEqual(trace.names, ['a-b', 'a-c', 'b-a', 'c-a', 'a-b|a-c', 'a-c|b-a', 'b-a|c-a'])
+        np.testing.assert_array_equal(trace.get_times(), np.arange(1, 600))
+        trains = [t for t in readings.trains.values() if t.service_start_time is not None]
+        for i, route in enumerate(readings.routes):
+            expected = [any(t.route == route and t.service_start_time <= time and
+                            (t.ending_time is None or time < t.ending_time) for t in trains)
+                        for time in trace.get_times()]
+            np.testing.assert_array_equal(trace.get_users()[:, i], expected)
+
+        env = simpy.Environment()
+        junction_sim = Simulator.create_junction_sim_ph(env, junction, route_service_rate, seed=6)
+        junction_sim.enable_occupancy_trace(capacity=64, on_change=True)
+        junction_sim.run(600, log_progress=False)
+        env.run(until=600)
+        self.assertEqual(junction_sim.export_trains(), readings.export_trains())
+        trace = junction_sim.occupancy_trace
+        self.assertEqual(len(trace), 64)
+        self.assertGreater(trace.dropped, 0)
+        self.assertTrue(np.all(np.diff(trace.get_times()) >= 0))
+        self.assertEqual(trace.get_users()[-1].tolist(),
+                         [len(junction_sim.resource_list[i].users) for i in range(len(trace.names))])
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'trace.npz')
+            trace.save_npz(path)
+            loaded = OccupancyTrace.load_npz(path)
+        self.assertTrue(loaded.to_dataframe().equals(trace.to_dataframe()))
+        self.assertIsNone(loaded.interval)
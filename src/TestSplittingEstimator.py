@@ -0,0 +1,34 @@
+import math
+from unittest import TestCase
+
+from src.JunctionContainer import JunctionContainer, TrainMixContainer
+from src.SplittingEstimator import SplittingEstimator, SPLIT_QUEUE_LENGTH, SPLIT_WAITING_TIME
+
+
+class TestSplittingEstimator(TestCase):
+    junction = JunctionContainer(TrainMixContainer(6, 0, 0, 0), TrainMixContainer(6, 0, 0, 0), 't', 't2', 60)
+    route_service_rate = {'a-b': 0.3, 'a-c': 0.3, 'b-a': 0.3, 'c-a': 0.3}
+
+    def test_agrees_with_brute_force(self):
+        for importance, levels in [(SPLIT_QUEUE_LENGTH, [2, 3, 4]), (SPLIT_WAITING_TIME, [5, 10, 15])]:
+            estimator = SplittingEstimator(self.junction, self.route_service_rate, 'a-c', levels, importance,
+                                           horizon=120, effort=50, repetitions=10, seed=1)
+            result = estimator.run()
+            self.assertEqual(len(result.stage_probabilities), len(levels))
+            self.assertGreater(result.probability, 0)
+            brute_force = estimator.run_brute_force(1500)
+            error = math.sqrt(result.standard_error ** 2 + brute_force.standard_error ** 2)
+            self.assertLess(abs(result.probability - brute_force.probability), 4 * error, importance)
+
+    def test_levels(self):
+        with self.assertRaises(ValueError):
+            SplittingEstimator(self.junction, self.route_service_rate, 'a-c', [3, 2])
+
+    def test_early_stop(self):
+        # nobody reaches a queue of 50 within two hours, the last stage never runs
+        estimator = SplittingEstimator(self.junction, self.route_service_rate, 'a-c', [2, 50, 100], horizon=120,
+                                       effort=10, repetitions=2, seed=1)
+        result = estimator.run()
+        self.assertEqual(result.probability, 0)
+        self.assertEqual(result.trajectories % estimator.effort, 0)
+        self.assertLessEqual(result.trajectories, 2 * estimator.repetitions * estimator.effort)
@@ -0,0 +1,82 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+import simpy
+from src.Simulator import Simulator
+from src.TraceReplay import ReplayTrace, ColumnReplay
+
+
+class TestTraceReplay(TestCase):
+    def test_replay(self):
+        rng = np.random.default_rng(0)
+        routes = ['a-b', 'a-c', 'b-a', 'c-a']
+        arrivals = {r: np.cumsum(rng.exponential(10, 100)) for r in routes}
+        services = {r: rng.gamma(10, 0.3, 100) for r in routes}
+        with tempfile.TemporaryDirectory() as directory:
+            trace = ReplayTrace.write(directory, arrivals, services)
+            self.assertEqual(trace.routes, sorted(routes))
+            fast = Simulator.create_replay_sim_fast(trace, seed=1)
+            fast.run(5000)
+            env = simpy.Environment()
+            simpy_sim = Simulator.create_replay_sim_ph(env, trace, seed=1)
+            simpy_sim.run(5000, log_progress=False)
+            env.run(until=5000)
+
+        for junction_sim in (fast, simpy_sim):
+            store = junction_sim.trains
+            for r in routes:
+                rows = store.get_rows(store.route_codes[r])
+                # every recorded train arrived and finished with its recorded occupation time
+                np.testing.assert_allclose(np.sort(store.arrival[rows]), arrivals[r])
+                np.testing.assert_allclose(store.service_length[rows][np.argsort(store.arrival[rows])], services[r])
+                self.assertFalse(np.isnan(store.end[rows]).any())
+        self.assertEqual(sorted(fast.trains.values()), sorted(simpy_sim.trains.values()))
+
+    def test_snapshot(self):
+        # routes that ran out of trace have no pending arrival, the snapshot still restores exactly
+        arrivals = {'a-b': np.arange(1., 6.), 'a-c': np.arange(2., 300., 3.), 'b-a': np.array([4.]),
+                    'c-a': np.array([5.])}
+        services = {r: np.full(len(a), 1.5) for r, a in arrivals.items()}
+        with tempfile.TemporaryDirectory() as directory:
+            trace = ReplayTrace.write(directory, arrivals, services)
+            junction_sim = Simulator.create_replay_sim_fast(trace, seed=1)
+            junction_sim.run(100)
+            snapshot = junction_sim.get_snapshot()
+            self.assertIsNone(snapshot.routes[0].next_arrival)
+            restored = Simulator.create_replay_sim_fast(trace, seed=1)
+            restored.restore(snapshot, resample=False)
+            junction_sim.run(400)
+            restored.run(400)
+
+        def get_trains(junction_sim):
+            return sorted((t.route, t.starting_time, t.service_start_time, t.ending_time)
+                          for t in junction_sim.trains.values() if t.ending_time is None or t.ending_time > 100)
+
+        self.assertEqual(get_trains(restored), get_trains(junction_sim))
+        self.assertEqual(len(get_trains(restored)), 67)
+
+    def test_csv(self):
+        with tempfile.TemporaryDirectory() as directory:
+            csv_path = os.path.join(directory, 'trace.csv')
+            with open(csv_path, 'w') as f:
+                f.write('route,arrival,service\n'
+                        'a-b,2024-01-01T06:00:00,3.5\n'
+                        'b-a,2024-01-01T06:02:30,4\n'
+                        'a-b,2024-01-01T06:10:00,2.5\n')
+            trace = ReplayTrace.from_csv(csv_path, os.path.join(directory, 'trace'))
+            self.assertEqual(trace.routes, ['a-b', 'b-a'])
+            arrivals = trace.get_arrival_generator('a-b')
+            self.assertEqual([arrivals(), arrivals(), arrivals()], [0., 10., None])
+            self.assertEqual(trace.open('b-a', 'arrival').tolist(), [2.5])
+            self.assertEqual(trace.open('a-b', 'service').tolist(), [3.5, 2.5])
+
+            with open(csv_path, 'a') as f:
+                f.write('a-b,2024-01-01T06:05:00,1\n')
+            with self.assertRaises(ValueError):
+                ReplayTrace.from_csv(csv_path, os.path.join(directory, 'unsorted'))
+
+    def test_blocks(self):
+        replay = ColumnReplay(np.arange(10.), block_size=3)
+        self.assertEqual([replay() for _ in range(11)], list(range(10)) + [None])
@@ -0,0 +1,149 @@
+import csv
+import math
+import os
+from datetime import datetime
+
+import numpy as np
+from typing import Dict, List
+
+REPLAY_BLOCK_SIZE = 4096
+
+COLUMN_ARRIVAL = 'arrival'
+COLUMN_SERVICE = 'service'
+
+
+class ColumnReplay:
+    # hands out the values of a memory mapped column one at a time like the PH samplers, only one block is
+    # copied at a time; None once the column is exhausted
+    def __init__(self, values: np.ndarray, block_size: int = REPLAY_BLOCK_SIZE):
+        self.values = values
+        self.block_size = block_size
+        self.block: List[float] = []
+        self.position = 0
+        self.offset = 0
+
+    def next_value(self):
+        if self.position == len(self.block):
+            if self.offset >= len(self.values):
+                return None
+            self.block = self.values[self.offset:self.offset + self.block_size].tolist()
+            self.offset += len(self.block)
+            self.position = 0
+        self.position += 1
+        return self.block[self.position - 1]
+
+    def __call__(self, x=1):
+        return self.next_value()
+
+    def get_state(self) -> Dict:
+        # the position in the column, the block is read again from the memory map
+        return {'offset': self.offset - len(self.block) + self.position}
+
+    def set_state(self, state: Dict):
+        self.block = []
+        self.position = 0
+        self.offset = state['offset']
+
+
+class ArrivalReplay(ColumnReplay):
+    # arrival times in simulation minutes replayed as the inter arrival times spawn_trains expects
+    def __init__(self, values: np.ndarray, block_size: int = REPLAY_BLOCK_SIZE):
+        super().__init__(values, block_size)
+        self.last_arrival = 0.
+
+    def __call__(self, x=1):
+        arrival = self.next_value()
+        if arrival is None:
+            return None
+        inter_arrival, self.last_arrival = arrival - self.last_arrival, arrival
+        return inter_arrival
+
+    def get_state(self) -> Dict:
+        return dict(super().get_state(), last_arrival=self.last_arrival)
+
+    def set_state(self, state: Dict):
+        super().set_state(state)
+        self.last_arrival = state['last_arrival']
+
+
+class ReplayTrace:
+    # recorded arrival times and occupation times in minutes, one float64 .npy file per route and column in a
+    # directory. The files are opened as memory maps, so a trace of any length opens instantly and is paged in
+    # while it is replayed; together with enable_streaming the memory use does not grow with the trace
+    def __init__(self, directory: str):
+        self.directory = directory
+        suffix = f'.{COLUMN_ARRIVAL}.npy'
+        self.routes = sorted(name[:-len(suffix)] for name in os.listdir(directory) if name.endswith(suffix))
+
+    @staticmethod
+    def get_path(directory: str, route: str, column: str) -> str:
+        return os.path.join(directory, f'{route}.{column}.npy')
+
+    def open(self, route: str, column: str) -> np.ndarray:
+        if route not in self.routes:
+            raise ValueError(f'no trace for route {route!r} in {self.directory}')
+        return np.load(ReplayTrace.get_path(self.directory, route, column), mmap_mode='r')
+
+    def get_arrival_generator(self, route: str, block_size: int = REPLAY_BLOCK_SIZE) -> ArrivalReplay:
+        return ArrivalReplay(self.open(route, COLUMN_ARRIVAL), block_size)
+
+    def get_service_generator(self, route: str, block_size: int = REPLAY_BLOCK_SIZE) -> ColumnReplay:
+        # trains of a route are served in arrival order, so the i-th occupation time belongs to the i-th arrival
+        return ColumnReplay(self.open(route, COLUMN_SERVICE), block_size)
+
+    @staticmethod
+    def write(directory: str, arrivals: Dict[str, np.ndarray], services: Dict[str, np.ndarray]):
+        os.makedirs(directory, exist_ok=True)
+        for route, values in arrivals.items():
+            if len(values) != len(services[route]):
+                raise ValueError(f'route {route!r} has {len(values)} arrivals and {len(services[route])} services')
+            np.save(ReplayTrace.get_path(directory, route, COLUMN_ARRIVAL), np.asarray(values, dtype=float))
+            np.save(ReplayTrace.get_path(directory, route, COLUMN_SERVICE), np.asarray(services[route], dtype=float))
+        return ReplayTrace(directory)
+
+    @staticmethod
+    def parse_time(value: str) -> float:
+        # minutes, or an ISO timestamp converted to minutes since the epoch
+        try:
+            return float(value)
+        except ValueError:
+            return datetime.fromisoformat(value).timestamp() / 60
+
+    @staticmethod
+    def from_csv(csv_path: str,
+                 directory: str,
+                 route_column: str = 'route',
+                 arrival_column: str = COLUMN_ARRIVAL,
+                 service_column: str = COLUMN_SERVICE):
+        # two streaming passes, the first counts the trains per route and finds the earliest arrival, the second
+        # writes into preallocated memory mapped .npy files; arrivals are shifted so the trace starts at minute 0
+        counts: Dict[str, int] = {}
+        origin = math.inf
+        with open(csv_path, newline='') as f:
+            for row in csv.DictReader(f):
+                counts[row[route_column]] = counts.get(row[route_column], 0) + 1
+                origin = min(origin, ReplayTrace.parse_time(row[arrival_column]))
+
+        os.makedirs(directory, exist_ok=True)
+        columns = {route: (np.lib.format.open_memmap(ReplayTrace.get_path(directory, route, COLUMN_ARRIVAL),
+                                                     mode='w+', dtype=float, shape=(count,)),
+                           np.lib.format.open_memmap(ReplayTrace.get_path(directory, route, COLUMN_SERVICE),
+                                                     mode='w+', dtype=float, shape=(count,)))
+                   for route, count in counts.items()}
+        positions = dict.fromkeys(counts, 0)
+        with open(csv_path, newline='') as f:
+            for row in csv.DictReader(f):
+                route = row[route_column]
+                arrivals, services = columns[route]
+                k = positions[route]
+                arrivals[k] = ReplayTrace.parse_time(row[arrival_column]) - origin
+                services[k] = float(row[service_column])
+                if k > 0 and arrivals[k] < arrivals[k - 1]:
+                    raise ValueError(f'arrivals of route {route!r} are not sorted in {csv_path}')
+                positions[route] = k + 1
+
+        for arrivals, services in columns.values():
+            arrivals.flush()
+            services.flush()
+        del columns
+        return ReplayTrace(directory)
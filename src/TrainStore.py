@@ -0,0 +1,199 @@
+import numpy as np
+
+from src.SimDataTypes import Train
+from typing import Dict, List, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas
+
+TRAIN_WAITING = 0
+TRAIN_IN_SERVICE = 1
+TRAIN_FINISHED = 2
+
+TRAIN_STORE_CAPACITY = 1024
+
+FLOAT_COLUMNS = ('arrival', 'service_start', 'service_length', 'end')
+COLUMNS = ('id', 'route', 'status') + FLOAT_COLUMNS
+
+
+class TrainStore:
+    # growable columnar train records in id order (ids start at 1); without keep_finished the finished trains
+    # are dropped instead of growing. The trains left by the last drop are found by id in head_rows, every later
+    # one at row = id - 1 - offset
+    def __init__(self, capacity: int = TRAIN_STORE_CAPACITY, keep_finished: bool = True):
+        self.route_names: List[str] = []
+        self.route_codes: Dict[str, int] = {}
+        self.keep_finished = keep_finished
+        self.size = 0
+        self.offset = 0
+        self.head_id = 0
+        self.head_rows: Dict[int, int] = {}
+        self.capacity = capacity
+        self.id = np.zeros(capacity, dtype=np.int64)
+        self.route = np.zeros(capacity, dtype=np.int8)
+        self.arrival = np.full(capacity, np.nan)
+        self.service_start = np.full(capacity, np.nan)
+        self.service_length = np.full(capacity, np.nan)
+        self.end = np.full(capacity, np.nan)
+        self.status = np.zeros(capacity, dtype=np.int8)
+        self.views: Dict[str, memoryview] = {}
+        self.update_views()
+
+    def update_views(self):
+        # the scalar writes of the engines go through memoryviews on the columns, they are about twice as fast
+        # as numpy item assignment; call after a column is replaced
+        self.views = {column: memoryview(getattr(self, column)) for column in COLUMNS}
+
+    def add_route(self, name: str) -> int:
+        if name not in self.route_codes:
+            self.route_codes[name] = len(self.route_names)
+            self.route_names.append(name)
+        return self.route_codes[name]
+
+    def drop_finished(self):
+        # every finished train, also behind a train that stays open, so a queue that never clears does not
+        # keep the trains of the other routes
+        open_rows = np.flatnonzero(self.status[:self.size] != TRAIN_FINISHED)
+        remaining = len(open_rows)
+        if remaining == self.size:
+            return
+        for column in COLUMNS:
+            values = getattr(self, column)
+            values[:remaining] = values[open_rows]
+            values[remaining:self.size] = np.nan if column in FLOAT_COLUMNS else 0
+        self.set_head(self.offset + self.size, remaining)
+
+    def set_head(self, last_id: int, size: int):
+        # the first size rows hold trains up to last_id by id, the next train gets row size
+        self.head_id = last_id
+        self.head_rows = {train_id: row for row, train_id in enumerate(self.id[:size].tolist())}
+        self.size = size
+        self.offset = last_id - size
+
+    def grow(self):
+        if not self.keep_finished:
+            self.drop_finished()
+            # grow anyway when little was dropped, otherwise every add would compact again
+            if self.size <= self.capacity // 2:
+                return
+        self.capacity *= 2
+        for column in ('id', 'route', 'status'):
+            values = np.zeros(self.capacity, dtype=getattr(self, column).dtype)
+            values[:self.size] = getattr(self, column)[:self.size]
+            setattr(self, column, values)
+        for column in FLOAT_COLUMNS:
+            values = np.full(self.capacity, np.nan)
+            values[:self.size] = getattr(self, column)[:self.size]
+            setattr(self, column, values)
+        self.update_views()
+
+    def add(self, route_code: int, arrival: float) -> int:
+        if self.size == self.capacity:
+            self.grow()
+        row = self.size
+        self.size += 1
+        views = self.views
+        views['id'][row] = train_id = self.offset + self.size
+        views['route'][row] = route_code
+        views['arrival'][row] = arrival
+        return train_id
+
+    def get_row(self, train_id: int) -> int:
+        return train_id - 1 - self.offset if train_id > self.head_id else self.head_rows[train_id]
+
+    def start_service(self, train_id: int, service_start: float, service_length: float):
+        row = train_id - 1 - self.offset if train_id > self.head_id else self.head_rows[train_id]
+        views = self.views
+        views['service_start'][row] = service_start
+        views['service_length'][row] = service_length
+        views['status'][row] = TRAIN_IN_SERVICE
+
+    def finish(self, train_id: int, end: float):
+        row = train_id - 1 - self.offset if train_id > self.head_id else self.head_rows[train_id]
+        views = self.views
+        views['end'][row] = end
+        views['status'][row] = TRAIN_FINISHED
+
+    def get_train(self, train_id: int) -> Train:
+        if train_id not in self:
+            raise KeyError(train_id)
+        row = self.get_row(train_id)
+        return Train(train_id,
+                     self.route_names[self.route[row]],
+                     float(self.arrival[row]),
+                     None if self.status[row] != TRAIN_FINISHED else float(self.end[row]),
+                     None if self.status[row] == TRAIN_WAITING else float(self.service_start[row]),
+                     None if self.status[row] == TRAIN_WAITING else float(self.service_length[row]),
+                     bool(self.status[row] == TRAIN_IN_SERVICE))
+
+    # read-only mapping interface, so code written against Dict[int, Train] keeps working
+    def __getitem__(self, train_id: int) -> Train:
+        return self.get_train(train_id)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, train_id):
+        if not isinstance(train_id, (int, np.integer)):
+            return False
+        if train_id <= self.head_id:
+            return train_id in self.head_rows
+        return self.offset < train_id <= self.offset + self.size
+
+    def keys(self):
+        if not self.head_rows:
+            return range(self.offset + 1, self.offset + self.size + 1)
+        return self.id[:self.size].tolist()
+
+    def values(self):
+        return (self.get_train(train_id) for train_id in self.keys())
+
+    def items(self):
+        return ((train_id, self.get_train(train_id)) for train_id in self.keys())
+
+    def get_rows(self, route_code: int = None, status: int = None) -> np.ndarray:
+        mask = np.ones(self.size, dtype=bool)
+        if route_code is not None:
+            mask &= self.route[:self.size] == route_code
+        if status is not None:
+            mask &= self.status[:self.size] == status
+        return np.flatnonzero(mask)
+
+    def to_numpy(self) -> Dict[str, np.ndarray]:
+        # views on the live buffers, valid until the next add grows the store
+        return {'id': self.id[:self.size],
+                'route': self.route[:self.size],
+                'arrival': self.arrival[:self.size],
+                'service_start': self.service_start[:self.size],
+                'service_length': self.service_length[:self.size],
+                'end': self.end[:self.size],
+                'status': self.status[:self.size]}
+
+    def to_dataframe(self) -> 'pandas.DataFrame':
+        import pandas
+        columns = self.to_numpy()
+        columns['route'] = pandas.Categorical.from_codes(columns['route'], self.route_names)
+        return pandas.DataFrame(columns, copy=False)
+
+    def save_npz(self, path: str):
+        np.savez(path, route_names=np.array(self.route_names), **self.to_numpy())
+
+    @staticmethod
+    def load_npz(path: str):
+        data = np.load(path)
+        store = TrainStore(max(1, len(data['id'])))
+        for name in data['route_names'].tolist():
+            store.add_route(name)
+        size = len(data['id'])
+        for column in COLUMNS:
+            getattr(store, column)[:size] = data[column]
+        store.size = size
+        if size and data['id'][-1] - data['id'][0] != size - 1:
+            # saved after finished trains were dropped in between
+            store.set_head(int(data['id'][-1]), size)
+        else:
+            store.offset = int(data['id'][0]) - 1 if size else 0
+        return store